@@ -0,0 +1,159 @@
+import asyncio
+import random
+import signal
+import time
+import weakref
+from channels.middleware import BaseMiddleware
+from django.conf import settings
+from coverence import metrics
+from .protocol import negotiate
+
+# Connection churn control for a worker. Opening a socket is the expensive
+# part of its life (token check, user lookup, room lookup, history and digest
+# queries), so handshakes run at most CHAT_MAX_HANDSHAKES at a time with the
+# rest queued. A draining worker turns new sockets away and closes its open
+# ones spread over CHAT_DRAIN_WINDOW, each with a "reconnect" frame carrying a
+# random delay, so its clients come back to the other workers gradually
+# rather than all at once.
+RECONNECT_CLOSE_CODE = 1012  # Service Restart
+TRY_AGAIN_CLOSE_CODE = 1013  # Try Again Later
+
+
+def reconnect_delay():
+    return random.randint(settings.CHAT_RECONNECT_MIN_MS, settings.CHAT_RECONNECT_MAX_MS)
+
+
+class HandshakeGate:
+    def __init__(self, limit, queue_size, queue_timeout):
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.waiting = 0
+        self.peak = 0
+        self._slots = asyncio.Semaphore(limit)
+
+        metrics.register_gauge("chat.handshakes.in_flight", lambda: self.in_flight)
+        metrics.register_gauge("chat.handshakes.waiting", lambda: self.waiting)
+        metrics.register_gauge("chat.handshakes.peak", lambda: self.peak)
+
+    async def admit(self):
+        """
+        Waits for a handshake slot. Returns a function releasing it (safe to
+        call more than once), or None if the queue is full or the wait timed
+        out.
+        """
+        if self._slots.locked():
+            if self.waiting >= self.queue_size:
+                metrics.incr("chat.handshakes.rejected")
+                return None
+            metrics.incr("chat.handshakes.queued")
+
+        start = time.monotonic()
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            metrics.incr("chat.handshakes.rejected")
+            return None
+        finally:
+            self.waiting -= 1
+            metrics.incr("chat.handshakes.queue_ms", int((time.monotonic() - start) * 1000))
+
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        metrics.incr("chat.handshakes.admitted")
+        released = False
+
+        def release():
+            nonlocal released
+            if not released:
+                released = True
+                self.in_flight -= 1
+                self._slots.release()
+
+        return release
+
+
+class Drainer:
+    def __init__(self):
+        self.draining = False
+        self.sockets = weakref.WeakSet()
+        self._loops = weakref.WeakSet()
+        self._closing = set()
+
+    def install(self):
+        """Drains the worker on CHAT_DRAIN_SIGNAL; called once the event loop runs."""
+        loop = asyncio.get_running_loop()
+        if loop in self._loops:
+            return
+        self._loops.add(loop)
+        try:
+            loop.add_signal_handler(getattr(signal, settings.CHAT_DRAIN_SIGNAL), self.start)
+        except (AttributeError, NotImplementedError, RuntimeError, ValueError):
+            # No such signal on this platform, or not the main thread's loop.
+            pass
+
+    def start(self):
+        asyncio.ensure_future(self.drain())
+
+    async def drain(self, window=None):
+        if self.draining:
+            return
+        self.draining = True
+        window = settings.CHAT_DRAIN_WINDOW if window is None else window
+
+        sockets = list(self.sockets)
+        random.shuffle(sockets)
+        for index, consumer in enumerate(sockets):
+            if index:
+                await asyncio.sleep(window / len(sockets))
+            self.close(consumer)
+        # Sockets whose handshake was already admitted when draining began.
+        for consumer in list(self.sockets):
+            self.close(consumer)
+
+    def close(self, consumer):
+        self.sockets.discard(consumer)
+        task = asyncio.ensure_future(consumer.drain(reconnect_delay()))
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+        metrics.incr("chat.sockets.drained")
+
+
+handshake_gate = HandshakeGate(
+    settings.CHAT_MAX_HANDSHAKES, settings.CHAT_HANDSHAKE_QUEUE_SIZE, settings.CHAT_HANDSHAKE_QUEUE_TIMEOUT
+)
+drainer = Drainer()
+
+
+async def turn_away(scope, receive, send, close_code):
+    """Completes the handshake only to send a reconnect hint and close."""
+    await receive()
+    codec = negotiate(scope.get("subprotocols"))
+    await send({"type": "websocket.accept", "subprotocol": codec.subprotocol})
+    data = codec.encode({"type": "reconnect", "after_ms": reconnect_delay()})
+    await send({"type": "websocket.send", ("bytes" if codec.binary else "text"): data})
+    await send({"type": "websocket.close", "code": close_code})
+
+
+class AdmissionMiddleware(BaseMiddleware):
+    """
+    Outermost websocket middleware: turns sockets away while draining, and
+    holds a handshake slot from before authentication until the consumer's
+    connect() has finished (the consumer releases it through
+    scope["handshake_release"]).
+    """
+
+    async def __call__(self, scope, receive, send):
+        drainer.install()
+        if drainer.draining:
+            metrics.incr("chat.handshakes.drained")
+            return await turn_away(scope, receive, send, RECONNECT_CLOSE_CODE)
+
+        release = await handshake_gate.admit()
+        if release is None:
+            return await turn_away(scope, receive, send, TRY_AGAIN_CLOSE_CODE)
+        try:
+            return await super().__call__(dict(scope, handshake_release=release), receive, send)
+        finally:
+            release()
@@ -0,0 +1,131 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db.models import Count, OuterRef, Q, Subquery
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+from users.async_views import AsyncAPIView
+from users.avatars import absolute_url
+from users.cards import aget_user_cards
+from .export import accepts_gzip, export_messages
+from .models import ChatRoom, Message
+from coverence.db_pool import pool
+from coverence.db_router import replica_reads, use_replica
+from coverence.single_flight import request_key
+from .cache import recent_chats_flight
+from .serializers import MessageValuesSerializer
+
+
+class AsyncChatMessageHistoryView(AsyncAPIView):
+    @replica_reads
+    async def get(self, request, receiver_id):
+        if not await User.objects.filter(id=receiver_id).aexists():
+            return JsonResponse({"error": "User not found"}, status=404)
+
+        user_ids = sorted([request.user.id, receiver_id])
+        try:
+            room = await ChatRoom.objects.aget(user1_id=user_ids[0], user2_id=user_ids[1])
+        except ChatRoom.DoesNotExist:
+            return JsonResponse([], safe=False)  # No messages yet
+
+        messages = Message.objects.filter(room=room).order_by("timestamp")
+        return JsonResponse(await MessageValuesSerializer().aserialize(messages), safe=False)
+
+
+class AsyncRecentChatsView(AsyncAPIView):
+    async def get(self, request):
+        return JsonResponse(await recent_chats_flight.arun(request_key(request), lambda: self.shared_build(request)))
+
+    async def shared_build(self, request):
+        # Shared with concurrent identical requests and run outside this
+        # one's context, so it takes its own checkout and replica routing.
+        async with pool.adetached_checkout():
+            with use_replica(request.user.id):
+                return await self.build(request)
+
+    async def build(self, request):
+        user_id = request.user.id
+        last_message = Message.objects.filter(room=OuterRef("pk")).order_by("-timestamp")
+        rooms = [
+            room
+            async for room in ChatRoom.objects.filter(Q(user1_id=user_id) | Q(user2_id=user_id)).annotate(
+                last_content=Subquery(last_message.values("content")[:1]),
+                last_timestamp=Subquery(last_message.values("timestamp")[:1]),
+                # Messages in a room are sent by one of its two members, so
+                # "not sent by me" means "sent by the other user".
+                unseen_count=Count(
+                    "messages",
+                    filter=Q(messages__is_seen=False) & ~Q(messages__sender_id=user_id),
+                ),
+            )
+        ]
+        cards = await aget_user_cards([room.user2_id if room.user1_id == user_id else room.user1_id for room in rooms])
+
+        chat_data = []
+
+        for room in rooms:
+            other_user_id = room.user2_id if room.user1_id == user_id else room.user1_id
+            if other_user_id not in cards:
+                continue
+
+            user_info = cards[other_user_id]
+
+            chat_data.append({
+                **user_info,
+                "profile_image": absolute_url(user_info["profile_image"], request),
+                "last_message": {
+                    "content": room.last_content or "",
+                    "timestamp": room.last_timestamp.isoformat() if room.last_timestamp else ""
+                },
+                "unseen_count": room.unseen_count
+            })
+
+        # Sort by latest message timestamp
+        chat_data.sort(key=lambda x: x['last_message']['timestamp'], reverse=True)
+
+        return {
+            "chats": chat_data,
+            "total_unseen_messages": sum(chat["unseen_count"] for chat in chat_data),
+        }
+
+
+class AsyncMessageExportView(AsyncAPIView):
+    """
+    Streams a conversation (with ``receiver_id``) or every message of the
+    user as NDJSON, ordered by id. ``?after=<id>`` resumes an interrupted
+    export; clients that accept gzip get a gzip-encoded stream.
+
+    Only an async view can stream under ASGI: Django buffers a synchronous
+    iterator into a list before sending it.
+    """
+
+    @replica_reads
+    async def get(self, request, receiver_id=None):
+        try:
+            after = int(request.GET.get("after", 0))
+        except ValueError:
+            return JsonResponse({"error": "after must be a message id"}, status=400)
+
+        user_id = request.user.id
+        if receiver_id is None:
+            messages = Message.objects.filter(Q(room__user1_id=user_id) | Q(room__user2_id=user_id))
+        else:
+            if not await User.objects.filter(id=receiver_id).aexists():
+                return JsonResponse({"error": "User not found"}, status=404)
+            user_ids = sorted([user_id, receiver_id])
+            messages = Message.objects.filter(room__user1_id=user_ids[0], room__user2_id=user_ids[1])
+
+        messages = messages.filter(id__gt=after).order_by("id")
+        # Rows are read after this method returns, outside replica_reads, so
+        # pin the alias it picked.
+        messages = messages.using(messages.db)
+
+        compress = accepts_gzip(request.headers.get("Accept-Encoding", ""))
+        response = StreamingHttpResponse(
+            export_messages(messages, compress, settings.CHAT_EXPORT_CHUNK_SIZE),
+            content_type="application/x-ndjson",
+        )
+        if compress:
+            response["Content-Encoding"] = "gzip"
+        patch_vary_headers(response, ["Accept-Encoding"])
+        response["Content-Disposition"] = 'attachment; filename="messages.ndjson"'
+        return response
@@ -0,0 +1,41 @@
+from django.conf import settings
+from django.db import transaction
+from coverence.lru import LRUCache
+from coverence.single_flight import SingleFlight
+from users.changes import ROOM, record_changes
+from .models import ChatRoom
+
+# Room membership never changes, so sorted user pair -> room id can be cached
+# for the lifetime of the worker.
+room_cache = LRUCache("chat_rooms", settings.CHAT_ROOM_CACHE_SIZE)
+
+# Shared by the sync and async recent chats views.
+recent_chats_flight = SingleFlight("recent_chats", settings.SINGLE_FLIGHT_TTL)
+
+
+def room_key(user_a_id, user_b_id):
+    user_a_id, user_b_id = int(user_a_id), int(user_b_id)
+    return (user_a_id, user_b_id) if user_a_id < user_b_id else (user_b_id, user_a_id)
+
+
+def get_room_id(user_a_id, user_b_id):
+    key = room_key(user_a_id, user_b_id)
+    room_id = room_cache.get(key)
+    if room_id is None:
+        room_id = ChatRoom.objects.filter(user1_id=key[0], user2_id=key[1]).values_list("id", flat=True).first()
+        if room_id is not None:
+            room_cache.set(key, room_id)
+    return room_id
+
+
+def get_or_create_room_id(user_a_id, user_b_id):
+    room_id = get_room_id(user_a_id, user_b_id)
+    if room_id is None:
+        key = room_key(user_a_id, user_b_id)
+        with transaction.atomic():
+            room, created = ChatRoom.objects.get_or_create(user1_id=key[0], user2_id=key[1])
+            if created:
+                record_changes([(key[0], ROOM, room.id), (key[1], ROOM, room.id)])
+        room_id = room.id
+        room_cache.set(key, room_id)
+    return room_id
@@ -1,213 +1,401 @@
-import json
+import asyncio
+import logging
+from channels.exceptions import StopConsumer
 from channels.generic.websocket import AsyncWebsocketConsumer
-from channels.db import database_sync_to_async
-from django.contrib.auth import get_user_model
+from coverence.db_pool import PoolTimeout, database_sync_to_async
+from coverence.db_router import use_replica, mark_write
+from django.conf import settings
+from django.db import transaction
 from django.utils.timezone import now
-from .models import Message, ChatRoom
+from coverence import metrics
+from .models import Message
+from .search import index_messages
+from . import presence
 from users.models import UserActivity 
+from .protocol import FrameError, negotiate
+from .typing import typing_coalescer
+from .throttling import ConnectionThrottle, classify
+from .cache import get_or_create_room_id
+from .admission import RECONNECT_CLOSE_CODE, TRY_AGAIN_CLOSE_CODE, drainer
+from users.cards import card_cache, get_user_card, display_name
+from users.changes import MESSAGE, ROOM, record_changes
+
+logger = logging.getLogger(__name__)
+
+class CodecWebsocketConsumer(AsyncWebsocketConsumer):
+    """
+    Websocket consumer that speaks JSON or a negotiated compact encoding.
+
+    Inbound frames pass through per-connection and per-user token buckets, and
+    outbound frames go through a bounded queue so a slow reader cannot pile up
+    unbounded work on the worker. The queue and its writer task only exist
+    while there are frames to send, so idle sockets hold neither. Accepted
+    sockets are registered with the worker's drainer, which may ask them to
+    reconnect elsewhere. When the database pool has no connection to spare,
+    the handshake is turned away with Try Again Later and a frame in flight
+    is answered with an error, rather than the exception killing the socket.
+    """
+
+    codec = negotiate(None)
+    outbox = None
+    writer = None
+
+    async def dispatch(self, message):
+        try:
+            await super().dispatch(message)
+        except PoolTimeout:
+            metrics.incr("chat.db_pool_timeouts")
+            if message["type"] == "websocket.connect":
+                await self.close(code=TRY_AGAIN_CLOSE_CODE)
+            elif message["type"] == "websocket.receive":
+                await self.send_event({"type": "error", "code": "unavailable"})
+            elif message["type"] == "websocket.disconnect":
+                raise StopConsumer()
+
+    async def websocket_connect(self, message):
+        try:
+            await super().websocket_connect(message)
+        finally:
+            # The handshake slot taken by AdmissionMiddleware.
+            release = self.scope.get("handshake_release")
+            if release:
+                release()
+
+    async def accept_with_codec(self):
+        self.codec = negotiate(self.scope.get("subprotocols"))
+        self.throttle = ConnectionThrottle(self.scope["user"].id)
+        await self.accept(subprotocol=self.codec.subprotocol)
+        drainer.sockets.add(self)
+
+    async def send_event(self, payload):
+        if self.outbox is None:
+            self.outbox = asyncio.Queue(maxsize=settings.CHAT_SEND_QUEUE_SIZE)
+            self.writer = asyncio.ensure_future(self.drain_outbox(self.outbox))
+        try:
+            self.outbox.put_nowait(payload)
+        except asyncio.QueueFull:
+            if settings.CHAT_SLOW_CONSUMER_POLICY == "disconnect":
+                metrics.incr("chat.outbound.disconnected")
+                await self.close(code=4008)
+            else:
+                metrics.incr("chat.outbound.dropped")
+
+    async def drain_outbox(self, outbox):
+        try:
+            while not outbox.empty():
+                payload = outbox.get_nowait()
+                data = self.codec.encode(payload)
+                if self.codec.binary:
+                    await self.send(bytes_data=data)
+                else:
+                    await self.send(text_data=data)
+                outbox.task_done()
+        except Exception:
+            # Whatever is left in the queue is lost with the socket.
+            logger.exception("Failed to send to socket %s", self.channel_name)
+            metrics.incr("chat.outbound.failed")
+            try:
+                await self.close(code=1011)
+            except Exception:
+                pass
+        finally:
+            # The next frame starts a new queue and writer.
+            self.outbox = self.writer = None
+
+    async def drain(self, after_ms):
+        """Tells the client to reconnect after ``after_ms`` and closes the socket."""
+        await self.send_event({"type": "reconnect", "after_ms": after_ms})
+        if self.outbox is not None:
+            try:
+                await asyncio.wait_for(self.outbox.join(), 1)
+            except asyncio.TimeoutError:
+                pass
+        await self.close(code=RECONNECT_CLOSE_CODE)
+
+    async def websocket_disconnect(self, message):
+        drainer.sockets.discard(self)
+        if self.writer:
+            self.writer.cancel()
+        await super().websocket_disconnect(message)
+
+    async def receive(self, text_data=None, bytes_data=None):
+        try:
+            data = self.codec.decode(text_data if text_data is not None else bytes_data)
+        except FrameError:
+            metrics.incr("chat.bad_frames")
+            if self.throttle.allow("default"):
+                await self.send_event({"type": "error", "code": "bad_frame"})
+            return
+        event = classify(data)
+        if not self.throttle.allow(event):
+            if event == "message":
+                await self.send_event({"type": "error", "code": "rate_limited"})
+            return
+        await self.receive_event(data)
 
-User = get_user_model()
+    async def receive_event(self, data):
+        pass
 
-# Global set to track online users
-online_users = set()
 
-class ChatConsumer(AsyncWebsocketConsumer):
+class ChatState:
+    """What a chat socket keeps between frames; models are loaded when needed."""
+
+    __slots__ = ("user_id", "display_name", "receiver_id", "room_id", "group_name")
+
+    def __init__(self, user_id, display_name, receiver_id, room_id):
+        self.user_id = user_id
+        self.display_name = display_name
+        self.receiver_id = receiver_id
+        self.room_id = room_id
+        self.group_name = f"chat_{room_id}"
+
+
+class ChatConsumer(CodecWebsocketConsumer):
+    state = None
+
     async def connect(self):
-        self.sender = self.scope["user"]
-        self.receiver_id = self.scope['url_route']['kwargs']['receiver_id']
-        self.room_group_name = None
+        user = self.scope["user"]
+        receiver_id = int(self.scope['url_route']['kwargs']['receiver_id'])
 
-        if not self.sender.is_authenticated:
+        if not user.is_authenticated:
             await self.close()
             return
 
-        self.receiver = await self.get_user(self.receiver_id)
-        self.room = await self.get_or_create_chatroom(self.sender, self.receiver)
-        self.room_group_name = f"chat_{self.room.id}"
+        if await self.get_user_card(receiver_id) is None:
+            await self.close()
+            return
 
-        await self.channel_layer.group_add(self.room_group_name, self.channel_name)
+        sender_card = await self.get_user_card(user.id)
+        room_id = await self.get_or_create_chatroom(user.id, receiver_id)
+        self.state = state = ChatState(user.id, display_name(sender_card), receiver_id, room_id)
+
+        await self.channel_layer.group_add(state.group_name, self.channel_name)
         await self.channel_layer.group_add("user_status", self.channel_name)
-        await self.accept()
+        await self.accept_with_codec()
 
         # Check if receiver is online
-        if self.receiver.id in online_users:
-            await self.send(text_data=json.dumps({
+        if await presence.is_online(receiver_id):
+            await self.send_event({
                 "type": "status",
-                "user_id": self.receiver.id,
+                "user_id": receiver_id,
                 "status": "online",
                 "last_seen": None
-            }))
+            })
         else:
-            last_seen = await self.get_last_seen(self.receiver)
-            await self.send(text_data=json.dumps({
+            last_seen = await self.get_last_seen(receiver_id)
+            await self.send_event({
                 "type": "status",
-                "user_id": self.receiver.id,
+                "user_id": receiver_id,
                 "status": "offline",
                 "last_seen": last_seen.isoformat() if last_seen else None
-            }))
+            })
 
     async def disconnect(self, close_code):
-        if self.room_group_name:
-            await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
+        if self.state:
+            await typing_coalescer.clear(
+                (self.state.group_name, self.state.user_id), self.channel_name, self.publish_typing
+            )
+            await self.channel_layer.group_discard(self.state.group_name, self.channel_name)
         await self.channel_layer.group_discard("user_status", self.channel_name)
 
-    async def receive(self, text_data):
-        data = json.loads(text_data)
-
+    async def receive_event(self, data):
+        state = self.state
         if "typing" in data:
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    "type": "typing_status",
-                    "sender_id": self.sender.id,
-                    "typing": data["typing"],
-                }
+            await typing_coalescer.update(
+                (state.group_name, state.user_id), self.channel_name, bool(data["typing"]), self.publish_typing
             )
             return
 
         message = data.get("message")
         if message:
-            await self.save_message(self.room, self.sender, message)
+            await self.save_message(state.room_id, state.user_id, state.receiver_id, message)
+            await self.refresh_display_name()
+            await typing_coalescer.clear((state.group_name, state.user_id), self.channel_name, self.publish_typing)
 
             await self.channel_layer.group_send(
-                self.room_group_name,
+                state.group_name,
                 {
                     "type": "chat_message",
                     "message": message,
-                    "sender_id": self.sender.id,
-                    "receiver_id": self.receiver.id,
-                    "sender": f"{self.sender.first_name} {self.sender.last_name}",
+                    "sender_id": state.user_id,
+                    "receiver_id": state.receiver_id,
+                    "sender": state.display_name,
                 }
             )
 
-            await self.channel_layer.group_send(
-                f"notifications_{self.receiver.id}",
+            await presence.notify(
+                self.channel_layer,
+                state.receiver_id,
                 {
                     "type": "new_message_notification",
-                    "sender_id": self.sender.id,
-                    "sender_name": f"{self.sender.first_name} {self.sender.last_name}",
+                    "sender_id": state.user_id,
+                    "sender_name": state.display_name,
                     "message": message,
                 }
             )
 
+    async def refresh_display_name(self):
+        # Cards expire from the cache, so a rename reaches open sockets too.
+        card = card_cache.get(self.state.user_id) or await self.get_user_card(self.state.user_id)
+        if card:
+            self.state.display_name = display_name(card)
+
+    async def publish_typing(self, typing):
+        await self.channel_layer.group_send(
+            self.state.group_name,
+            {
+                "type": "typing_status",
+                "sender_id": self.state.user_id,
+                "typing": typing,
+            }
+        )
+
     async def chat_message(self, event):
-        await self.send(text_data=json.dumps({
+        await self.send_event({
             "type": "chat",
             "message": event["message"],
             "sender_id": event["sender_id"],
             "receiver_id": event["receiver_id"],
             "sender": event["sender"],
-        }))
+        })
 
     async def typing_status(self, event):
-        await self.send(text_data=json.dumps({
+        await self.send_event({
             "type": "typing",
             "sender_id": event["sender_id"],
             "typing": event["typing"],
-        }))
+        })
 
     async def status_update(self, event):
         # Only notify if status is about the receiver of this chat
-        if str(event["user_id"]) == str(self.receiver.id):
+        if str(event["user_id"]) == str(self.state.receiver_id):
             if event["status"] == "offline":
-                last_seen = await self.get_last_seen(self.receiver)
-                await self.send(text_data=json.dumps({
+                last_seen = await self.get_last_seen(self.state.receiver_id)
+                await self.send_event({
                     "type": "status",
                     "user_id": event["user_id"],
                     "status": "offline",
                     "last_seen": last_seen.isoformat() if last_seen else None
-                }))
+                })
             else:
-                await self.send(text_data=json.dumps({
+                await self.send_event({
                     "type": "status",
                     "user_id": event["user_id"],
                     "status": "online",
                     "last_seen": None
-                }))
+                })
 
     @database_sync_to_async
-    def get_user(self, user_id):
-        return User.objects.get(id=user_id)
+    def get_user_card(self, user_id):
+        return get_user_card(user_id)
 
     @database_sync_to_async
-    def get_or_create_chatroom(self, user1, user2):
-        if user1.id > user2.id:
-            user1, user2 = user2, user1
-        room, _ = ChatRoom.objects.get_or_create(user1=user1, user2=user2)
-        return room
+    def get_or_create_chatroom(self, user1_id, user2_id):
+        return get_or_create_room_id(user1_id, user2_id)
 
     @database_sync_to_async
-    def save_message(self, room, sender, content):
-        return Message.objects.create(room=room, sender=sender, content=content)
+    def save_message(self, room_id, sender_id, receiver_id, content):
+        mark_write(sender_id)
+        with transaction.atomic():
+            message = Message.objects.create(room_id=room_id, sender_id=sender_id, content=content)
+            index_messages([(message.id, room_id, content)], replace=False)
+            record_changes([
+                (user_id, kind, key)
+                for user_id in (sender_id, receiver_id)
+                for kind, key in ((ROOM, room_id), (MESSAGE, message.id))
+            ])
+        return message
 
     @database_sync_to_async
-    def get_last_seen(self, user):
+    def get_last_seen(self, user_id):
         try:
-            return UserActivity.objects.get(user=user).last_seen
+            with use_replica():
+                return UserActivity.objects.get(user_id=user_id).last_seen
         except UserActivity.DoesNotExist:
             return None
 
 
 
-class NotificationConsumer(AsyncWebsocketConsumer):
+class NotificationConsumer(CodecWebsocketConsumer):
+    user_id = None
+
     async def connect(self):
-        self.user = self.scope["user"]
-        if not self.user.is_authenticated:
+        user = self.scope["user"]
+        if not user.is_authenticated:
             await self.close()
             return
 
-        self.group_name = f"notifications_{self.user.id}"
+        self.user_id = user.id
+        self.group_name = f"notifications_{self.user_id}"
         await self.channel_layer.group_add(self.group_name, self.channel_name)
         await self.channel_layer.group_add("user_status", self.channel_name)
 
-        online_users.add(self.user.id)
-        await self.accept()
+        await presence.connected(self.user_id)
+        self.presence_refresher = asyncio.ensure_future(self.refresh_presence())
+        await self.accept_with_codec()
+
+        # Whatever arrived while the user was offline, in one frame.
+        digest = await self.get_pending_digest(self.user_id)
+        if digest["senders"]:
+            await self.send_event({"type": "digest", **digest})
 
         await self.channel_layer.group_send(
             "user_status",
             {
                 "type": "status_update",
-                "user_id": self.user.id,
+                "user_id": self.user_id,
                 "status": "online"
             }
         )
 
     async def disconnect(self, close_code):
+        if self.user_id is None:
+            return
         await self.channel_layer.group_discard(self.group_name, self.channel_name)
         await self.channel_layer.group_discard("user_status", self.channel_name)
 
-        online_users.discard(self.user.id)
-        await self.update_last_seen(self.user)
+        self.presence_refresher.cancel()
+        await presence.disconnected(self.user_id)
+        await self.update_last_seen(self.user_id)
 
         await self.channel_layer.group_send(
             "user_status",
             {
                 "type": "status_update",
-                "user_id": self.user.id,
+                "user_id": self.user_id,
                 "status": "offline"
             }
         )
 
+    async def refresh_presence(self):
+        while True:
+            await asyncio.sleep(settings.CHAT_PRESENCE_TTL / 3)
+            await presence.refresh(self.user_id)
+
     async def new_message_notification(self, event):
-        await self.send(text_data=json.dumps({
+        await self.send_event({
             "type": "new_message",
             "sender_id": event["sender_id"],
             "sender_name": event["sender_name"],
             "message": event["message"],
-        }))
+        })
 
     async def status_update(self, event):
-        await self.send(text_data=json.dumps({
+        await self.send_event({
             "type": "status",
             "user_id": event["user_id"],
             "status": event["status"]
-        }))
+        })
+
+    @database_sync_to_async
+    def get_pending_digest(self, user_id):
+        return presence.pending_digest(user_id)
 
     @database_sync_to_async
-    def update_last_seen(self, user):
+    def update_last_seen(self, user_id):
         try:
-            activity = UserActivity.objects.get(user=user)
+            activity = UserActivity.objects.get(user_id=user_id)
             activity.last_seen = now()
             activity.save()
         except UserActivity.DoesNotExist:
-            UserActivity.objects.create(user=user, last_seen=now())
+            UserActivity.objects.create(user_id=user_id, last_seen=now())
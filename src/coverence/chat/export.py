@@ -0,0 +1,89 @@
+import json
+import zlib
+from itertools import islice
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from coverence.db_pool import pool
+from .serializers import MessageValuesSerializer
+
+
+class MessageExportSerializer(MessageValuesSerializer):
+    fields = {"id": "id", "room_id": "room_id", **MessageValuesSerializer.fields}
+
+
+class NDJSONWriter:
+    """
+    Turns batches of rows into NDJSON bytes, optionally as one gzip stream.
+
+    Each batch is sync-flushed so everything received so far decompresses
+    even if the download is cut off; the client then resumes after the last
+    complete line's id.
+    """
+
+    def __init__(self, compress=False):
+        self.compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS) if compress else None
+
+    def write(self, rows):
+        data = "".join(json.dumps(row, cls=DjangoJSONEncoder) + "\n" for row in rows).encode()
+        if self.compressor is None:
+            return data
+        return self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def close(self):
+        return self.compressor.flush() if self.compressor is not None else b""
+
+
+def accepts_gzip(accept_encoding):
+    """
+    Whether an Accept-Encoding header allows gzip: listed (or covered by "*")
+    with a non-zero q-value.
+    """
+    qvalues = {}
+    for item in accept_encoding.split(","):
+        coding, *params = (part.strip() for part in item.split(";"))
+        if not coding:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        qvalues[coding.lower()] = q
+    for coding in ("gzip", "x-gzip", "*"):
+        if coding in qvalues:
+            return qvalues[coding] > 0
+    return False
+
+
+def _next_chunk(rows, chunk_size):
+    return list(islice(rows, chunk_size))
+
+
+async def export_messages(messages, compress, chunk_size):
+    """
+    Streams ``messages`` as NDJSON, ``chunk_size`` rows per chunk.
+
+    Rows come from a server-side cursor and are written out a chunk at a
+    time, so memory stays flat however long the history is. The stream
+    outlives the request's pool checkout, so it holds its own.
+    """
+    serializer = MessageExportSerializer()
+    writer = NDJSONWriter(compress)
+    # QuerySet.aiterator() would run a values_list() query on the event loop,
+    # so the cursor is advanced in the sync thread explicitly.
+    rows = messages.values_list(*serializer.columns).iterator(chunk_size=chunk_size)
+
+    async with pool.acheckout():
+        while True:
+            chunk = await sync_to_async(_next_chunk)(rows, chunk_size)
+            if chunk:
+                yield writer.write([serializer.to_representation(row) for row in chunk])
+            if len(chunk) < chunk_size:
+                break
+
+    tail = writer.close()
+    if tail:
+        yield tail
@@ -0,0 +1,90 @@
+import asyncio
+import statistics
+import time
+from channels_redis.core import RedisChannelLayer
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from coverence.channel_layers import HybridChannelLayer, ShardedChannelLayer
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures group_send throughput and delivery latency of the plain Redis, hybrid and sharded "
+        "channel layers, with chat groups on one worker or spread over several (each worker is "
+        "a separate layer instance). Uses the Redis hosts in CHANNEL_LAYERS unless --hosts is given."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, nargs="+", default=[1, 4])
+        parser.add_argument("--groups", type=int, default=50)
+        parser.add_argument("--members", type=int, default=2, help="Sockets per group")
+        parser.add_argument("--messages", type=int, default=2000)
+        parser.add_argument("--hosts", nargs="+", help="Redis URLs to use")
+
+    def handle(self, *args, **options):
+        if options["hosts"]:
+            hosts = options["hosts"]
+        else:
+            hosts = settings.CHANNEL_LAYERS["default"]["CONFIG"]["hosts"]
+
+        for workers in options["workers"]:
+            for layer_class in (RedisChannelLayer, HybridChannelLayer, ShardedChannelLayer):
+                result = asyncio.run(self.run(layer_class, hosts, workers, options))
+                self.stdout.write(
+                    f"{workers} worker(s) {layer_class.__name__:<19} {result['rate']:>8.0f} deliveries/s, "
+                    f"latency p50 {result['p50']:.2f} ms, p99 {result['p99']:.2f} ms"
+                )
+
+    async def run(self, layer_class, hosts, workers, options):
+        layers = [layer_class(hosts=hosts, prefix="bench") for _ in range(workers)]
+        await layers[0].flush()
+
+        # Members of a group are spread round-robin over the workers, so with
+        # one worker every delivery is local and with N, (N-1)/N are remote.
+        groups = [f"bench_{i}" for i in range(options["groups"])]
+        sockets = []
+        for i, group in enumerate(groups):
+            for member in range(options["members"]):
+                layer = layers[(i + member) % workers]
+                channel = await layer.new_channel()
+                await layer.group_add(group, channel)
+                sockets.append((layer, channel))
+
+        expected = options["messages"] * options["members"]
+        latencies = []
+        done = asyncio.Event()
+
+        async def reader(layer, channel):
+            while True:
+                message = await layer.receive(channel)
+                latencies.append((time.perf_counter() - message["sent"]) * 1000)
+                if len(latencies) == expected:
+                    done.set()
+
+        readers = [asyncio.ensure_future(reader(layer, channel)) for layer, channel in sockets]
+        start = time.perf_counter()
+        for i in range(options["messages"]):
+            group = groups[i % len(groups)]
+            sender = layers[i % workers]
+            await sender.group_send(group, {"type": "chat.message", "message": "hi", "sent": time.perf_counter()})
+        try:
+            await asyncio.wait_for(done.wait(), 60)
+        except asyncio.TimeoutError:
+            raise CommandError(f"Only {len(latencies)} of {expected} messages were delivered")
+        elapsed = time.perf_counter() - start
+
+        for task in readers:
+            task.cancel()
+        await asyncio.gather(*readers, return_exceptions=True)
+        if len(latencies) != expected:
+            raise CommandError(f"{len(latencies)} deliveries for {expected} expected")
+        await layers[0].flush()
+        for layer in layers:
+            await layer.close_pools()
+
+        latencies.sort()
+        return {
+            "rate": expected / elapsed,
+            "p50": statistics.median(latencies),
+            "p99": latencies[int(len(latencies) * 0.99) - 1],
+        }
@@ -0,0 +1,101 @@
+import asyncio
+import random
+import time
+from channels.layers import InMemoryChannelLayer
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from chat import presence
+
+# Redis commands behind each call with the production backends: Django's
+# RedisCache (incr checks EXISTS first) and channels_redis, whose group_send
+# runs ZREMRANGEBYSCORE + ZRANGE on the group, then per shard holding members
+# a ZREMRANGEBYSCORE per channel and an EVAL that queues the message.
+CACHE_COMMANDS = {"aget": 1, "aset": 1, "aincr": 2, "adecr": 2, "atouch": 1, "adelete": 1}
+
+
+def group_send_commands(members):
+    return 2 + (members + 1 if members else 0)
+
+
+class CountingLayer(InMemoryChannelLayer):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.commands = 0
+
+    async def group_send(self, group, message):
+        self.commands += group_send_commands(len(self.groups.get(group, {})))
+        await super().group_send(group, message)
+
+
+class Command(BaseCommand):
+    help = (
+        "Counts Redis commands per chat notification when most recipients are offline, "
+        "publishing to every recipient versus presence-aware delivery."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--recipients", type=int, default=1000)
+        parser.add_argument("--messages", type=int, default=10000)
+        parser.add_argument("--online", type=float, default=0.1, help="Fraction of recipients online")
+        parser.add_argument("--local", type=float, default=0.2, help="Fraction of online recipients on this worker")
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        asyncio.run(self.run(options))
+
+    async def run(self, options):
+        rng = random.Random(options["seed"])
+        # Ids far above real users so the presence keys cannot collide.
+        recipients = list(range(10_000_000, 10_000_000 + options["recipients"]))
+        online = rng.sample(recipients, int(len(recipients) * options["online"]))
+        local = online[:int(len(online) * options["local"])]
+        targets = [rng.choice(recipients) for _ in range(options["messages"])]
+        event = {"type": "new_message_notification", "sender_id": 1, "sender_name": "Ada", "message": "hi"}
+
+        calls = {}
+        originals = {name: getattr(cache, name) for name in CACHE_COMMANDS}
+
+        def counted(name):
+            async def method(*args, **kwargs):
+                calls[name] = calls.get(name, 0) + 1
+                return await originals[name](*args, **kwargs)
+            return method
+
+        layer = CountingLayer()
+        for user_id in online:
+            await layer.group_add(f"notifications_{user_id}", await layer.new_channel())
+            if user_id in local:
+                await presence.connected(user_id)
+            else:
+                await cache.aset(presence.presence_key(user_id), 1, 60)
+
+        try:
+            for name in CACHE_COMMANDS:
+                setattr(cache, name, counted(name))
+
+            start = time.perf_counter()
+            for user_id in targets:
+                await layer.group_send(f"notifications_{user_id}", event)
+            self.report("publish to all", layer.commands, {}, start, len(targets))
+
+            layer.commands = 0
+            start = time.perf_counter()
+            for user_id in targets:
+                await presence.notify(layer, user_id, event)
+            self.report("presence-aware", layer.commands, calls, start, len(targets))
+        finally:
+            for name, method in originals.items():
+                setattr(cache, name, method)
+            for user_id in local:
+                await presence.disconnected(user_id)
+            await cache.adelete_many([presence.presence_key(user_id) for user_id in online])
+
+    def report(self, name, layer_commands, cache_calls, start, messages):
+        elapsed_us = (time.perf_counter() - start) / messages * 1e6
+        cache_commands = sum(CACHE_COMMANDS[call] * count for call, count in cache_calls.items())
+        total = layer_commands + cache_commands
+        self.stdout.write(
+            f"{name:<15} {total / messages:.2f} Redis commands/message "
+            f"(channel layer {layer_commands / messages:.2f}, presence {cache_commands / messages:.2f}), "
+            f"{elapsed_us:.1f} us/message in process"
+        )
@@ -0,0 +1,78 @@
+import random
+import statistics
+import time
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from chat.search import search_messages
+from coverence.synthetic import generate
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures message search latency over a synthetic dataset (see coverence.synthetic; "
+        "messages are indexed through chat.search like live writes). Everything is created "
+        "in a transaction that is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--messages", type=int, default=1_000_000)
+        parser.add_argument("--users", type=int, default=200)
+        parser.add_argument("--rooms-per-user", type=int, default=20)
+        parser.add_argument("--vocabulary", type=int, default=20000)
+        parser.add_argument("--queries", type=int, default=200)
+        parser.add_argument("--batch-size", type=int, default=10000)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.run(options)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def run(self, options):
+        self.stdout.write(f"Generating and indexing {options['messages']} messages on {connection.vendor}...")
+        start = time.perf_counter()
+        dataset = generate(
+            users=options["users"],
+            messages=options["messages"],
+            rooms_per_user=options["rooms_per_user"],
+            notifications_per_user=0,
+            vocabulary=options["vocabulary"],
+            seed=options["seed"],
+            batch_size=options["batch_size"],
+            prefix="search-bench",
+            log=self.stdout.write,
+        )
+        elapsed = time.perf_counter() - start
+        self.stdout.write(f"Indexed at {options['messages'] / elapsed:.0f} messages/s")
+        rng = random.Random(options["seed"])
+        users = dataset["users"]
+        vocabulary = dataset["vocabulary"]
+
+        # Common, mid-frequency and rare words, alone and in pairs.
+        buckets = {
+            "common term": vocabulary[:20],
+            "mid term": vocabulary[200:2000],
+            "rare term": vocabulary[-5000:],
+        }
+        for name, words in buckets.items():
+            for terms in (1, 2):
+                latencies = []
+                for _ in range(options["queries"]):
+                    user_id = rng.choice(users)
+                    query = " ".join(rng.sample(words, terms))
+                    start = time.perf_counter()
+                    search_messages(user_id, query)
+                    latencies.append((time.perf_counter() - start) * 1000)
+                latencies.sort()
+                self.stdout.write(
+                    f"{name} x{terms}: p50 {statistics.median(latencies):.2f} ms, "
+                    f"p95 {latencies[int(len(latencies) * 0.95) - 1]:.2f} ms, "
+                    f"p99 {latencies[int(len(latencies) * 0.99) - 1]:.2f} ms"
+                )
@@ -0,0 +1,70 @@
+import contextlib
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+from django.test.utils import CaptureQueriesContext
+from chat.cache import get_or_create_room_id
+from chat.consumers import ChatConsumer
+from users.models import ChangeLog
+
+save_message = ChatConsumer.save_message.__wrapped__
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures the chat message write (ChatConsumer.save_message) with and without recording "
+        "changes for incremental sync: queries per message, latency from one sender, and "
+        "throughput with several senders writing to the same receiver, whose change log row "
+        "every message locks."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--messages", type=int, default=500, help="Messages per sender")
+        parser.add_argument("--senders", type=int, default=4)
+
+    def handle(self, *args, **options):
+        # Messages are written from other threads, so the users have to be
+        # committed; they are deleted again at the end.
+        User.objects.filter(username__startswith="bench_send_").delete()
+        users = User.objects.bulk_create(
+            User(username=f"bench_send_{i}", email=f"bench_send_{i}@example.com") for i in range(options["senders"] + 1)
+        )
+        receiver, senders = users[0], users[1:]
+        rooms = [get_or_create_room_id(sender.id, receiver.id) for sender in senders]
+        try:
+            for label, record in (("with change log", True), ("without change log", False)):
+                patch = contextlib.nullcontext() if record else mock.patch("chat.consumers.record_changes", lambda changes: None)
+                with patch:
+                    result = self.run(rooms, senders, receiver, options)
+                self.stdout.write(
+                    f"{label:<19} {result['queries']:>2} queries/message, {result['latency']:.2f} ms from one "
+                    f"sender, {result['rate']:.0f} messages/s from {options['senders']} senders"
+                )
+        finally:
+            User.objects.filter(username__startswith="bench_send_").delete()
+            ChangeLog.objects.filter(user_id__in=[user.id for user in users]).delete()
+
+    def run(self, rooms, senders, receiver, options):
+        with CaptureQueriesContext(connection) as queries:
+            save_message(None, rooms[0], senders[0].id, receiver.id, "warm-up")
+
+        start = time.perf_counter()
+        for i in range(options["messages"]):
+            save_message(None, rooms[0], senders[0].id, receiver.id, f"message {i}")
+        latency = (time.perf_counter() - start) / options["messages"] * 1000
+
+        def send(index):
+            try:
+                for i in range(options["messages"]):
+                    save_message(None, rooms[index], senders[index].id, receiver.id, f"message {i}")
+            finally:
+                close_old_connections()
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(len(senders)) as executor:
+            list(executor.map(send, range(len(senders))))
+        rate = len(senders) * options["messages"] / (time.perf_counter() - start)
+        return {"queries": len(queries.captured_queries), "latency": latency, "rate": rate}
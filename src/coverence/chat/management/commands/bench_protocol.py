@@ -0,0 +1,55 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from chat.protocol import JSONCodec, MsgPackCodec
+
+SAMPLE_FRAMES = [
+    {"message": "hey, are you around later?"},
+    {"typing": True},
+    {
+        "type": "chat",
+        "message": "hey, are you around later?",
+        "sender_id": 1042,
+        "receiver_id": 2087,
+        "sender": "Ada Lovelace",
+    },
+    {"type": "typing", "sender_id": 1042, "typing": True},
+    {"type": "status", "user_id": 2087, "status": "offline", "last_seen": "2025-06-18T09:12:44.120391+00:00"},
+    {"type": "status", "user_id": 2087, "status": "online"},
+    {"type": "new_message", "sender_id": 1042, "sender_name": "Ada Lovelace", "message": "hey, are you around later?"},
+]
+
+
+class Command(BaseCommand):
+    help = "Compares bytes on the wire and encode/decode cost per frame for each socket encoding"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--iterations", type=int, default=20000)
+
+    def handle(self, *args, **options):
+        iterations = options["iterations"]
+
+        for codec in (JSONCodec(), MsgPackCodec()):
+            name = codec.__class__.__name__
+            for frame in SAMPLE_FRAMES:
+                if codec.decode(codec.encode(frame)) != frame:
+                    raise CommandError(f"{name} does not round-trip {frame!r}")
+
+            size = sum(len(codec.encode(frame)) for frame in SAMPLE_FRAMES)
+            encoded = [codec.encode(frame) for frame in SAMPLE_FRAMES]
+
+            start = time.perf_counter()
+            for _ in range(iterations):
+                for frame in SAMPLE_FRAMES:
+                    codec.encode(frame)
+            encode_us = (time.perf_counter() - start) / (iterations * len(SAMPLE_FRAMES)) * 1e6
+
+            start = time.perf_counter()
+            for _ in range(iterations):
+                for data in encoded:
+                    codec.decode(data)
+            decode_us = (time.perf_counter() - start) / (iterations * len(SAMPLE_FRAMES)) * 1e6
+
+            self.stdout.write(
+                f"{name}: {size / len(SAMPLE_FRAMES):.1f} bytes/frame, "
+                f"encode {encode_us:.2f} us/frame, decode {decode_us:.2f} us/frame"
+            )
@@ -0,0 +1,83 @@
+import asyncio
+import threading
+import time
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.test import AsyncRequestFactory
+from rest_framework_simplejwt.tokens import AccessToken
+from chat.async_views import AsyncChatMessageHistoryView, AsyncRecentChatsView
+from chat.views import ChatMessageHistoryView, RecentChatsView
+from users.async_views import AsyncNotificationView, AsyncUnseenNotificationCountView
+from users.views import NotificationView, UnseenNotificationCountView
+
+
+class Command(BaseCommand):
+    help = "Compares concurrent-request throughput and DB connection usage of the sync and async read views"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user-id", type=int, required=True)
+        parser.add_argument("--receiver-id", type=int, required=True)
+        parser.add_argument("--requests", type=int, default=200)
+        parser.add_argument("--concurrency", type=int, default=50)
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(id=options["user_id"])
+        except User.DoesNotExist:
+            raise CommandError("User not found")
+
+        token = str(AccessToken.for_user(user))
+        receiver_id = options["receiver_id"]
+        endpoints = [
+            ("history", f"/api/chat/{receiver_id}/messages/", {"receiver_id": receiver_id},
+             ChatMessageHistoryView, AsyncChatMessageHistoryView),
+            ("recent", "/api/chat/recent/", {}, RecentChatsView, AsyncRecentChatsView),
+            ("notifications", "/api/users/notifications/", {}, NotificationView, AsyncNotificationView),
+            ("unseen", "/api/users/notifications/unseen-count/", {},
+             UnseenNotificationCountView, AsyncUnseenNotificationCountView),
+        ]
+
+        for name, path, kwargs, sync_view, async_view in endpoints:
+            for label, view in (("sync", sync_view), ("async", async_view)):
+                rate, connections = asyncio.run(
+                    self.run(view.as_view(), label == "async", path, kwargs, token, options)
+                )
+                self.stdout.write(f"{name:<14} {label:<6} {rate:8.1f} req/s  {connections} DB connections opened")
+
+    async def run(self, view, is_async, path, kwargs, token, options):
+        factory = AsyncRequestFactory()
+        semaphore = asyncio.Semaphore(options["concurrency"])
+        opened = set()
+
+        def track(sender, connection, **kw):
+            opened.add((connection.alias, threading.get_ident()))
+
+        if not is_async:
+            # Mirrors how Django's ASGI handler runs synchronous views.
+            view = sync_to_async(view)
+
+        async def one():
+            async with semaphore:
+                request = factory.get(path, headers={"Authorization": f"Bearer {token}"})
+                response = await view(request, **kwargs)
+                if response.status_code != 200:
+                    raise CommandError(f"{path} returned {response.status_code}")
+                if hasattr(response, "render"):
+                    response.render()
+
+        # Start every run from cold connections so the count reflects this run.
+        connections.close_all()
+        await sync_to_async(connections.close_all)()
+
+        connection_created.connect(track)
+        try:
+            start = time.perf_counter()
+            await asyncio.gather(*(one() for _ in range(options["requests"])))
+            elapsed = time.perf_counter() - start
+        finally:
+            connection_created.disconnect(track)
+
+        return options["requests"] / elapsed, len(opened)
@@ -0,0 +1,149 @@
+import asyncio
+import json
+import time
+import weakref
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+from rest_framework_simplejwt.tokens import AccessToken
+from coverence.asgi import application
+from coverence.db_pool import consumer_pool
+from chat import admission
+
+
+class Command(BaseCommand):
+    help = (
+        "Opens N notification sockets on the in-process ASGI app, then takes them all down "
+        "and measures the reconnect storm: every client reconnecting at once (a worker "
+        "restart), the same with handshake admission control, and a drain with jittered "
+        "reconnect hints. Reports peak database calls per bucket and peak concurrent handshakes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sockets", type=int, default=200)
+        parser.add_argument("--window", type=float, default=5, help="Drain window in seconds")
+        parser.add_argument("--reconnect-ms", type=int, nargs=2, default=[200, 3000], metavar=("MIN", "MAX"))
+        parser.add_argument("--max-handshakes", type=int, default=16)
+        parser.add_argument("--bucket-ms", type=int, default=100)
+
+    def handle(self, *args, **options):
+        # Sockets are served from pool threads, so the users have to be
+        # committed; they are deleted again at the end.
+        User.objects.filter(username__startswith="bench_storm_").delete()
+        User.objects.bulk_create(
+            User(username=f"bench_storm_{i}", email=f"bench_storm_{i}@example.com") for i in range(options["sockets"])
+        )
+        users = list(User.objects.filter(username__startswith="bench_storm_"))
+        try:
+            with override_settings(
+                CHAT_RECONNECT_MIN_MS=options["reconnect_ms"][0], CHAT_RECONNECT_MAX_MS=options["reconnect_ms"][1]
+            ):
+                asyncio.run(self.run(users, options))
+        finally:
+            User.objects.filter(username__startswith="bench_storm_").delete()
+
+    async def run(self, users, options):
+        self.crash = asyncio.Event()
+        self.stopping = False
+        paths = [f"/ws/notifications/{user.id}/?token={AccessToken.for_user(user)}" for user in users]
+
+        self.use_gate(len(paths))
+        clients = [asyncio.ensure_future(self.client(path)) for path in paths]
+        await self.wait_connected(len(paths))
+
+        for name, limit, drain in [
+            ("restart", len(paths), False),
+            ("restart + admission", options["max_handshakes"], False),
+            ("drain + admission", options["max_handshakes"], True),
+        ]:
+            self.use_gate(limit)
+            result = await self.storm(len(paths), drain, options)
+            self.stdout.write(
+                f"{name:<20} peak {result['peak_db']:>4} DB calls/{options['bucket_ms']} ms, "
+                f"peak {result['peak_handshakes']:>4} concurrent handshakes, "
+                f"all back in {result['elapsed']:.1f} s"
+            )
+
+        self.stopping = True
+        self.crash.set()
+        await asyncio.gather(*clients, return_exceptions=True)
+
+    def use_gate(self, limit):
+        admission.handshake_gate = admission.HandshakeGate(limit, 100000, 60)
+
+    def open_sockets(self, replacing=()):
+        return sum(1 for consumer in admission.drainer.sockets if consumer not in replacing)
+
+    async def wait_connected(self, count, replacing=()):
+        while self.open_sockets(replacing) < count:
+            await asyncio.sleep(0.05)
+
+    async def storm(self, count, drain, options):
+        replacing = set(admission.drainer.sockets)
+        samples = []
+        last = consumer_pool.checkouts
+
+        def sample():
+            nonlocal last
+            samples.append((consumer_pool.checkouts - last, admission.handshake_gate.in_flight))
+            last = consumer_pool.checkouts
+
+        async def sampler():
+            while True:
+                await asyncio.sleep(options["bucket_ms"] / 1000)
+                sample()
+
+        sampling = asyncio.ensure_future(sampler())
+        start = time.perf_counter()
+        if drain:
+            # The draining worker: its own drainer, holding today's sockets,
+            # while the app keeps accepting reconnects as the other workers.
+            old_worker = admission.Drainer()
+            old_worker.sockets = weakref.WeakSet(admission.drainer.sockets)
+            await old_worker.drain(options["window"])
+        else:
+            crash, self.crash = self.crash, asyncio.Event()
+            crash.set()
+        try:
+            await asyncio.wait_for(self.wait_connected(count, replacing), 120)
+        except asyncio.TimeoutError:
+            raise CommandError(f"Only {self.open_sockets(replacing)} of {count} sockets reconnected")
+        elapsed = time.perf_counter() - start
+        sampling.cancel()
+        sample()
+        return {
+            "peak_db": max(sample[0] for sample in samples),
+            "peak_handshakes": max(sample[1] for sample in samples),
+            "elapsed": elapsed,
+        }
+
+    async def client(self, path):
+        """Keeps a socket open, reconnecting after the hinted delay (at once without a hint)."""
+        while not self.stopping:
+            crash = self.crash
+            communicator = WebsocketCommunicator(application, path)
+            await communicator.connect(timeout=120)
+            after_ms = await self.hold(communicator, crash)
+            await communicator.disconnect(timeout=30)
+            if after_ms:
+                await asyncio.sleep(after_ms / 1000)
+
+    async def hold(self, communicator, crash):
+        """Reads frames until the server closes or ``crash`` is set; returns the reconnect hint."""
+        after_ms = 0
+        while True:
+            frame = asyncio.ensure_future(communicator.output_queue.get())
+            crashed = asyncio.ensure_future(crash.wait())
+            done, pending = await asyncio.wait({frame, crashed}, return_when=asyncio.FIRST_COMPLETED)
+            for task in pending:
+                task.cancel()
+            if frame not in done:
+                return 0
+            message = frame.result()
+            if message["type"] == "websocket.close":
+                return after_ms
+            if message.get("text"):
+                payload = json.loads(message["text"])
+                if payload.get("type") == "reconnect":
+                    after_ms = payload["after_ms"]
@@ -0,0 +1,95 @@
+import time
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from rest_framework.renderers import JSONRenderer
+from chat.models import ChatRoom, Message
+from chat.serializers import MessageSerializer, MessageValuesSerializer
+from users.models import Notification, UserProfile
+from users.serializers import (
+    NotificationSerializer,
+    NotificationValuesSerializer,
+    PublicUserSerializer,
+    PublicUserValuesSerializer,
+)
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares rows/second of the ModelSerializer and values()-based serializers for "
+        "messages, notifications and users, checking that both render the same JSON. "
+        "Sample rows are created in a transaction that is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=1000)
+        parser.add_argument("--rounds", type=int, default=5)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.run(options["rows"], options["rounds"])
+                raise Rollback
+        except Rollback:
+            pass
+
+    def run(self, rows, rounds):
+        users = User.objects.bulk_create(
+            User(username=f"bench-{i}", first_name="Ada", last_name=f"Lovelace {i}", email=f"bench-{i}@example.com")
+            for i in range(rows)
+        )
+        UserProfile.objects.bulk_create(UserProfile(user=user, skill_known="Python") for user in users)
+        me, other = users[0], users[1]
+        room = ChatRoom.objects.create(user1=me, user2=other)
+        Message.objects.bulk_create(
+            Message(room=room, sender=(me, other)[i % 2], content=f"message {i}") for i in range(rows)
+        )
+        Notification.objects.bulk_create(
+            Notification(to_user=me, from_user=users[i % rows], notification_type="like") for i in range(rows)
+        )
+
+        context = {"request": RequestFactory().get("/")}
+        messages = Message.objects.filter(room=room).order_by("timestamp")
+        notifications = Notification.objects.filter(to_user=me).order_by("-created_at")
+        people = User.objects.filter(username__startswith="bench-").order_by("id")
+
+        cases = [
+            (
+                "messages",
+                lambda: MessageSerializer(messages.all(), many=True).data,
+                lambda: MessageValuesSerializer().serialize(messages.all()),
+            ),
+            (
+                "notifications",
+                lambda: NotificationSerializer(notifications.all(), many=True, context=context).data,
+                lambda: NotificationValuesSerializer(context=context).serialize(notifications.all()),
+            ),
+            (
+                "users",
+                lambda: PublicUserSerializer(people.all(), many=True, context=context).data,
+                lambda: PublicUserValuesSerializer(context=context).serialize(people.all()),
+            ),
+        ]
+
+        renderer = JSONRenderer()
+        for name, before, after in cases:
+            if renderer.render(before()) != renderer.render(after()):
+                raise CommandError(f"values() serializer output differs for {name}")
+
+            for label, serialize in (("ModelSerializer", before), ("values()", after)):
+                connection.queries_log.clear()
+                with CaptureQueriesContext(connection) as queries:
+                    serialize()
+                start = time.perf_counter()
+                for _ in range(rounds):
+                    serialize()
+                elapsed = (time.perf_counter() - start) / rounds
+                self.stdout.write(
+                    f"{name:<14} {label:<16} {rows / elapsed:>10.0f} rows/s  {len(queries)} queries"
+                )
@@ -0,0 +1,77 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+from rest_framework_simplejwt.tokens import AccessToken
+from chat.async_views import AsyncRecentChatsView
+from chat.models import ChatRoom, Message
+from chat.views import RecentChatsView
+from coverence import metrics
+
+
+class Command(BaseCommand):
+    help = (
+        "Sends bursts of identical concurrent recent-chats requests to the sync view (from "
+        "threads) and the async view (on the event loop) and reports how many were computed, "
+        "how many shared a computation in flight and how many came from the SINGLE_FLIGHT_TTL cache."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rooms", type=int, default=200)
+        parser.add_argument("--messages-per-room", type=int, default=20)
+        parser.add_argument("--concurrency", type=int, default=8)
+        parser.add_argument("--bursts", type=int, default=20)
+
+    def handle(self, *args, **options):
+        # Sync views are served from other threads, so the data has to be
+        # committed; it is deleted again at the end.
+        User.objects.filter(username__startswith="bench_flight_").delete()
+        users = User.objects.bulk_create(
+            User(username=f"bench_flight_{i}", email=f"bench_flight_{i}@example.com", first_name="Bench", last_name=str(i))
+            for i in range(options["rooms"] + 1)
+        )
+        me, others = users[0], users[1:]
+        rooms = ChatRoom.objects.bulk_create(ChatRoom(user1=me, user2=other) for other in others)
+        Message.objects.bulk_create(
+            Message(room=room, sender=(me, other)[i % 2], content=f"message {i}")
+            for room, other in zip(rooms, others) for i in range(options["messages_per_room"])
+        )
+        factory = RequestFactory()
+        token = AccessToken.for_user(me)
+        self.make_request = lambda: factory.get("/api/chat/recent/", HTTP_AUTHORIZATION=f"Bearer {token}")
+        try:
+            self.report("sync", self.run_sync, options)
+            self.report("async", lambda options: asyncio.run(self.run_async(options)), options)
+        finally:
+            User.objects.filter(username__startswith="bench_flight_").delete()
+
+    def report(self, name, run, options):
+        before = metrics.snapshot()
+        start = time.perf_counter()
+        run(options)
+        elapsed = time.perf_counter() - start
+        after = metrics.snapshot()
+        computed, coalesced, cached = (
+            after.get(f"single_flight.recent_chats.{counter}", 0) - before.get(f"single_flight.recent_chats.{counter}", 0)
+            for counter in ("computed", "coalesced", "cached")
+        )
+        requests = options["concurrency"] * options["bursts"]
+        self.stdout.write(
+            f"{name:<5} {requests} requests in {elapsed:.2f} s: {computed} computed, {coalesced} coalesced, "
+            f"{cached} from the micro-cache"
+        )
+
+    def run_sync(self, options):
+        view = RecentChatsView.as_view()
+        with ThreadPoolExecutor(options["concurrency"]) as executor:
+            for _ in range(options["bursts"]):
+                responses = list(executor.map(lambda _: view(self.make_request()), range(options["concurrency"])))
+                assert all(response.status_code == 200 for response in responses)
+
+    async def run_async(self, options):
+        view = AsyncRecentChatsView.as_view()
+        for _ in range(options["bursts"]):
+            responses = await asyncio.gather(*(view(self.make_request()) for _ in range(options["concurrency"])))
+            assert all(response.status_code == 200 for response in responses)
@@ -0,0 +1,103 @@
+import asyncio
+import gc
+import os
+import tracemalloc
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework_simplejwt.tokens import AccessToken
+from coverence.asgi import application
+
+
+def rss_bytes():
+    """Resident set size of this process, or None where /proc is missing."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        "Opens N idle websockets on the in-process ASGI app (chat sockets, each to its own "
+        "peer, or notification sockets) and reports the memory each one holds, from "
+        "tracemalloc and RSS. The test client's own per-socket objects are included."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sockets", type=int, default=1000)
+        parser.add_argument("--kind", choices=["chat", "notifications"], default="chat")
+        parser.add_argument("--top", type=int, default=0, help="Also list the N biggest allocation sites")
+
+    def handle(self, *args, **options):
+        # Sockets are served from pool threads, so the users have to be
+        # committed; they are deleted again at the end.
+        User.objects.filter(username__startswith="bench_mem_").delete()
+        User.objects.bulk_create(
+            User(username=f"bench_mem_{i}", email=f"bench_mem_{i}@example.com", first_name="Bench", last_name=str(i))
+            for i in range(options["sockets"] + 1)
+        )
+        users = list(User.objects.filter(username__startswith="bench_mem_").order_by("id"))
+        try:
+            asyncio.run(self.run(users, options))
+        finally:
+            User.objects.filter(username__startswith="bench_mem_").delete()
+
+    def path(self, kind, user, peer):
+        if kind == "chat":
+            return f"/ws/chat/{peer.id}/?token={AccessToken.for_user(user)}"
+        return f"/ws/notifications/{user.id}/?token={AccessToken.for_user(user)}"
+
+    async def open(self, path):
+        communicator = WebsocketCommunicator(application, path)
+        connected, _ = await communicator.connect(timeout=60)
+        if not connected:
+            raise CommandError(f"Could not connect to {path}")
+        return communicator
+
+    def discard_frames(self, communicators):
+        # Status and digest frames the sockets were sent, which a client would
+        # have read.
+        for communicator in communicators:
+            while not communicator.output_queue.empty():
+                communicator.output_queue.get_nowait()
+
+    async def run(self, users, options):
+        kind = options["kind"]
+        peer, users = users[0], users[1:]
+        paths = [self.path(kind, user, peer) for user in users]
+
+        # Warm up imports, caches and pools so they are not counted per socket.
+        warmup = await self.open(self.path(kind, peer, users[0]))
+        await warmup.disconnect()
+
+        gc.collect()
+        tracemalloc.start(25 if options["top"] else 1)
+        traced_before, rss_before = tracemalloc.get_traced_memory()[0], rss_bytes()
+        snapshot_before = tracemalloc.take_snapshot() if options["top"] else None
+
+        communicators = []
+        for path in paths:
+            communicators.append(await self.open(path))
+            self.discard_frames(communicators)
+        await asyncio.sleep(0.5)
+        self.discard_frames(communicators)
+
+        gc.collect()
+        traced_after, rss_after = tracemalloc.get_traced_memory()[0], rss_bytes()
+        snapshot_after = tracemalloc.take_snapshot() if options["top"] else None
+        tracemalloc.stop()
+
+        count = len(communicators)
+        self.stdout.write(f"{count} {kind} sockets open")
+        self.stdout.write(f"tracemalloc: {(traced_after - traced_before) / count:,.0f} bytes per socket")
+        if rss_before is not None:
+            self.stdout.write(f"RSS:         {(rss_after - rss_before) / count:,.0f} bytes per socket")
+        if snapshot_before:
+            for stat in snapshot_after.compare_to(snapshot_before, "lineno")[:options["top"]]:
+                frame = stat.traceback[0]
+                self.stdout.write(f"{stat.size_diff / count:>10,.0f} B  {frame.filename}:{frame.lineno}")
+
+        for start in range(0, count, 100):
+            await asyncio.gather(*(communicator.disconnect() for communicator in communicators[start:start + 100]))
@@ -0,0 +1,65 @@
+import asyncio
+from collections import Counter
+from channels_redis.utils import _consistent_hash
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from coverence.channel_layers import HashRing, ShardedChannelLayer
+
+
+class Command(BaseCommand):
+    help = (
+        "Pings each channel layer shard and shows how groups spread over them. With --add or "
+        "--remove, also shows the share of groups that would move, against hashing modulo the "
+        "shard count."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--hosts", nargs="+", help="Redis URLs to use instead of CHANNEL_LAYERS")
+        parser.add_argument("--keys", type=int, default=100000, help="Sample groups to place")
+        parser.add_argument("--add", nargs="+", default=[], metavar="HOST:PORT")
+        parser.add_argument("--remove", nargs="+", default=[], metavar="HOST:PORT")
+        parser.add_argument("--no-ping", action="store_true", help="Only compute placement")
+
+    def handle(self, *args, **options):
+        if options["hosts"]:
+            hosts = options["hosts"]
+        else:
+            hosts = settings.CHANNEL_LAYERS["default"]["CONFIG"]["hosts"]
+        layer = ShardedChannelLayer(hosts=hosts, health_interval=0)
+
+        health = {} if options["no_ping"] else asyncio.run(self.ping(layer))
+        keys = [f"notifications_{user_id}" for user_id in range(options["keys"])]
+        placement = Counter(layer.shard_names[layer.consistent_hash(key)] for key in keys)
+        for name in layer.shard_names:
+            line = f"{name:<24} {placement[name] / len(keys):>7.2%} of groups"
+            if name in health:
+                state = health[name]
+                line += f", {'up' if state['up'] else 'DOWN'}"
+                if state["up"]:
+                    line += f" {state['latency_ms']:.2f} ms"
+            self.stdout.write(line)
+
+        if options["add"] or options["remove"]:
+            unknown = set(options["remove"]) - set(layer.shard_names)
+            if unknown:
+                raise CommandError(f"Not a shard: {', '.join(sorted(unknown))}")
+            nodes = [name for name in layer.shard_names if name not in options["remove"]] + options["add"]
+            if not nodes:
+                raise CommandError("No shards left")
+            ring = HashRing(nodes)
+            moved = sum(layer.shard_names[layer.ring.get(key)] != nodes[ring.get(key)] for key in keys)
+            # channels_redis' own placement: crc32 of the key modulo the shard count.
+            before, after = len(layer.shard_names), len(nodes)
+            modulo_moved = sum(
+                layer.shard_names[_consistent_hash(key, before)] != nodes[_consistent_hash(key, after)] for key in keys
+            )
+            self.stdout.write(
+                f"{before} -> {after} shards: {moved / len(keys):.2%} of groups move "
+                f"(hashing modulo the shard count: {modulo_moved / len(keys):.2%})"
+            )
+
+    async def ping(self, layer):
+        try:
+            return await layer.check_shards()
+        finally:
+            await layer.close_pools()
@@ -0,0 +1,45 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from coverence.synthetic import SCALES, generate
+
+
+class Command(BaseCommand):
+    help = (
+        "Generates a synthetic dataset (users, profiles, activity, rooms, messages, notifications) "
+        "for profiling. The same scale and seed always give the same data."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--scale", choices=SCALES, default="small")
+        parser.add_argument("--users", type=int, help="Overrides the scale's user count")
+        parser.add_argument("--messages", type=int, help="Overrides the scale's message count")
+        parser.add_argument("--rooms-per-user", type=int, default=8)
+        parser.add_argument("--notifications-per-user", type=int, default=5)
+        parser.add_argument("--days", type=int, default=90)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument("--prefix", default="synth", help="Username prefix of the generated users")
+        parser.add_argument("--no-index", action="store_true", help="Skip indexing messages for search")
+        parser.add_argument("--clear", action="store_true", help="Delete a dataset with this prefix first")
+
+    def handle(self, *args, **options):
+        existing = User.objects.filter(username__startswith=f"{options['prefix']}_")
+        if existing.exists():
+            if not options["clear"]:
+                raise CommandError(f"Users named {options['prefix']}_* already exist; pass --clear to replace them")
+            self.stdout.write(f"Deleting {existing.count()} users with their data...")
+            existing.delete()
+
+        scale = SCALES[options["scale"]]
+        generate(
+            users=options["users"] or scale["users"],
+            messages=options["messages"] or scale["messages"],
+            rooms_per_user=options["rooms_per_user"],
+            notifications_per_user=options["notifications_per_user"],
+            days=options["days"],
+            seed=options["seed"],
+            batch_size=options["batch_size"],
+            prefix=options["prefix"],
+            index=not options["no_index"],
+            log=self.stdout.write,
+        )
@@ -0,0 +1,49 @@
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from chat.models import Message
+from chat.search import index_messages
+
+CHECKPOINT_KEY = "chat:search:reindex:last_id"
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuilds the message search index in id order, a batch per transaction. "
+        "An interrupted run resumes after the last indexed batch."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument("--after", type=int, help="Start after this message id instead of the checkpoint")
+        parser.add_argument("--restart", action="store_true", help="Ignore the checkpoint and start from the beginning")
+
+    def handle(self, *args, **options):
+        if options["after"] is not None:
+            last_id = options["after"]
+        elif options["restart"]:
+            last_id = 0
+        else:
+            last_id = cache.get(CHECKPOINT_KEY, 0)
+        if last_id:
+            self.stdout.write(f"Resuming after message {last_id}")
+
+        indexed = 0
+        while True:
+            rows = list(
+                Message.objects.filter(id__gt=last_id)
+                .order_by("id")
+                .values_list("id", "room_id", "content")[:options["batch_size"]]
+            )
+            if not rows:
+                break
+
+            with transaction.atomic():
+                index_messages(rows)
+            last_id = rows[-1][0]
+            indexed += len(rows)
+            cache.set(CHECKPOINT_KEY, last_id, None)
+            self.stdout.write(f"Indexed {indexed} messages (up to id {last_id})")
+
+        cache.delete(CHECKPOINT_KEY)
+        self.stdout.write(self.style.SUCCESS(f"Reindexed {indexed} messages."))
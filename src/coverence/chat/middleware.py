@@ -1,5 +1,5 @@
 from urllib.parse import parse_qs
-from channels.db import database_sync_to_async
+from coverence.db_pool import database_sync_to_async
 from channels.middleware import BaseMiddleware
 from django.contrib.auth.models import AnonymousUser
 from django.contrib.auth import get_user_model
@@ -7,12 +7,30 @@ from rest_framework_simplejwt.tokens import AccessToken
 
 User = get_user_model()
 
+
+class SocketUser:
+    """
+    The authenticated user of a socket, as scope["user"]. Sockets live for
+    hours and only need the id, so the User row is not kept around.
+    """
+
+    __slots__ = ("id",)
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, user_id):
+        self.id = user_id
+
+    @property
+    def pk(self):
+        return self.id
+
+
 @database_sync_to_async
 def get_user(user_id):
-    try:
-        return User.objects.get(id=user_id)
-    except User.DoesNotExist:
-        return AnonymousUser()
+    if User.objects.filter(id=user_id).exists():
+        return SocketUser(user_id)
+    return AnonymousUser()
 
 class JWTAuthMiddleware(BaseMiddleware):
     async def __call__(self, scope, receive, send):
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.1 on 2026-10-19 15:48
+
+import django.contrib.postgres.search
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+# The GIN index only exists on PostgreSQL; other databases search through
+# MessageSearchToken instead.
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(
+            'CREATE INDEX IF NOT EXISTS chat_message_search_vector_gin ON chat_message USING gin (search_vector)'
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS chat_message_search_vector_gin')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0006_remove_message_receiver_alter_message_sender'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.CreateModel(
+            name='MessageSearchToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=64)),
+                ('count', models.PositiveSmallIntegerField(default=1)),
+                ('message', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_tokens', to='chat.message')),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='chat.chatroom')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['token', 'room'], name='chat_messag_token_198ee1_idx')],
+                'unique_together': {('message', 'token')},
+            },
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -1,6 +1,7 @@
 from django.db import models
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
+from django.contrib.postgres.search import SearchVectorField
 
 class ChatRoom(models.Model):
     user1 = models.ForeignKey(User, related_name='chat_user1', on_delete=models.CASCADE)
@@ -12,13 +13,13 @@ class ChatRoom(models.Model):
 
     def clean(self):
         # Enforce user1.id < user2.id
-        if self.user1 and self.user2 and self.user1.id >= self.user2.id:
+        if self.user1_id and self.user2_id and self.user1_id >= self.user2_id:
             raise ValidationError("user1's ID must be less than user2's ID")
 
     def save(self, *args, **kwargs):
         # Auto-swap users if needed before validation
-        if self.user1.id > self.user2.id:
-            self.user1, self.user2 = self.user2, self.user1
+        if self.user1_id > self.user2_id:
+            self.user1_id, self.user2_id = self.user2_id, self.user1_id
         self.full_clean()
         super().save(*args, **kwargs)
 
@@ -33,6 +34,20 @@ class Message(models.Model):
     content = models.TextField()
     timestamp = models.DateTimeField(auto_now_add=True)
     is_seen = models.BooleanField(default=False) 
+    # Full-text index of content on PostgreSQL (GIN-indexed); see chat.search.
+    search_vector = SearchVectorField(null=True, editable=False)
 
     def __str__(self):
         return f"{self.sender.username}: {self.content[:20]}"
+
+
+class MessageSearchToken(models.Model):
+    """Inverted index of message tokens, used for search on databases without full-text search."""
+    token = models.CharField(max_length=64)
+    room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, related_name='+')
+    message = models.ForeignKey(Message, on_delete=models.CASCADE, related_name='search_tokens')
+    count = models.PositiveSmallIntegerField(default=1)
+
+    class Meta:
+        unique_together = ('message', 'token')
+        indexes = [models.Index(fields=['token', 'room'])]
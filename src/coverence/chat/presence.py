@@ -0,0 +1,145 @@
+from collections import Counter
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Max, Q
+from coverence import metrics
+from users.cards import display_name, get_user_cards
+from users.changes import log_head
+from users.models import UserActivity
+from .models import ChatRoom, Message
+
+# Who has a notification socket open. Each user's open sockets are counted in
+# the shared cache (kept alive by refresh() while connected, so a crashed
+# worker's count expires after CHAT_PRESENCE_TTL), and sockets on this worker
+# are also counted locally so those lookups skip the cache entirely.
+_local_sockets = Counter()
+
+# BaseCache.aincr()/adecr() are a get and a set, so concurrent updates are
+# lost; the sync methods are atomic on the backends that matter (INCRBY).
+_incr = sync_to_async(lambda key: cache.incr(key), thread_sensitive=False)
+_decr = sync_to_async(lambda key: cache.decr(key), thread_sensitive=False)
+
+
+def presence_key(user_id):
+    return f"presence:{user_id}"
+
+
+async def connected(user_id):
+    _local_sockets[user_id] += 1
+    key = presence_key(user_id)
+    # add() only creates a missing count, so concurrent first connects (from
+    # other workers too) each still count.
+    await cache.aadd(key, 0, settings.CHAT_PRESENCE_TTL)
+    await _incr(key)
+    await cache.atouch(key, settings.CHAT_PRESENCE_TTL)
+
+
+async def disconnected(user_id):
+    _local_sockets[user_id] -= 1
+    if _local_sockets[user_id] <= 0:
+        del _local_sockets[user_id]
+    # A count at zero is left to expire: deleting it could drop an increment
+    # made since by another connect.
+    try:
+        await _decr(presence_key(user_id))
+    except ValueError:
+        pass
+
+
+async def refresh(user_id):
+    key = presence_key(user_id)
+    if not await cache.atouch(key, settings.CHAT_PRESENCE_TTL):
+        # The count was evicted or the cache restarted. This worker's sockets
+        # are the best count at hand; other workers' refreshes add theirs if
+        # the count drops to zero while they still have some.
+        await cache.aadd(key, max(_local_sockets[user_id], 1), settings.CHAT_PRESENCE_TTL)
+
+
+async def is_online(user_id):
+    if _local_sockets[user_id] > 0:
+        return True
+    return (await cache.aget(presence_key(user_id)) or 0) > 0
+
+
+async def notify(channel_layer, user_id, event):
+    """
+    Pushes ``event`` to the user's notification sockets if they have any.
+
+    Offline users are skipped: the message is already stored, and it shows
+    up in the pending digest they get on their next connect.
+    """
+    if not await is_online(user_id):
+        metrics.incr("chat.notifications.deferred")
+        return False
+    await channel_layer.group_send(f"notifications_{user_id}", event)
+    return True
+
+
+def pending_digest(user_id):
+    """
+    Unseen messages received since the user was last seen, as the latest
+    message and a count per sender (at most CHAT_DIGEST_MAX_SENDERS senders;
+    the rest are only counted in "others").
+
+    Digests are cached with the user's change log head, which new messages
+    and read marks move. While it stays put, a cached digest still holds for
+    the same last_seen, and an empty one also for any later last_seen (each
+    disconnect moves it); so most reconnects, the bulk of a reconnect storm
+    included, cost two row lookups instead of the aggregate.
+    """
+    last_seen = UserActivity.objects.filter(user_id=user_id).values_list("last_seen", flat=True).first()
+    head = log_head(user_id)[0]
+    key = f"digest:{user_id}"
+    cached = cache.get(key)
+    if cached is not None and _still_current(cached, head, last_seen):
+        metrics.incr("chat.digest.cached")
+        return cached[2]
+
+    digest = _build_digest(user_id, last_seen)
+    cache.set(key, (head, last_seen, digest), settings.CHAT_DIGEST_CACHE_SECONDS)
+    return digest
+
+
+def _still_current(cached, head, last_seen):
+    cached_head, cached_last_seen, digest = cached
+    if cached_head != head:
+        return False
+    if cached_last_seen == last_seen:
+        return True
+    # Nothing pending since cached_last_seen means nothing since any later time.
+    return not digest["senders"] and (
+        cached_last_seen is None or (last_seen is not None and last_seen >= cached_last_seen)
+    )
+
+
+def _build_digest(user_id, last_seen):
+    rooms = ChatRoom.objects.filter(Q(user1_id=user_id) | Q(user2_id=user_id)).values("id")
+    pending = Message.objects.filter(room__in=rooms, is_seen=False).exclude(sender_id=user_id)
+    if last_seen:
+        pending = pending.filter(timestamp__gt=last_seen)
+
+    senders = list(
+        pending.values("sender_id").annotate(count=Count("id"), latest_id=Max("id")).order_by("-latest_id")
+    )
+    shown = senders[:settings.CHAT_DIGEST_MAX_SENDERS]
+    latest = {
+        message_id: (content, timestamp)
+        for message_id, content, timestamp in Message.objects.filter(
+            id__in=[sender["latest_id"] for sender in shown]
+        ).values_list("id", "content", "timestamp")
+    }
+    cards = get_user_cards([sender["sender_id"] for sender in shown])
+
+    digest = []
+    for sender in shown:
+        content, timestamp = latest[sender["latest_id"]]
+        card = cards.get(sender["sender_id"])
+        digest.append({
+            "sender_id": sender["sender_id"],
+            "sender_name": display_name(card) if card else "",
+            "message": content[:settings.CHAT_DIGEST_PREVIEW_CHARS],
+            "timestamp": timestamp.isoformat(),
+            "count": sender["count"],
+        })
+    return {"senders": digest, "others": sum(sender["count"] for sender in senders[len(shown):])}
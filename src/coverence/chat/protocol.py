@@ -0,0 +1,129 @@
+import json
+import msgpack
+
+# Subprotocol a client offers in Sec-WebSocket-Protocol to get MessagePack frames.
+MSGPACK_SUBPROTOCOL = "coverence.msgpack.v1"
+
+# Shared schema: long JSON keys <-> short MessagePack field codes.
+FIELD_CODES = {
+    "type": "t",
+    "message": "m",
+    "sender_id": "s",
+    "receiver_id": "r",
+    "sender": "n",
+    "sender_name": "n",
+    "user_id": "u",
+    "status": "st",
+    "last_seen": "ls",
+    "typing": "ty",
+    "code": "c",
+    "senders": "sd",
+    "others": "o",
+    "after_ms": "a",
+}
+
+# Frame "type" values are enumerated too, so they travel as small ints.
+TYPE_CODES = {
+    "chat": 1,
+    "typing": 2,
+    "status": 3,
+    "new_message": 4,
+    "error": 5,
+    "digest": 6,
+    "reconnect": 7,
+}
+
+# Per frame type, which long key a short code expands back to
+# ("n" is "sender" on chat frames but "sender_name" on notifications).
+_FRAME_ALIASES = {
+    "new_message": {"n": "sender_name"},
+}
+
+_CODE_FIELDS = {}
+for _field, _code in FIELD_CODES.items():
+    _CODE_FIELDS.setdefault(_code, _field)
+_CODE_TYPES = {code: name for name, code in TYPE_CODES.items()}
+
+
+class FrameError(ValueError):
+    """An inbound frame that is not a valid object in the socket's encoding."""
+
+
+def compact(payload):
+    frame = {}
+    for key, value in payload.items():
+        if key == "type":
+            value = TYPE_CODES.get(value, value)
+        frame[FIELD_CODES.get(key, key)] = value
+    return frame
+
+
+def expand(frame):
+    for key in frame:
+        if not isinstance(key, (str, int)):
+            raise FrameError(f"Field names must be strings, got {type(key).__name__}")
+    frame_type = frame.get("t")
+    if frame_type is not None and not isinstance(frame_type, (str, int)):
+        raise FrameError(f"Frame type must be a string or code, got {type(frame_type).__name__}")
+    frame_type = _CODE_TYPES.get(frame_type, frame_type)
+    aliases = _FRAME_ALIASES.get(frame_type, {})
+
+    payload = {}
+    for key, value in frame.items():
+        if key == "t":
+            value = frame_type
+        payload[aliases.get(key) or _CODE_FIELDS.get(key, key)] = value
+    return payload
+
+
+def _as_object(frame):
+    if not isinstance(frame, dict):
+        raise FrameError(f"Expected an object, got {type(frame).__name__}")
+    return frame
+
+
+class JSONCodec:
+    subprotocol = None
+    binary = False
+
+    def encode(self, payload):
+        return json.dumps(payload)
+
+    def decode(self, data):
+        try:
+            frame = json.loads(data)
+        except ValueError as error:
+            raise FrameError(str(error)) from error
+        return _as_object(frame)
+
+
+class MsgPackCodec:
+    subprotocol = MSGPACK_SUBPROTOCOL
+    binary = True
+
+    def encode(self, payload):
+        return msgpack.packb(compact(payload), use_bin_type=True)
+
+    def decode(self, data):
+        if not isinstance(data, (bytes, bytearray)):
+            raise FrameError("MessagePack sockets only accept binary frames")
+        try:
+            frame = msgpack.unpackb(data, raw=False)
+        except ValueError as error:
+            raise FrameError(str(error)) from error
+        return expand(_as_object(frame))
+
+
+CODECS = {
+    MSGPACK_SUBPROTOCOL: MsgPackCodec(),
+}
+
+DEFAULT_CODEC = JSONCodec()
+
+
+def negotiate(subprotocols):
+    """Pick the first codec the client offered, falling back to JSON."""
+    for name in subprotocols or ():
+        if name in CODECS:
+            return CODECS[name]
+    return DEFAULT_CODEC
@@ -0,0 +1,123 @@
+import re
+from collections import Counter
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db import connections
+from django.db.models import Count, F, Q, Sum
+from django.utils.html import escape
+from .models import ChatRoom, Message, MessageSearchToken
+from .serializers import MessageValuesSerializer
+
+# Message search. On PostgreSQL, Message.search_vector is a GIN-indexed
+# tsvector; elsewhere MessageSearchToken is an inverted index of the same
+# tokens. Both match every query token exactly (CHAT_SEARCH_CONFIG defaults to
+# the non-stemming "simple" configuration), so results and highlighting agree
+# across backends.
+_TOKEN_RE = re.compile(r"\w+")
+MAX_TOKEN_LENGTH = 64
+
+
+def uses_search_vector():
+    """
+    Whether messages are indexed in Message.search_vector. Indexing and search
+    both ask this, and it goes by the primary, which a search routed to a
+    replica still sees mirrored.
+    """
+    return connections["default"].vendor == "postgresql"
+
+
+def tokenize(text):
+    return [token for token in _TOKEN_RE.findall(text.lower()) if len(token) <= MAX_TOKEN_LENGTH]
+
+
+def index_messages(rows, replace=True):
+    """
+    (Re)indexes messages given as ``(id, room_id, content)`` rows. Pass
+    ``replace=False`` for messages that were just created and have no index
+    entries yet.
+    """
+    rows = list(rows)
+    if not rows:
+        return
+
+    if uses_search_vector():
+        Message.objects.filter(id__in=[row[0] for row in rows]).update(
+            search_vector=SearchVector("content", config=settings.CHAT_SEARCH_CONFIG)
+        )
+        return
+
+    if replace:
+        MessageSearchToken.objects.filter(message_id__in=[row[0] for row in rows]).delete()
+    MessageSearchToken.objects.bulk_create(
+        MessageSearchToken(message_id=message_id, room_id=room_id, token=token, count=min(count, 32767))
+        for message_id, room_id, content in rows
+        for token, count in Counter(tokenize(content)).items()
+    )
+
+
+def highlight(content, terms):
+    """HTML-escaped ``content`` with every matched term wrapped in <mark>."""
+    parts = []
+    last = 0
+    for match in _TOKEN_RE.finditer(content):
+        if match.group().lower() in terms:
+            parts.append(escape(content[last:match.start()]))
+            parts.append(f"<mark>{escape(match.group())}</mark>")
+            last = match.end()
+    parts.append(escape(content[last:]))
+    return "".join(parts)
+
+
+class MessageSearchResultSerializer(MessageValuesSerializer):
+    fields = {
+        "id": "id",
+        "room_id": "room_id",
+        **MessageValuesSerializer.fields,
+        "highlight": ("get_highlight", "content"),
+    }
+
+    def get_highlight(self, content):
+        return highlight(content, self.context["terms"])
+
+
+def _ranked_ids(rooms, terms, offset, limit):
+    if uses_search_vector():
+        query = SearchQuery(" ".join(terms), config=settings.CHAT_SEARCH_CONFIG)
+        matches = (
+            Message.objects.filter(room__in=rooms, search_vector=query)
+            .annotate(rank=SearchRank(F("search_vector"), query))
+            .order_by("-rank", "-id")
+            .values_list("id", flat=True)
+        )
+    else:
+        # Messages holding every term, ranked by how often the terms occur.
+        matches = (
+            MessageSearchToken.objects.filter(room__in=rooms, token__in=terms)
+            .values("message_id")
+            .annotate(matched=Count("id"), rank=Sum("count"))
+            .filter(matched=len(terms))
+            .order_by("-rank", "-message_id")
+            .values_list("message_id", flat=True)
+        )
+    return list(matches[offset:offset + limit])
+
+
+def search_messages(user_id, query, page=1, page_size=20):
+    """
+    Ranked page of the messages matching ``query`` in the user's rooms.
+
+    Returns ``(results, has_next)``; there is no total count, which would
+    mean ranking every match.
+    """
+    terms = list(dict.fromkeys(tokenize(query)))
+    if not terms:
+        return [], False
+
+    rooms = ChatRoom.objects.filter(Q(user1_id=user_id) | Q(user2_id=user_id)).values("id")
+    ids = _ranked_ids(rooms, terms, (page - 1) * page_size, page_size + 1)
+    has_next = len(ids) > page_size
+    ids = ids[:page_size]
+
+    serializer = MessageSearchResultSerializer(context={"terms": set(terms)})
+    results = {row["id"]: row for row in serializer.serialize(Message.objects.filter(id__in=ids))}
+    return [results[message_id] for message_id in ids if message_id in results], has_next
@@ -1,4 +1,5 @@
 from rest_framework import serializers
+from coverence.values_serializer import ValuesSerializer
 from .models import Message
 
 class MessageSerializer(serializers.ModelSerializer):
@@ -10,4 +11,26 @@ class MessageSerializer(serializers.ModelSerializer):
 
     def get_sender_username(self, obj):
         full_name = f"{obj.sender.first_name} {obj.sender.last_name}".strip()
-        return full_name or obj.sender.email 
+        return full_name or obj.sender.email
+
+
+class MessageValuesSerializer(ValuesSerializer):
+    """Same output as MessageSerializer, straight from values_list() rows."""
+
+    fields = {
+        "id": "id",
+        "sender_id": "sender_id",
+        "sender_username": ("get_sender_username", "sender__first_name", "sender__last_name", "sender__email"),
+        "content": "content",
+        "timestamp": ("format_datetime", "timestamp"),
+    }
+
+    def get_sender_username(self, first_name, last_name, email):
+        full_name = f"{first_name} {last_name}".strip()
+        return full_name or email
+
+
+class SyncMessageValuesSerializer(MessageValuesSerializer):
+    """MessageValuesSerializer plus the room, for messages from several rooms."""
+
+    fields = {**MessageValuesSerializer.fields, "room_id": "room_id"}
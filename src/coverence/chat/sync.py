@@ -0,0 +1,114 @@
+from collections import defaultdict
+from django.conf import settings
+from django.db.models import Count, Max, OuterRef, Q, Subquery
+from users import changes
+from users.avatars import absolute_url
+from users.cards import get_user_cards
+from users.models import Notification
+from users.serializers import NotificationValuesSerializer
+from .models import ChatRoom, Message
+from .serializers import SyncMessageValuesSerializer
+
+# Incremental sync: the client keeps the version token of its last sync and
+# gets back only what changed since (see users.changes). When nothing did,
+# that costs one primary-key lookup. A missing, stale or foreign token gets a
+# full snapshot instead, like a first sync.
+
+
+def sync(user_id, since, request):
+    seq, floor = changes.log_head(user_id)
+    after = changes.read_token(user_id, since) if since else None
+    if after is None or after < floor or after > seq:
+        return snapshot(user_id, seq, request)
+
+    entries = [] if after == seq else changes.changes_between(user_id, after, seq, settings.SYNC_MAX_CHANGES)
+    upto = entries[-1][0] if len(entries) == settings.SYNC_MAX_CHANGES else seq
+    keys = defaultdict(list)
+    for _, kind, key in entries:
+        keys[kind].append(key)
+
+    notifications = []
+    if keys[changes.NOTIFICATION]:
+        notifications = NotificationValuesSerializer(context={"request": request}).serialize(
+            Notification.objects.filter(id__in=keys[changes.NOTIFICATION], to_user_id=user_id).order_by("-created_at")
+        )
+    found = {notification["id"] for notification in notifications}
+
+    return {
+        "version": changes.make_token(user_id, upto),
+        "reset": False,
+        "has_more": upto < seq,
+        "rooms": room_summaries(user_id, request, keys[changes.ROOM]) if keys[changes.ROOM] else [],
+        "messages": SyncMessageValuesSerializer().serialize(
+            Message.objects.filter(id__in=keys[changes.MESSAGE]).order_by("id")
+        ) if keys[changes.MESSAGE] else [],
+        "read": read_watermarks(user_id, keys[changes.READ]) if keys[changes.READ] else [],
+        "notifications": notifications,
+        "removed_notifications": [key for key in keys[changes.NOTIFICATION] if key not in found],
+    }
+
+
+def snapshot(user_id, seq, request):
+    # The head is read first, so anything changed while the snapshot is
+    # built is sent again on the next sync rather than missed.
+    return {
+        "version": changes.make_token(user_id, seq),
+        "reset": True,
+        "has_more": False,
+        "rooms": room_summaries(user_id, request),
+        "messages": [],
+        "read": read_watermarks(user_id),
+        "notifications": NotificationValuesSerializer(context={"request": request}).serialize(
+            Notification.objects.filter(to_user_id=user_id).order_by("-created_at")
+        ),
+        "removed_notifications": [],
+    }
+
+
+def _rooms(user_id, room_ids):
+    rooms = ChatRoom.objects.filter(Q(user1_id=user_id) | Q(user2_id=user_id))
+    return rooms if room_ids is None else rooms.filter(id__in=room_ids)
+
+
+def room_summaries(user_id, request, room_ids=None):
+    """The RecentChatsView entry, plus ``room_id``, of each of the user's rooms (or of ``room_ids``)."""
+    last_message = Message.objects.filter(room=OuterRef("pk")).order_by("-timestamp")
+    rooms = list(_rooms(user_id, room_ids).annotate(
+        last_content=Subquery(last_message.values("content")[:1]),
+        last_timestamp=Subquery(last_message.values("timestamp")[:1]),
+        unseen_count=Count("messages", filter=Q(messages__is_seen=False) & ~Q(messages__sender_id=user_id)),
+    ))
+    cards = get_user_cards([room.user2_id if room.user1_id == user_id else room.user1_id for room in rooms])
+
+    summaries = []
+    for room in rooms:
+        card = cards.get(room.user2_id if room.user1_id == user_id else room.user1_id)
+        if card is None:
+            continue
+        summaries.append({
+            **card,
+            "profile_image": absolute_url(card["profile_image"], request),
+            "room_id": room.id,
+            "last_message": {
+                "content": room.last_content or "",
+                "timestamp": room.last_timestamp.isoformat() if room.last_timestamp else "",
+            },
+            "unseen_count": room.unseen_count,
+        })
+    return summaries
+
+
+def read_watermarks(user_id, room_ids=None):
+    """Per room, the newest message the user has read and the newest of theirs the other user has."""
+    rows = (
+        Message.objects.filter(room__in=_rooms(user_id, room_ids).values("id"), is_seen=True)
+        .values("room_id")
+        .annotate(read_up_to=Max("id", filter=~Q(sender_id=user_id)), seen_up_to=Max("id", filter=Q(sender_id=user_id)))
+    )
+    watermarks = {
+        row["room_id"]: {"room_id": row["room_id"], "read_up_to": row["read_up_to"], "seen_up_to": row["seen_up_to"]}
+        for row in rows
+    }
+    for room_id in room_ids or ():
+        watermarks.setdefault(room_id, {"room_id": room_id, "read_up_to": None, "seen_up_to": None})
+    return list(watermarks.values())
@@ -1,3 +1,667 @@
-from django.test import TestCase
+import asyncio
+import datetime
+import gzip
+import json
+import zlib
+from collections import Counter
+from unittest import mock
+from asgiref.sync import async_to_sync
+import msgpack
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+from coverence.db_pool import PoolTimeout
+from coverence.synthetic import DEFAULT_END
+from coverence.testing import SyntheticDataTestCase
+from users.cards import card_cache, get_user_cards
+from users import changes
+from users.serializers import ClaimsTokenObtainPairSerializer
+from users.models import ChangeLogEntry, Notification, UserActivity
+from . import admission, presence, search, throttling
+from .cache import get_or_create_room_id, room_cache
+from .models import ChatRoom, Message, MessageSearchToken
+from .async_views import AsyncMessageExportView
+from .consumers import ChatConsumer, CodecWebsocketConsumer
+from .export import accepts_gzip
+from .sync import sync
+from .typing import TypingCoalescer
+from .throttling import ConnectionThrottle
+from .middleware import SocketUser
+from .protocol import (
+    FIELD_CODES, MSGPACK_SUBPROTOCOL, TYPE_CODES, FrameError, JSONCodec, MsgPackCodec, negotiate,
+)
 
-# Create your tests here.
+# One of every frame the sockets send or receive.
+FRAMES = [
+    {"message": "hey, are you around later?"},
+    {"typing": True},
+    {"type": "chat", "message": "hi", "sender_id": 1042, "receiver_id": 2087, "sender": "Ada Lovelace"},
+    {"type": "typing", "sender_id": 1042, "typing": False},
+    {"type": "status", "user_id": 2087, "status": "offline", "last_seen": "2025-06-18T09:12:44.120391+00:00"},
+    {"type": "status", "user_id": 2087, "status": "online", "last_seen": None},
+    {"type": "new_message", "sender_id": 1042, "sender_name": "Ada Lovelace", "message": "hi"},
+    {"type": "error", "code": "rate_limited"},
+    {
+        "type": "digest",
+        "senders": [{
+            "sender_id": 1042,
+            "sender_name": "Ada Lovelace",
+            "message": "hi",
+            "timestamp": "2025-06-18T09:12:44.120391+00:00",
+            "count": 3,
+        }],
+        "others": 0,
+    },
+    {"type": "reconnect", "after_ms": 1500},
+]
+
+
+class CodecTests(SimpleTestCase):
+    def test_frames_cover_every_type(self):
+        self.assertEqual({frame.get("type") for frame in FRAMES} - {None}, set(TYPE_CODES))
+
+    def test_json_round_trip(self):
+        codec = JSONCodec()
+        for frame in FRAMES:
+            with self.subTest(frame=frame):
+                self.assertEqual(codec.decode(codec.encode(frame)), frame)
+
+    def test_msgpack_round_trip(self):
+        codec = MsgPackCodec()
+        for frame in FRAMES:
+            with self.subTest(frame=frame):
+                self.assertEqual(codec.decode(codec.encode(frame)), frame)
+
+    def test_msgpack_uses_short_codes(self):
+        encoded = msgpack.unpackb(MsgPackCodec().encode(FRAMES[2]), raw=False)
+        self.assertEqual(encoded["t"], TYPE_CODES["chat"])
+        self.assertEqual(set(encoded), {FIELD_CODES[key] for key in FRAMES[2]})
+
+    def test_sender_code_is_aliased_per_frame_type(self):
+        codec = MsgPackCodec()
+        chat = codec.decode(msgpack.packb({"t": TYPE_CODES["chat"], "n": "Ada"}))
+        notification = codec.decode(msgpack.packb({"t": TYPE_CODES["new_message"], "n": "Ada"}))
+        self.assertEqual(chat, {"type": "chat", "sender": "Ada"})
+        self.assertEqual(notification, {"type": "new_message", "sender_name": "Ada"})
+
+    def test_unknown_fields_and_types_pass_through(self):
+        codec = MsgPackCodec()
+        frame = {"type": "something_new", "extra": [1, 2]}
+        self.assertEqual(codec.decode(codec.encode(frame)), frame)
+
+    def test_invalid_frames(self):
+        for codec, data in [
+            (MsgPackCodec(), '{"message": "hi"}'),
+            (MsgPackCodec(), b"\xc1"),
+            (MsgPackCodec(), msgpack.packb([1, 2])),
+            (MsgPackCodec(), msgpack.packb({"t": [1]})),
+            (MsgPackCodec(), msgpack.packb({"t": {"a": 1}})),
+            (MsgPackCodec(), msgpack.packb({b"t": 1}, use_bin_type=True)),
+            (JSONCodec(), "{not json"),
+            (JSONCodec(), "[1, 2]"),
+        ]:
+            with self.subTest(codec=codec, data=data), self.assertRaises(FrameError):
+                codec.decode(data)
+
+    def test_negotiate(self):
+        self.assertIsInstance(negotiate(None), JSONCodec)
+        self.assertIsInstance(negotiate(["graphql-ws"]), JSONCodec)
+        self.assertIsInstance(negotiate(["graphql-ws", MSGPACK_SUBPROTOCOL]), MsgPackCodec)
+
+
+@override_settings(
+    CHAT_RATE_LIMITS={"default": (0.001, 2)},
+    CHAT_USER_RATE_LIMITS={"default": (0.001, 3)},
+)
+class ThrottleTests(SimpleTestCase):
+    def setUp(self):
+        throttling._user_buckets.clear()
+
+    def test_user_bucket_is_shared_by_sockets(self):
+        first, second = ConnectionThrottle(1), ConnectionThrottle(1)
+        self.assertEqual([first.allow("default") for _ in range(3)], [True, True, False])
+        self.assertEqual([second.allow("default") for _ in range(2)], [True, False])
+
+    def test_denied_frame_costs_no_token(self):
+        first, second = ConnectionThrottle(1), ConnectionThrottle(1)
+        first.allow("default")
+        first.allow("default")
+        second.allow("default")
+        # The user's bucket is empty now; the socket's must stay untouched.
+        self.assertFalse(second.allow("default"))
+        throttling._user_buckets.clear()
+        self.assertTrue(second.allow("default"))
+
+    def test_user_buckets_are_bounded_lru(self):
+        with mock.patch.object(throttling, "MAX_USER_BUCKETS", 3):
+            for user_id in range(3):
+                ConnectionThrottle(user_id).allow("default")
+            ConnectionThrottle(0).allow("default")
+            ConnectionThrottle(3).allow("default")
+            self.assertEqual([user_id for user_id, _ in throttling._user_buckets], [2, 0, 3])
+
+
+class EchoConsumer(CodecWebsocketConsumer):
+    async def connect(self):
+        await self.accept_with_codec()
+
+    async def receive_event(self, data):
+        await self.send_event({"type": "chat", **data})
+
+
+class FailingSendConsumer(EchoConsumer):
+    async def send(self, text_data=None, bytes_data=None, close=False):
+        raise RuntimeError("connection lost")
+
+
+@override_settings(CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}})
+class CodecConsumerTests(SimpleTestCase):
+    async def connect(self, subprotocols=None, consumer=EchoConsumer):
+        communicator = WebsocketCommunicator(consumer.as_asgi(), "/ws/echo/", subprotocols=subprotocols)
+        communicator.scope["user"] = SocketUser(1)
+        connected, subprotocol = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator, subprotocol
+
+    async def test_msgpack_socket(self):
+        communicator, subprotocol = await self.connect([MSGPACK_SUBPROTOCOL])
+        self.assertEqual(subprotocol, MSGPACK_SUBPROTOCOL)
+        codec = MsgPackCodec()
+        await communicator.send_to(bytes_data=codec.encode({"message": "hi"}))
+        self.assertEqual(codec.decode(await communicator.receive_from()), {"type": "chat", "message": "hi"})
+        await communicator.disconnect()
+
+    async def test_text_frame_on_msgpack_socket(self):
+        communicator, _ = await self.connect([MSGPACK_SUBPROTOCOL])
+        codec = MsgPackCodec()
+        await communicator.send_to(text_data='{"message": "hi"}')
+        self.assertEqual(codec.decode(await communicator.receive_from()), {"type": "error", "code": "bad_frame"})
+        # The socket is still usable.
+        await communicator.send_to(bytes_data=codec.encode({"message": "hi"}))
+        self.assertEqual(codec.decode(await communicator.receive_from()), {"type": "chat", "message": "hi"})
+        await communicator.disconnect()
+
+    async def test_unhashable_type_on_msgpack_socket(self):
+        communicator, _ = await self.connect([MSGPACK_SUBPROTOCOL])
+        codec = MsgPackCodec()
+        await communicator.send_to(bytes_data=msgpack.packb({"t": [1]}))
+        self.assertEqual(codec.decode(await communicator.receive_from()), {"type": "error", "code": "bad_frame"})
+        await communicator.send_to(bytes_data=codec.encode({"message": "hi"}))
+        self.assertEqual(codec.decode(await communicator.receive_from()), {"type": "chat", "message": "hi"})
+        await communicator.disconnect()
+
+    async def test_invalid_json_frame(self):
+        communicator, _ = await self.connect()
+        await communicator.send_to(text_data="{not json")
+        self.assertEqual(await communicator.receive_json_from(), {"type": "error", "code": "bad_frame"})
+        await communicator.disconnect()
+
+    async def test_failed_send_closes_socket(self):
+        communicator, _ = await self.connect(consumer=FailingSendConsumer)
+        with self.assertLogs("chat.consumers", "ERROR"):
+            await communicator.send_to(text_data='{"message": "hi"}')
+            self.assertEqual(await communicator.receive_output(), {"type": "websocket.close", "code": 1011})
+        await communicator.disconnect()
+
+
+class HeldConsumer(EchoConsumer):
+    """Echo consumer whose connect() waits until the test lets it finish."""
+
+    async def connect(self):
+        await self.scope["proceed"].wait()
+        await super().connect()
+
+
+class PoolTimeoutConsumer(EchoConsumer):
+    async def connect(self):
+        raise PoolTimeout()
+
+
+class BrokenConsumer(EchoConsumer):
+    async def connect(self):
+        raise RuntimeError("connect failed")
+
+
+@override_settings(
+    CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}},
+    CHAT_RECONNECT_MIN_MS=100,
+    CHAT_RECONNECT_MAX_MS=200,
+)
+class AdmissionTests(SimpleTestCase):
+    def setUp(self):
+        self.gate = admission.HandshakeGate(1, 0, 0.1)
+        self.drainer = admission.Drainer()
+        for patcher in (
+            mock.patch.object(admission, "handshake_gate", self.gate),
+            mock.patch.object(admission, "drainer", self.drainer),
+            mock.patch("chat.consumers.drainer", self.drainer),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def communicator(self, consumer=EchoConsumer, **scope):
+        communicator = WebsocketCommunicator(admission.AdmissionMiddleware(consumer.as_asgi()), "/ws/echo/")
+        communicator.scope.update(user=SocketUser(1), **scope)
+        return communicator
+
+    async def assert_turned_away(self, communicator, close_code):
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        frame = await communicator.receive_json_from()
+        self.assertEqual(frame["type"], "reconnect")
+        self.assertTrue(100 <= frame["after_ms"] <= 200)
+        self.assertEqual(await communicator.receive_output(), {"type": "websocket.close", "code": close_code})
+
+    async def test_gate_queues_and_times_out(self):
+        gate = admission.HandshakeGate(1, 1, 0.1)
+        release = await gate.admit()
+        queued = asyncio.ensure_future(gate.admit())
+        await asyncio.sleep(0)
+        self.assertEqual((gate.in_flight, gate.waiting), (1, 1))
+        # The queue is full.
+        self.assertIsNone(await gate.admit())
+
+        release()
+        release()  # a second call is a no-op
+        second = await queued
+        self.assertEqual((gate.in_flight, gate.waiting), (1, 0))
+        self.assertIsNone(await gate.admit())  # timed out
+        second()
+        self.assertEqual(gate.in_flight, 0)
+        self.assertIsNotNone(await gate.admit())
+
+    async def test_handshake_beyond_limit_is_told_to_retry(self):
+        proceed = asyncio.Event()
+        held = self.communicator(HeldConsumer, proceed=proceed)
+        connecting = asyncio.ensure_future(held.connect())
+        await asyncio.sleep(0.01)
+        self.assertEqual(self.gate.in_flight, 1)
+
+        await self.assert_turned_away(self.communicator(), admission.TRY_AGAIN_CLOSE_CODE)
+
+        proceed.set()
+        self.assertEqual(await connecting, (True, None))
+        # The slot is given back once connect() has finished, not when the socket closes.
+        self.assertEqual(self.gate.in_flight, 0)
+        await held.disconnect()
+
+    async def test_slot_released_when_connect_fails(self):
+        communicator = self.communicator(PoolTimeoutConsumer)
+        self.assertEqual(await communicator.connect(), (False, admission.TRY_AGAIN_CLOSE_CODE))
+        self.assertEqual(self.gate.in_flight, 0)
+
+        communicator = self.communicator(BrokenConsumer)
+        with self.assertRaises(RuntimeError):
+            await communicator.connect()
+        self.assertEqual(self.gate.in_flight, 0)
+
+        communicator = self.communicator()
+        self.assertEqual(await communicator.connect(), (True, None))
+        await communicator.disconnect()
+
+    async def test_drain_asks_sockets_to_reconnect(self):
+        communicators = [self.communicator() for _ in range(2)]
+        for communicator in communicators:
+            await communicator.connect()
+        self.assertEqual(len(self.drainer.sockets), 2)
+
+        await self.drainer.drain(window=0)
+        for communicator in communicators:
+            frame = await communicator.receive_json_from()
+            self.assertEqual(frame["type"], "reconnect")
+            self.assertTrue(100 <= frame["after_ms"] <= 200)
+            self.assertEqual(
+                await communicator.receive_output(),
+                {"type": "websocket.close", "code": admission.RECONNECT_CLOSE_CODE},
+            )
+        self.assertEqual(len(self.drainer.sockets), 0)
+
+        # New sockets are turned away while draining, without taking a slot.
+        await self.assert_turned_away(self.communicator(), admission.RECONNECT_CLOSE_CODE)
+        self.assertEqual(self.gate.in_flight, 0)
+        for communicator in communicators:
+            await communicator.disconnect()
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class PresenceTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        room_cache.clear()
+        self.alice = User.objects.create_user("alice", "alice@example.com", "pw", first_name="Alice")
+        self.bob = User.objects.create_user("bob", "bob@example.com", "pw", first_name="Bob")
+        self.room_id = get_or_create_room_id(self.alice.id, self.bob.id)
+
+    def send(self, content):
+        ChatConsumer.save_message.__wrapped__(None, self.room_id, self.alice.id, self.bob.id, content)
+
+    async def test_concurrent_connects_are_all_counted(self):
+        await asyncio.gather(presence.connected(self.bob.id), presence.connected(self.bob.id))
+        try:
+            self.assertEqual(await cache.aget(presence.presence_key(self.bob.id)), 2)
+            await presence.disconnected(self.bob.id)
+            self.assertEqual(await cache.aget(presence.presence_key(self.bob.id)), 1)
+            self.assertTrue(await presence.is_online(self.bob.id))
+        finally:
+            await presence.disconnected(self.bob.id)
+        self.assertFalse(await presence.is_online(self.bob.id))
+
+    async def test_refresh_recreates_lost_count(self):
+        await presence.connected(self.bob.id)
+        try:
+            await cache.adelete(presence.presence_key(self.bob.id))
+            await presence.refresh(self.bob.id)
+            self.assertEqual(await cache.aget(presence.presence_key(self.bob.id)), 1)
+        finally:
+            await presence.disconnected(self.bob.id)
+
+    def test_digest_is_cached_until_something_changes(self):
+        self.send("one")
+        self.assertEqual(presence.pending_digest(self.bob.id)["senders"][0]["count"], 1)
+        with self.assertNumQueries(2):
+            presence.pending_digest(self.bob.id)
+
+        self.send("two")
+        digest = presence.pending_digest(self.bob.id)
+        self.assertEqual((digest["senders"][0]["count"], digest["senders"][0]["message"]), (2, "two"))
+
+    def test_empty_digest_survives_later_last_seen(self):
+        self.assertEqual(presence.pending_digest(self.bob.id)["senders"], [])
+        UserActivity.objects.filter(user=self.bob).update(last_seen=timezone.now())
+        with self.assertNumQueries(2):
+            self.assertEqual(presence.pending_digest(self.bob.id)["senders"], [])
+
+
+class AcceptEncodingTests(SimpleTestCase):
+    def test_accepts_gzip(self):
+        for header in ("gzip", "deflate, gzip", "GZIP;q=0.5", "x-gzip", "br;q=1, *;q=0.1", "gzip; q=1.0, *;q=0"):
+            with self.subTest(header=header):
+                self.assertTrue(accepts_gzip(header))
+
+    def test_refuses_gzip(self):
+        for header in ("", "identity", "br, deflate", "gzip;q=0", "gzip;q=0.0, *", "*;q=0", "gzip;q=bogus"):
+            with self.subTest(header=header):
+                self.assertFalse(accepts_gzip(header))
+
+
+class TypingCoalescerTests(SimpleTestCase):
+    key = ("chat_1_2", 1)
+
+    def run_updates(self, coalescer, updates):
+        published = []
+
+        async def publish(typing):
+            published.append(typing)
+
+        async def run():
+            for connection, typing in updates:
+                if typing is None:
+                    await coalescer.clear(self.key, connection, publish)
+                else:
+                    await coalescer.update(self.key, connection, typing, publish)
+
+        async_to_sync(run)()
+        return published
+
+    def test_repeats_coalesced(self):
+        coalescer = TypingCoalescer(refresh_interval=60, timeout=60)
+        self.assertEqual(self.run_updates(coalescer, [("a", True), ("a", True), ("a", False)]), [True, False])
+        self.assertEqual(coalescer.states, {})
+
+    def test_zero_refresh_interval_is_kept(self):
+        coalescer = TypingCoalescer(refresh_interval=0, timeout=60)
+        self.assertEqual(coalescer.refresh_interval, 0)
+        self.assertEqual(self.run_updates(coalescer, [("a", True), ("a", True), ("a", None)]), [True, True, False])
+
+    def test_one_tab_closing_keeps_the_other_typing(self):
+        coalescer = TypingCoalescer(refresh_interval=60, timeout=60)
+        published = self.run_updates(coalescer, [("a", True), ("b", True), ("a", None)])
+        self.assertEqual(published, [True])
+        self.assertIn(self.key, coalescer.states)
+        self.assertEqual(self.run_updates(coalescer, [("b", None)]), [False])
+
+    def test_stop_from_idle_tab_is_ignored(self):
+        coalescer = TypingCoalescer(refresh_interval=60, timeout=60)
+        self.assertEqual(self.run_updates(coalescer, [("a", True), ("b", False)]), [True])
+        self.run_updates(coalescer, [("a", None)])
+
+    def test_expires(self):
+        coalescer = TypingCoalescer(refresh_interval=60, timeout=0.01)
+        published = []
+
+        async def publish(typing):
+            published.append(typing)
+
+        async def run():
+            await coalescer.update(self.key, "a", True, publish)
+            await asyncio.sleep(0.05)
+
+        async_to_sync(run)()
+        self.assertEqual(published, [True, False])
+        self.assertEqual(coalescer.states, {})
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class QueryBudgetTests(SyntheticDataTestCase):
+    def setUp(self):
+        cache.clear()
+        card_cache.clear()
+
+    def test_digest_does_not_grow_with_senders(self):
+        # Rooms are Zipf-skewed: the busiest recipient hears from many more senders than the quietest.
+        pairs = Message.objects.values_list("room__user1_id", "room__user2_id", "sender_id").distinct()
+        senders = Counter(user2_id if sender_id == user1_id else user1_id for user1_id, user2_id, sender_id in pairs)
+        ranked = senders.most_common()
+        self.assertGreater(ranked[0][1], ranked[-1][1])
+        users = [ranked[0][0], ranked[-1][0]]
+        UserActivity.objects.update(last_seen=DEFAULT_END - datetime.timedelta(days=365))
+        Message.objects.update(is_seen=False)
+        for user_id in users:
+            cache.clear()
+            card_cache.clear()
+            with self.subTest(user_id=user_id), self.assertNumQueries(5):
+                self.assertTrue(presence.pending_digest(user_id)["senders"])
+
+    def test_cards_in_one_query(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(len(get_user_cards(self.dataset["users"])), len(self.dataset["users"]))
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class SyncTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        room_cache.clear()
+        self.alice = User.objects.create_user("alice", "alice@example.com", "pw", first_name="Alice")
+        self.bob = User.objects.create_user("bob", "bob@example.com", "pw", first_name="Bob")
+        self.room_id = get_or_create_room_id(self.alice.id, self.bob.id)
+        self.request = RequestFactory().get("/api/chat/sync/")
+
+    def send(self, content):
+        return ChatConsumer.save_message.__wrapped__(None, self.room_id, self.alice.id, self.bob.id, content)
+
+    def test_first_sync_is_snapshot(self):
+        result = sync(self.bob.id, None, self.request)
+        self.assertTrue(result["reset"])
+        self.assertEqual([room["room_id"] for room in result["rooms"]], [self.room_id])
+
+    def test_incremental_sync_returns_only_changes(self):
+        token = sync(self.bob.id, None, self.request)["version"]
+        alice_token = sync(self.alice.id, None, self.request)["version"]
+        message = self.send("hi")
+        notification = Notification.objects.create(to_user=self.bob, from_user=self.alice, notification_type="like")
+
+        result = sync(self.bob.id, token, self.request)
+        self.assertFalse(result["reset"])
+        self.assertFalse(result["has_more"])
+        self.assertEqual([room["room_id"] for room in result["rooms"]], [self.room_id])
+        self.assertEqual([row["id"] for row in result["messages"]], [message.id])
+        self.assertEqual([row["id"] for row in result["notifications"]], [notification.id])
+
+        alice_result = sync(self.alice.id, alice_token, self.request)
+        self.assertEqual([row["id"] for row in alice_result["messages"]], [message.id])
+        self.assertEqual(alice_result["notifications"], [])
+
+        with self.assertNumQueries(1):
+            result = sync(self.bob.id, result["version"], self.request)
+        self.assertEqual((result["rooms"], result["messages"], result["notifications"]), ([], [], []))
+
+        notification_id = notification.id
+        notification.delete()
+        changes.record_changes([(self.bob.id, changes.NOTIFICATION, notification_id)])
+        self.assertEqual(sync(self.bob.id, result["version"], self.request)["removed_notifications"], [notification_id])
+
+    @override_settings(SYNC_MAX_CHANGES=2)
+    def test_has_more_pages(self):
+        token = sync(self.bob.id, None, self.request)["version"]
+        sent = [self.send(f"message {i}").id for i in range(3)]
+
+        pages = []
+        while True:
+            result = sync(self.bob.id, token, self.request)
+            pages.append(result)
+            token = result["version"]
+            if not result["has_more"]:
+                break
+        self.assertGreater(len(pages), 1)
+        self.assertTrue(all(page["has_more"] for page in pages[:-1]))
+        received = [row["id"] for page in pages for row in page["messages"]]
+        self.assertEqual(sorted(set(received)), sent)
+
+    def test_token_below_floor_gets_snapshot(self):
+        token = sync(self.bob.id, None, self.request)["version"]
+        self.send("old")
+        ChangeLogEntry.objects.update(changed_at=timezone.now() - datetime.timedelta(days=30))
+        changes.compact_changes(timezone.now() - datetime.timedelta(days=1))
+        self.assertTrue(sync(self.bob.id, token, self.request)["reset"])
+
+    def test_foreign_or_tampered_token_gets_snapshot(self):
+        alice_token = sync(self.alice.id, None, self.request)["version"]
+        token = sync(self.bob.id, None, self.request)["version"]
+        self.send("hi")
+        for since in (alice_token, token[:-2] + "xx", changes.make_token(self.bob.id, 10**6)):
+            with self.subTest(since=since):
+                self.assertTrue(sync(self.bob.id, since, self.request)["reset"])
+        self.assertFalse(sync(self.bob.id, token, self.request)["reset"])
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class MessageSearchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        room_cache.clear()
+        self.alice, self.bob, self.carol = (
+            User.objects.create_user(name, f"{name}@example.com", "pw") for name in ("alice", "bob", "carol")
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+        self.ids = {
+            content: self.send(self.alice, self.bob, content).id
+            for content in ("deploy the server today", "deploy deploy deploy now", "server deploy")
+        }
+        self.send(self.carol, self.bob, "deploy the secret server")
+
+    def send(self, sender, receiver, content):
+        room_id = get_or_create_room_id(sender.id, receiver.id)
+        return ChatConsumer.save_message.__wrapped__(None, room_id, sender.id, receiver.id, content)
+
+    def search(self, **params):
+        response = self.client.get("/api/chat/search/", params)
+        self.assertEqual(response.status_code, 200)
+        return [row["id"] for row in response.data["results"]], response.data["has_next"]
+
+    def test_ranked_matches_in_own_rooms(self):
+        ids = self.ids
+        self.assertEqual(
+            self.search(q="deploy"),
+            ([ids["deploy deploy deploy now"], ids["server deploy"], ids["deploy the server today"]], False),
+        )
+        # Every term has to match; ties go to the newest.
+        self.assertEqual(self.search(q="Server DEPLOY"), ([ids["server deploy"], ids["deploy the server today"]], False))
+        self.assertEqual(self.search(q="secret"), ([], False))
+
+    def test_highlight(self):
+        response = self.client.get("/api/chat/search/", {"q": "server"})
+        self.assertEqual(
+            [row["highlight"] for row in response.data["results"]],
+            ["<mark>server</mark> deploy", "deploy the <mark>server</mark> today"],
+        )
+
+    def test_pages(self):
+        ids = self.ids
+        self.assertEqual(
+            self.search(q="deploy", page_size=2), ([ids["deploy deploy deploy now"], ids["server deploy"]], True)
+        )
+        self.assertEqual(self.search(q="deploy", page_size=2, page=2), ([ids["deploy the server today"]], False))
+
+    def test_bad_requests(self):
+        for params in ({}, {"q": "  "}, {"q": "?!"}, {"q": "deploy", "page": "x"}):
+            with self.subTest(params=params):
+                self.assertEqual(self.client.get("/api/chat/search/", params).status_code, 400)
+
+    def test_token_index_on_sqlite(self):
+        self.assertFalse(search.uses_search_vector())
+        self.assertEqual(MessageSearchToken.objects.filter(message_id=self.ids["server deploy"]).count(), 2)
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}, CHAT_EXPORT_CHUNK_SIZE=2
+)
+class MessageExportTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        room_cache.clear()
+        self.alice, self.bob, self.carol = (
+            User.objects.create_user(name, f"{name}@example.com", "pw") for name in ("alice", "bob", "carol")
+        )
+        self.ids = [
+            self.send(sender, receiver, f"message {i}").id
+            for i, (sender, receiver) in enumerate([(self.alice, self.bob), (self.bob, self.alice)] * 3)
+        ]
+        self.send(self.carol, self.bob, "not for alice")
+        self.token = str(ClaimsTokenObtainPairSerializer.get_token(self.alice).access_token)
+
+    def send(self, sender, receiver, content):
+        room_id = get_or_create_room_id(sender.id, receiver.id)
+        return ChatConsumer.save_message.__wrapped__(None, room_id, sender.id, receiver.id, content)
+
+    def export(self, path="/api/chat/export/", **headers):
+        request = RequestFactory().get(path, HTTP_AUTHORIZATION=f"Bearer {self.token}", **headers)
+
+        async def run():
+            response = await AsyncMessageExportView.as_view()(request)
+            return response, [chunk async for chunk in response]
+
+        response, chunks = async_to_sync(run)()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        return response, chunks
+
+    def assert_rows(self, data, ids):
+        rows = [json.loads(line) for line in data.decode().splitlines()]
+        self.assertEqual([row["id"] for row in rows], ids)
+        self.assertEqual(rows[0]["content"], "message 0")
+        self.assertEqual(rows[0]["sender_id"], self.alice.id)
+
+    def test_plain(self):
+        response, chunks = self.export()
+        self.assertNotIn("Content-Encoding", response)
+        # Three chunks of two rows.
+        self.assertEqual([chunk.count(b"\n") for chunk in chunks], [2, 2, 2])
+        self.assert_rows(b"".join(chunks), self.ids)
+
+    def test_gzip(self):
+        response, chunks = self.export(HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assert_rows(gzip.decompress(b"".join(chunks)), self.ids)
+        # A download cut off after the first chunk still decodes to whole lines.
+        partial = zlib.decompressobj(wbits=16 + zlib.MAX_WBITS).decompress(chunks[0])
+        self.assert_rows(partial, self.ids[:2])
+
+    def test_resume(self):
+        _, chunks = self.export(f"/api/chat/{self.bob.id}/export/?after={self.ids[2]}")
+        rows = [json.loads(line) for line in b"".join(chunks).decode().splitlines()]
+        self.assertEqual([row["id"] for row in rows], self.ids[3:])
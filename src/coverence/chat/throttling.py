@@ -0,0 +1,83 @@
+import time
+from collections import OrderedDict
+from django.conf import settings
+from coverence import metrics
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def available(self, amount=1):
+        """Whether ``amount`` tokens can be consumed now (consumes nothing)."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return self.tokens >= amount
+
+    def consume(self, amount=1):
+        if not self.available(amount):
+            return False
+        self.tokens -= amount
+        return True
+
+
+# Per-user buckets are shared by all of a user's sockets on this worker. At
+# most MAX_USER_BUCKETS are kept; the least recently used go first.
+_user_buckets = OrderedDict()
+MAX_USER_BUCKETS = 10000
+
+
+def _bucket(limits, event):
+    rate, burst = limits.get(event) or limits["default"]
+    return TokenBucket(rate, burst)
+
+
+def _user_bucket(user_id, event):
+    key = (user_id, event)
+    bucket = _user_buckets.get(key)
+    if bucket is None:
+        bucket = _user_buckets[key] = _bucket(settings.CHAT_USER_RATE_LIMITS, event)
+        while len(_user_buckets) > MAX_USER_BUCKETS:
+            _user_buckets.popitem(last=False)
+    else:
+        _user_buckets.move_to_end(key)
+    return bucket
+
+
+def classify(data):
+    if "typing" in data:
+        return "typing"
+    if "message" in data:
+        return "message"
+    return "default"
+
+
+class ConnectionThrottle:
+    """Token buckets for one socket, checked together with its user's buckets."""
+
+    __slots__ = ("user_id", "buckets")
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.buckets = {}
+
+    def allow(self, event):
+        bucket = self.buckets.get(event)
+        if bucket is None:
+            bucket = self.buckets[event] = _bucket(settings.CHAT_RATE_LIMITS, event)
+
+        # A frame either passes both buckets or costs neither a token.
+        user_bucket = _user_bucket(self.user_id, event)
+        if bucket.available() and user_bucket.available():
+            bucket.consume()
+            user_bucket.consume()
+            return True
+
+        metrics.incr(f"chat.throttled.{event}")
+        return False
@@ -0,0 +1,67 @@
+import asyncio
+from django.conf import settings
+
+
+class TypingState:
+    __slots__ = ("last_sent", "expiries")
+
+    def __init__(self):
+        self.last_sent = 0.0
+        # Connections currently typing, each with its own expiry timer.
+        self.expiries = {}
+
+
+class TypingCoalescer:
+    """
+    Collapses typing frames per (room, sender) before they reach the channel layer.
+
+    Only state transitions are published: the sender starts typing when the
+    first of their connections does and stops when the last one stops (or
+    goes quiet for longer than the timeout), and repeated "typing: true"
+    frames are forwarded at most once per refresh interval.
+    """
+
+    def __init__(self, refresh_interval=None, timeout=None):
+        self.refresh_interval = (
+            settings.CHAT_TYPING_REFRESH_INTERVAL if refresh_interval is None else refresh_interval
+        )
+        self.timeout = settings.CHAT_TYPING_TIMEOUT if timeout is None else timeout
+        self.states = {}
+
+    async def update(self, key, connection, typing, publish):
+        loop = asyncio.get_running_loop()
+        state = self.states.get(key)
+
+        if not typing:
+            if state is None or connection not in state.expiries:
+                return False
+            state.expiries.pop(connection).cancel()
+            if state.expiries:
+                return False
+            del self.states[key]
+            await publish(False)
+            return True
+
+        if state is None:
+            state = self.states[key] = TypingState()
+
+        was_typing = bool(state.expiries)
+        if connection in state.expiries:
+            state.expiries[connection].cancel()
+        state.expiries[connection] = loop.call_later(
+            self.timeout, lambda: asyncio.ensure_future(self.update(key, connection, False, publish))
+        )
+
+        if was_typing and loop.time() - state.last_sent < self.refresh_interval:
+            return False
+
+        state.last_sent = loop.time()
+        await publish(True)
+        return True
+
+    async def clear(self, key, connection, publish):
+        await self.update(key, connection, False, publish)
+
+
+# Shared by every consumer in this worker so several tabs of one sender coalesce too.
+typing_coalescer = TypingCoalescer()
@@ -1,9 +1,22 @@
+from django.conf import settings
 from django.urls import path
-from .views import ChatMessageHistoryView, RecentChatsView, MarkMessagesAsSeenView
+from .views import ChatMessageHistoryView, RecentChatsView, MarkMessagesAsSeenView, MessageSearchView, SyncView
+from .async_views import AsyncChatMessageHistoryView, AsyncRecentChatsView, AsyncMessageExportView
 
 urlpatterns = [
-    path("chat/<int:receiver_id>/messages/", ChatMessageHistoryView.as_view()),
-    path("chat/recent/", RecentChatsView.as_view(), name="recent-chats"),
+    path(
+        "chat/<int:receiver_id>/messages/",
+        (AsyncChatMessageHistoryView if settings.ASYNC_READ_VIEWS else ChatMessageHistoryView).as_view(),
+    ),
+    path(
+        "chat/recent/",
+        (AsyncRecentChatsView if settings.ASYNC_READ_VIEWS else RecentChatsView).as_view(),
+        name="recent-chats",
+    ),
     path('chat/<int:receiver_id>/mark-seen/', MarkMessagesAsSeenView.as_view(), name='mark_messages_seen'),
+    path("chat/search/", MessageSearchView.as_view(), name="message-search"),
+    path("chat/sync/", SyncView.as_view(), name="chat-sync"),
+    path("chat/export/", AsyncMessageExportView.as_view(), name="message-export"),
+    path("chat/<int:receiver_id>/export/", AsyncMessageExportView.as_view(), name="conversation-export"),
 
 ]
@@ -3,17 +3,29 @@ from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from .models import ChatRoom, Message
 from django.contrib.auth.models import User
-from .serializers import MessageSerializer
+from .serializers import MessageValuesSerializer
+from .search import search_messages, tokenize
+from .cache import recent_chats_flight
 from rest_framework import status
-from users.serializers import PublicUserSerializer
+from django.conf import settings
+from users.avatars import absolute_url
+from users.cards import get_user_cards
+from django.db import transaction
 from django.db.models import Q
+from coverence.db_router import replica_reads
+from coverence.single_flight import request_key
+from users.authentication import StatelessJWTAuthentication
+from users.changes import READ, ROOM, record_changes
+from .sync import sync
 
 
 
 
 class ChatMessageHistoryView(APIView):
+    authentication_classes = [StatelessJWTAuthentication]
     permission_classes = [IsAuthenticated]
 
+    @replica_reads
     def get(self, request, receiver_id):
         try:
             receiver = User.objects.get(id=receiver_id)
@@ -27,36 +39,44 @@ class ChatMessageHistoryView(APIView):
             return Response([], status=status.HTTP_200_OK)  # No messages yet
 
         messages = Message.objects.filter(room=room).order_by("timestamp")
-        serializer = MessageSerializer(messages, many=True)
-        return Response(serializer.data)
+        return Response(MessageValuesSerializer().serialize(messages))
 
 
 
 
 class RecentChatsView(APIView):
+    authentication_classes = [StatelessJWTAuthentication]
     permission_classes = [IsAuthenticated]
 
+    @replica_reads
     def get(self, request):
+        return Response(recent_chats_flight.run(request_key(request), lambda: self.build(request)))
+
+    def build(self, request):
         user = request.user
-        rooms = ChatRoom.objects.filter(Q(user1=user) | Q(user2=user))
+        rooms = list(ChatRoom.objects.filter(Q(user1_id=user.id) | Q(user2_id=user.id)).values_list("id", "user1_id", "user2_id"))
+        cards = get_user_cards([user2_id if user1_id == user.id else user1_id for _, user1_id, user2_id in rooms])
 
         chat_data = []
 
-        for room in rooms:
-            other_user = room.user2 if room.user1 == user else room.user1
-            last_message = Message.objects.filter(room=room).order_by("-timestamp").first()
+        for room_id, user1_id, user2_id in rooms:
+            other_user_id = user2_id if user1_id == user.id else user1_id
+            if other_user_id not in cards:
+                continue
+            last_message = Message.objects.filter(room_id=room_id).order_by("-timestamp").first()
 
             # Count unseen messages sent by the other_user to the current user
             unseen_count = Message.objects.filter(
-                room=room,
-                sender=other_user,
+                room_id=room_id,
+                sender_id=other_user_id,
                 is_seen=False
             ).count()
 
-            user_info = PublicUserSerializer(other_user, context={'request': request}).data
+            user_info = cards[other_user_id]
 
             chat_data.append({
                 **user_info,
+                "profile_image": absolute_url(user_info["profile_image"], request),
                 "last_message": {
                     "content": last_message.content if last_message else "",
                     "timestamp": last_message.timestamp.isoformat() if last_message else ""
@@ -67,25 +87,19 @@ class RecentChatsView(APIView):
         # Sort by latest message timestamp
         chat_data.sort(key=lambda x: x['last_message']['timestamp'], reverse=True)
 
-        total_unseen = sum(
-            Message.objects.filter(
-                room=room,
-                sender=room.user2 if room.user1 == user else room.user1,
-                is_seen=False
-            ).count()
-            for room in rooms
-        )
+        total_unseen = sum(chat["unseen_count"] for chat in chat_data)
 
-        return Response({
+        return {
             "chats": chat_data,
             "total_unseen_messages": total_unseen,
-        })
+        }
             
 
 
 
 
 class MarkMessagesAsSeenView(APIView):
+    authentication_classes = [StatelessJWTAuthentication]
     permission_classes = [IsAuthenticated]
 
     def post(self, request, receiver_id):
@@ -101,11 +115,46 @@ class MarkMessagesAsSeenView(APIView):
             return Response({"error": "ChatRoom not found"}, status=status.HTTP_404_NOT_FOUND)
 
         # Mark all messages from receiver to current user as seen
-        Message.objects.filter(
-            room=room,
-            sender=receiver,
-            is_seen=False
-        ).update(is_seen=True)
+        with transaction.atomic():
+            updated = Message.objects.filter(
+                room=room,
+                sender=receiver,
+                is_seen=False
+            ).update(is_seen=True)
+            if updated:
+                record_changes([(request.user.id, ROOM, room.id), (request.user.id, READ, room.id), (receiver.id, READ, room.id)])
 
         return Response({"message": "Messages marked as seen"}, status=status.HTTP_200_OK)
- 
\ No newline at end of file
+
+
+class MessageSearchView(APIView):
+    authentication_classes = [StatelessJWTAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    @replica_reads
+    def get(self, request):
+        query = request.GET.get("q", "").strip()
+        if not tokenize(query):
+            return Response({"error": "q must contain at least one word"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            page = max(int(request.GET.get("page", 1)), 1)
+            page_size = int(request.GET.get("page_size", settings.CHAT_SEARCH_PAGE_SIZE))
+        except ValueError:
+            return Response({"error": "page and page_size must be integers"}, status=status.HTTP_400_BAD_REQUEST)
+        page_size = min(max(page_size, 1), settings.CHAT_SEARCH_MAX_PAGE_SIZE)
+
+        results, has_next = search_messages(request.user.id, query, page, page_size)
+        return Response({"results": results, "page": page, "has_next": has_next})
+
+
+class SyncView(APIView):
+    """
+    Everything that changed for the user since ``?since=<version>`` (see
+    chat.sync); without a usable version, a full snapshot.
+    """
+
+    authentication_classes = [StatelessJWTAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        return Response(sync(request.user.id, request.GET.get("since"), request))
@@ -6,14 +6,17 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'coverence.settings')
 django.setup()
 
+from chat.admission import AdmissionMiddleware
 from chat.middleware import JWTAuthMiddleware  # 👈 import your custom middleware
 import chat.routing  # ✅ safe to import after setup
 
 application = ProtocolTypeRouter({
     "http": get_asgi_application(),
-    "websocket": JWTAuthMiddleware(
-        URLRouter(
-            chat.routing.websocket_urlpatterns
+    "websocket": AdmissionMiddleware(
+        JWTAuthMiddleware(
+            URLRouter(
+                chat.routing.websocket_urlpatterns
+            )
         )
     ),
 })
@@ -0,0 +1,348 @@
+import asyncio
+import bisect
+import collections
+import contextvars
+import copy
+import hashlib
+import logging
+import time
+import urllib.parse
+import weakref
+import channels_redis
+from channels.exceptions import ChannelFull
+from django.core.exceptions import ImproperlyConfigured
+from channels_redis.core import RedisChannelLayer
+from redis.exceptions import RedisError
+from coverence import metrics
+
+logger = logging.getLogger(__name__)
+
+# send_to_channels() repeats channels_redis' group fan-out: its Lua script and
+# the private _map_channel_keys_to_connection(). Both may change in any
+# release, so requirements.txt pins channels_redis and the layer refuses to
+# start on another version until this has been checked against it.
+CHANNELS_REDIS_VERSION = "4.2.1"
+
+# Marks messages this worker sent to one of its own channels through Redis.
+PENDING_KEY = "__hybrid_pending__"
+
+GROUP_SEND_LUA = """
+    local over_capacity = 0
+    local current_time = ARGV[#ARGV - 1]
+    local expiry = ARGV[#ARGV]
+    for i=1,#KEYS do
+        if redis.call('ZCOUNT', KEYS[i], '-inf', '+inf') < tonumber(ARGV[i + #KEYS]) then
+            redis.call('ZADD', KEYS[i], current_time, ARGV[i])
+            redis.call('EXPIRE', KEYS[i], expiry)
+        else
+            over_capacity = over_capacity + 1
+        end
+    end
+    return over_capacity
+"""
+
+# The channel the current task is receiving on, so receive_single knows which
+# channel's reader is blocked on Redis.
+_receiving = contextvars.ContextVar("receiving", default=None)
+
+
+class HybridChannelLayer(RedisChannelLayer):
+    """
+    Redis channel layer that delivers to sockets on this worker in memory.
+
+    Channels created by this layer are remembered per group as they are
+    added, and messages for them are put straight into the receive buffer the
+    layer's own receive() reads from, with no Redis round trip and no
+    serialization. Groups still live in Redis so other workers can reach
+    these channels; group_send reads the members from Redis and only
+    publishes to the ones that are not local, so every channel receives a
+    message once.
+
+    One reader at a time waits on Redis for the whole worker and does not look
+    at its buffer until Redis answers, so messages for that channel still go
+    through Redis, which wakes it. Until those have been received, later
+    messages for the channel take the same path, so they cannot overtake.
+    Messages dropped because a channel is over capacity are counted in
+    ``channel_layer.local_dropped`` and ``channel_layer.remote_dropped``.
+    """
+
+    def __init__(self, *args, **kwargs):
+        if channels_redis.__version__ != CHANNELS_REDIS_VERSION:
+            raise ImproperlyConfigured(
+                f"HybridChannelLayer was written against channels_redis {CHANNELS_REDIS_VERSION}, "
+                f"not {channels_redis.__version__}"
+            )
+        super().__init__(*args, **kwargs)
+        # group -> {local channel: time added}
+        self.local_groups = collections.defaultdict(dict)
+        self.blocked_channel = None
+        # local channel -> [messages sent through Redis not yet received, expiry]
+        self.redis_pending = {}
+
+    def owns(self, channel):
+        return "!" in channel and self.non_local_name(channel).endswith(self.client_prefix + "!")
+
+    def is_local(self, channel):
+        return self.owns(channel) and channel != self.blocked_channel and not self.has_pending(channel)
+
+    def has_pending(self, channel):
+        pending = self.redis_pending.get(channel)
+        if pending is None:
+            return False
+        if pending[1] < time.time():
+            # Never received: expired or dropped in Redis.
+            del self.redis_pending[channel]
+            return False
+        return True
+
+    def add_pending(self, channel):
+        pending = self.redis_pending.setdefault(channel, [0, 0])
+        pending[0] += 1
+        pending[1] = time.time() + self.expiry
+
+    def remove_pending(self, channel):
+        pending = self.redis_pending.get(channel)
+        if pending is not None:
+            pending[0] -= 1
+            if pending[0] <= 0:
+                del self.redis_pending[channel]
+
+    async def receive(self, channel):
+        token = _receiving.set(channel)
+        try:
+            return await super().receive(channel)
+        finally:
+            _receiving.reset(token)
+
+    async def receive_single(self, channel):
+        self.blocked_channel = _receiving.get()
+        try:
+            channel, message = await super().receive_single(channel)
+        finally:
+            self.blocked_channel = None
+        # receive() buffers the message before anything else runs, so local
+        # deliveries resumed from here on queue up behind it.
+        if message.pop(PENDING_KEY, False):
+            # A group message for several of this worker's channels comes
+            # through Redis once, with a list of them.
+            for name in channel if isinstance(channel, list) else [channel]:
+                self.remove_pending(name)
+        return channel, message
+
+    def deliver_local(self, channel, message):
+        buffer = self.receive_buffer[channel]
+        if buffer.qsize() >= self.get_capacity(channel):
+            return False
+        buffer.put_nowait(copy.deepcopy(message))
+        return True
+
+    async def send(self, channel, message):
+        if self.is_local(channel):
+            assert isinstance(message, dict), "message is not a dict"
+            assert self.valid_channel_name(channel), "Channel name not valid"
+            if not self.deliver_local(channel, message):
+                metrics.incr("channel_layer.local_dropped")
+                raise ChannelFull()
+            metrics.incr("channel_layer.local_deliveries")
+            return
+        if not self.owns(channel):
+            return await super().send(channel, message)
+
+        self.add_pending(channel)
+        try:
+            await super().send(channel, {**message, PENDING_KEY: True})
+        except BaseException:
+            self.remove_pending(channel)
+            raise
+
+    async def group_add(self, group, channel):
+        await super().group_add(group, channel)
+        if self.owns(channel):
+            self.local_groups[group][channel] = time.time()
+
+    async def group_discard(self, group, channel):
+        await super().group_discard(group, channel)
+        members = self.local_groups.get(group)
+        if members is not None:
+            members.pop(channel, None)
+            if not members:
+                del self.local_groups[group]
+
+    def local_members(self, group):
+        members = self.local_groups.get(group)
+        if not members:
+            return ()
+        # Expire local members the way Redis expires group entries.
+        cutoff = time.time() - self.group_expiry
+        for channel in [channel for channel, added in members.items() if added < cutoff]:
+            del members[channel]
+        return list(members)
+
+    async def group_send(self, group, message):
+        assert self.valid_group_name(group), "Group name not valid"
+        local = [channel for channel in self.local_members(group) if self.is_local(channel)]
+        delivered = sum(self.deliver_local(channel, message) for channel in local)
+        if delivered:
+            metrics.incr("channel_layer.local_deliveries", delivered)
+        if delivered < len(local):
+            metrics.incr("channel_layer.local_dropped", len(local) - delivered)
+            logger.info("%s of %s local channels over capacity in group %s", len(local) - delivered, len(local), group)
+
+        key = self._group_key(group)
+        connection = self.connection(self.consistent_hash(group))
+        async with connection.pipeline(transaction=False) as pipe:
+            pipe.zremrangebyscore(key, min=0, max=int(time.time()) - self.group_expiry)
+            pipe.zrange(key, 0, -1)
+            _, members = await pipe.execute()
+
+        local = set(local)
+        remote = [channel for channel in (member.decode("utf8") for member in members) if channel not in local]
+        if not remote:
+            return
+        # Own channels end up here while their reader is blocked on Redis or
+        # has messages in flight there.
+        own = [channel for channel in remote if self.owns(channel)]
+        others = [channel for channel in remote if not self.owns(channel)]
+        dropped = 0
+        if own:
+            for channel in own:
+                self.add_pending(channel)
+            dropped += await self.send_to_channels(own, {**message, PENDING_KEY: True})
+        if others:
+            dropped += await self.send_to_channels(others, message)
+        metrics.incr("channel_layer.remote_deliveries", len(remote) - dropped)
+        if dropped:
+            metrics.incr("channel_layer.remote_dropped", dropped)
+            logger.info("%s of %s channels over capacity in group %s", dropped, len(remote), group)
+
+    async def send_to_channels(self, channel_names, message):
+        """
+        Publishes ``message`` to each channel in Redis (channels_redis' group
+        fan-out) and returns how many were over capacity.
+        """
+        connection_to_channel_keys, channel_keys_to_message, channel_keys_to_capacity = (
+            self._map_channel_keys_to_connection(channel_names, message)
+        )
+        over_capacity = 0
+        for connection_index, channel_redis_keys in connection_to_channel_keys.items():
+            connection = self.connection(connection_index)
+            async with connection.pipeline(transaction=False) as pipe:
+                for key in channel_redis_keys:
+                    pipe.zremrangebyscore(key, min=0, max=int(time.time()) - int(self.expiry))
+                await pipe.execute()
+
+            args = [channel_keys_to_message[key] for key in channel_redis_keys]
+            args += [channel_keys_to_capacity[key] for key in channel_redis_keys]
+            args += [time.time(), self.expiry]
+            over_capacity += await connection.eval(GROUP_SEND_LUA, len(channel_redis_keys), *channel_redis_keys, *args)
+        return over_capacity
+
+
+def _ring_hash(value):
+    if isinstance(value, str):
+        value = value.encode("utf8")
+    return int.from_bytes(hashlib.md5(value).digest()[:8], "big")
+
+
+class HashRing:
+    """
+    Consistent hash ring over a list of nodes.
+
+    Each node owns ``replicas`` points on the ring and a key belongs to the
+    first point at or after its hash. Adding or removing a node only moves
+    the keys on that node's arcs, about 1/N of them, where hashing modulo N
+    would move almost all.
+    """
+
+    def __init__(self, nodes, replicas=160):
+        self.nodes = list(nodes)
+        points = sorted(
+            (_ring_hash(f"{node}#{replica}"), index)
+            for index, node in enumerate(self.nodes)
+            for replica in range(replicas)
+        )
+        self.hashes = [point for point, _ in points]
+        self.indexes = [index for _, index in points]
+
+    def get(self, key):
+        """Index in ``nodes`` of the node owning ``key``."""
+        if len(self.nodes) == 1:
+            return 0
+        return self.indexes[bisect.bisect_left(self.hashes, _ring_hash(key)) % len(self.hashes)]
+
+
+def shard_name(host):
+    """host:port[/db] of a channel layer host entry, without credentials."""
+    if "address" in host:
+        address = urllib.parse.urlparse(host["address"])
+        return f"{address.hostname}:{address.port or 6379}{address.path.rstrip('/')}"
+    return f"{host.get('host', 'localhost')}:{host.get('port', 6379)}"
+
+
+class ShardedChannelLayer(HybridChannelLayer):
+    """
+    HybridChannelLayer spread over several Redis shards.
+
+    Groups and worker channels are placed on a shard by a consistent hash
+    ring keyed on the shard's host:port rather than its position in
+    ``hosts``, so adding or removing a shard remaps only the groups on the
+    arcs it gains or loses. Every worker must be configured with the same
+    hosts to agree on placement.
+
+    Per shard it counts the connections handed out and, every
+    ``health_interval`` seconds while the event loop runs, pings the shard
+    and records whether it answered and the round trip in milliseconds.
+    """
+
+    def __init__(self, *args, replicas=160, health_interval=10, health_timeout=1, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.shard_names = [shard_name(host) for host in self.hosts]
+        self.ring = HashRing(self.shard_names, replicas)
+        self.health_interval = health_interval
+        self.health_timeout = health_timeout
+        self.shard_health = {name: {"up": None, "latency_ms": None} for name in self.shard_names}
+        self._monitors = weakref.WeakKeyDictionary()
+        for name in self.shard_names:
+            metrics.register_gauge(f"channel_layer.shard.{name}.up", lambda name=name: self.shard_health[name]["up"])
+            metrics.register_gauge(
+                f"channel_layer.shard.{name}.latency_ms", lambda name=name: self.shard_health[name]["latency_ms"]
+            )
+
+    def consistent_hash(self, value):
+        return self.ring.get(value)
+
+    def connection(self, index):
+        connection = super().connection(index)
+        metrics.incr(f"channel_layer.shard.{self.shard_names[index]}.calls")
+        if self.health_interval:
+            loop = asyncio.get_running_loop()
+            if loop not in self._monitors:
+                self._monitors[loop] = loop.create_task(self.monitor_shards())
+        return connection
+
+    async def monitor_shards(self):
+        while True:
+            await self.check_shards()
+            await asyncio.sleep(self.health_interval)
+
+    async def check_shards(self):
+        """Pings every shard and returns {shard: {"up": bool, "latency_ms": float or None}}."""
+        await asyncio.gather(*(self.check_shard(index) for index in range(self.ring_size)))
+        return self.shard_health
+
+    async def check_shard(self, index):
+        name = self.shard_names[index]
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(super().connection(index).ping(), self.health_timeout)
+        except (RedisError, OSError, asyncio.TimeoutError):
+            self.shard_health[name] = {"up": False, "latency_ms": None}
+            metrics.incr(f"channel_layer.shard.{name}.failures")
+        else:
+            self.shard_health[name] = {"up": True, "latency_ms": round((time.perf_counter() - start) * 1000, 2)}
+
+    async def close_pools(self):
+        monitor = self._monitors.pop(asyncio.get_running_loop(), None)
+        if monitor is not None:
+            monitor.cancel()
+        await super().close_pools()
@@ -0,0 +1,256 @@
+import asyncio
+import collections
+import contextvars
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+from asgiref.sync import ThreadSensitiveContext, iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.http import JsonResponse
+from coverence import metrics
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+# The pool whose checkout the current request or task holds, if any.
+_checked_out = contextvars.ContextVar("db_pool_checked_out", default=None)
+
+
+class ConnectionPool:
+    """
+    Caps how many threads may hold a database connection at once.
+
+    Django keeps one persistent connection per thread, so the pool bounds
+    connections by bounding the threads doing database work: ``arun`` calls
+    run on a dedicated executor of ``max_size`` threads, and every checkout
+    (from that executor or from a request) takes one of ``max_size`` slots,
+    waiting at most ``checkout_timeout`` seconds. Connections are
+    health-checked on checkout and check-in, dropping ones that are broken or
+    past CONN_MAX_AGE. Async checkouts wait on their event loop, not in a
+    thread, so a saturated pool cannot tie up the executor that the requests
+    holding its slots need to finish. Gauges are reported under ``name``.
+    """
+
+    def __init__(self, name, max_size, checkout_timeout):
+        self.name = name
+        self.max_size = max_size
+        self.checkout_timeout = checkout_timeout
+        self.in_use = 0
+        self.waiting = 0
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_time = 0.0
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._lock = threading.Lock()
+        # Async checkouts waiting for a slot, as (loop, future), oldest first.
+        self._waiters = collections.deque()
+        self._executor = ThreadPoolExecutor(max_workers=max_size, thread_name_prefix=name.replace("_", "-"))
+
+        metrics.register_gauge(f"{name}.in_use", lambda: self.in_use)
+        metrics.register_gauge(f"{name}.waiting", lambda: self.waiting)
+        metrics.register_gauge(f"{name}.timeouts", lambda: self.timeouts)
+        metrics.register_gauge(f"{name}.avg_wait_ms", self.avg_wait_ms)
+
+    def avg_wait_ms(self):
+        return self.wait_time / self.checkouts * 1000 if self.checkouts else 0.0
+
+    def _acquire(self):
+        start = time.monotonic()
+        with self._lock:
+            self.waiting += 1
+        acquired = self._slots.acquire(timeout=self.checkout_timeout)
+        with self._lock:
+            self.waiting -= 1
+            if not acquired:
+                raise self._timed_out()
+            self.in_use += 1
+            self.checkouts += 1
+            self.wait_time += time.monotonic() - start
+
+    def _timed_out(self):
+        self.timeouts += 1
+        return PoolTimeout(f"No database connection available within {self.checkout_timeout}s")
+
+    async def _aacquire(self):
+        loop = asyncio.get_running_loop()
+        start = time.monotonic()
+        deadline = start + self.checkout_timeout
+        with self._lock:
+            self.waiting += 1
+        try:
+            while True:
+                with self._lock:
+                    if self._slots.acquire(blocking=False):
+                        self.in_use += 1
+                        self.checkouts += 1
+                        self.wait_time += time.monotonic() - start
+                        return
+                    waiter = loop.create_future()
+                    self._waiters.append((loop, waiter))
+                try:
+                    await asyncio.wait_for(waiter, max(deadline - time.monotonic(), 0))
+                except BaseException as error:
+                    with self._lock:
+                        try:
+                            self._waiters.remove((loop, waiter))
+                        except ValueError:
+                            pass
+                        # Woken for a slot it will not take: pass that on.
+                        if waiter.done() and not waiter.cancelled():
+                            self._wake_next()
+                        if isinstance(error, asyncio.TimeoutError):
+                            raise self._timed_out() from None
+                    raise
+        finally:
+            with self._lock:
+                self.waiting -= 1
+
+    def _wake_next(self):
+        # Called with self._lock held.
+        while self._waiters:
+            loop, waiter = self._waiters.popleft()
+            try:
+                loop.call_soon_threadsafe(self._wake, waiter)
+                return
+            except RuntimeError:
+                # That loop is closed; its waiter is gone too.
+                continue
+
+    def _wake(self, waiter):
+        if waiter.done():
+            with self._lock:
+                self._wake_next()
+        else:
+            waiter.set_result(None)
+
+    def _release(self):
+        with self._lock:
+            self.in_use -= 1
+            self._slots.release()
+            self._wake_next()
+
+    @contextmanager
+    def checkout(self):
+        self._acquire()
+        token = _checked_out.set(self)
+        close_old_connections()
+        try:
+            yield
+        finally:
+            close_old_connections()
+            _checked_out.reset(token)
+            self._release()
+
+    @asynccontextmanager
+    async def acheckout(self):
+        await self._aacquire()
+        token = _checked_out.set(self)
+        try:
+            yield
+        finally:
+            _checked_out.reset(token)
+            self._release()
+
+    @asynccontextmanager
+    async def adetached_checkout(self):
+        """
+        A checkout for async work that runs outside any request, such as a
+        task shared by several: it gets its own thread for thread-sensitive
+        calls, and that thread's connections are closed afterwards, as Django
+        does at the end of a request.
+        """
+        async with ThreadSensitiveContext(), self.acheckout():
+            try:
+                yield
+            finally:
+                await sync_to_async(close_old_connections)()
+
+    def run(self, func, *args, **kwargs):
+        with self.checkout():
+            return func(*args, **kwargs)
+
+    def _run_covered(self, func, *args, **kwargs):
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+
+    async def arun(self, func, *args, **kwargs):
+        # Inside one of this pool's checkouts (an async request), that
+        # checkout already covers the call; taking a second slot could
+        # deadlock once every slot is held by a request waiting for another.
+        run = self._run_covered if _checked_out.get() is self else self.run
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, functools.partial(run, func, *args, **kwargs)
+        )
+
+    def stats(self):
+        return {
+            "max_size": self.max_size,
+            "in_use": self.in_use,
+            "waiting": self.waiting,
+            "checkouts": self.checkouts,
+            "timeouts": self.timeouts,
+            "avg_wait_ms": self.avg_wait_ms(),
+        }
+
+
+# HTTP requests and websocket consumers draw from separate pools, so a burst
+# of requests cannot starve the sockets of connections, nor the other way round.
+pool = ConnectionPool("db_pool", settings.DB_POOL_MAX_SIZE, settings.DB_POOL_CHECKOUT_TIMEOUT)
+consumer_pool = ConnectionPool(
+    "db_pool.consumers", settings.DB_POOL_CONSUMER_MAX_SIZE, settings.DB_POOL_CHECKOUT_TIMEOUT
+)
+
+
+def database_sync_to_async(func):
+    """
+    Drop-in for channels' database_sync_to_async that runs on a bounded pool:
+    the one whose checkout the caller holds (an async request's), otherwise
+    the consumers' pool.
+    """
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await (_checked_out.get() or consumer_pool).arun(func, *args, **kwargs)
+
+    return wrapper
+
+
+def _pool_exhausted():
+    return JsonResponse({"detail": "Service temporarily unavailable."}, status=503)
+
+
+class PoolCheckoutMiddleware:
+    """Holds a pool slot for the duration of each HTTP request."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        try:
+            with pool.checkout():
+                return self.get_response(request)
+        except PoolTimeout:
+            return _pool_exhausted()
+
+    async def __acall__(self, request):
+        try:
+            async with pool.acheckout():
+                return await self.get_response(request)
+        except PoolTimeout:
+            return _pool_exhausted()
@@ -0,0 +1,170 @@
+import contextvars
+import functools
+import random
+import time
+from contextlib import contextmanager
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+from coverence import metrics
+
+# Reads only go to a replica inside a replica_reads()/use_replica() block, and
+# never for a user who wrote within the last REPLICA_STICKY_SECONDS. Writes are
+# marked where they enter: ReplicaRoutingMiddleware for unsafe requests, and
+# explicit mark_write() calls elsewhere (websocket consumers).
+_replica_ok = contextvars.ContextVar("replica_ok", default=False)
+_user_id = contextvars.ContextVar("replica_user_id", default=None)
+_sticky = contextvars.ContextVar("replica_sticky", default=None)
+
+_unhealthy_until = {}
+_last_checked = {}
+
+
+def _sticky_key(user_id):
+    return f"db:sticky:{user_id}"
+
+
+def mark_write(user_id=None):
+    user_id = user_id or _user_id.get()
+    if user_id is not None:
+        cache.set(_sticky_key(user_id), 1, settings.REPLICA_STICKY_SECONDS)
+    _sticky.set(True)
+
+
+def _is_sticky():
+    sticky = _sticky.get()
+    if sticky is None:
+        user_id = _user_id.get()
+        sticky = bool(user_id is not None and cache.get(_sticky_key(user_id)))
+        _sticky.set(sticky)
+    return sticky
+
+
+def _healthy(alias):
+    now = time.monotonic()
+    if _unhealthy_until.get(alias, 0) > now:
+        return False
+    if now - _last_checked.get(alias, 0) < settings.REPLICA_HEALTH_CHECK_INTERVAL:
+        return True
+
+    _last_checked[alias] = now
+    try:
+        connections[alias].ensure_connection()
+        healthy = connections[alias].is_usable()
+    except Exception:
+        healthy = False
+    if not healthy:
+        _unhealthy_until[alias] = now + settings.REPLICA_RETRY_SECONDS
+        metrics.incr(f"db_router.unhealthy.{alias}")
+    return healthy
+
+
+def pick_replica():
+    replicas = [alias for alias in settings.DATABASE_REPLICAS if _healthy(alias)]
+    return random.choice(replicas) if replicas else None
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if not _replica_ok.get() or _is_sticky():
+            return "default"
+        alias = pick_replica()
+        if alias is None:
+            metrics.incr("db_router.replica_fallback")
+            return "default"
+        return alias
+
+    def db_for_write(self, model, **hints):
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas mirror the primary, so objects from any alias may relate.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == "default"
+
+
+@contextmanager
+def use_replica(user_id=None):
+    replica_token = _replica_ok.set(True)
+    user_token = _user_id.set(user_id) if user_id is not None else None
+    sticky_token = _sticky.set(None)
+    try:
+        yield
+    finally:
+        _sticky.reset(sticky_token)
+        if user_token is not None:
+            _user_id.reset(user_token)
+        _replica_ok.reset(replica_token)
+
+
+def replica_reads(method):
+    """Lets a view method (sync or async) read from a replica."""
+
+    if iscoroutinefunction(method):
+        @functools.wraps(method)
+        async def async_wrapper(self, request, *args, **kwargs):
+            with use_replica(request.user.id):
+                return await method(self, request, *args, **kwargs)
+        return async_wrapper
+
+    @functools.wraps(method)
+    def wrapper(self, request, *args, **kwargs):
+        with use_replica(getattr(request.user, "id", None)):
+            return method(self, request, *args, **kwargs)
+    return wrapper
+
+
+def _token_user_id(request):
+    header = request.headers.get("Authorization", "")
+    parts = header.split()
+    if len(parts) != 2 or parts[0] not in api_settings.AUTH_HEADER_TYPES:
+        return None
+    try:
+        return AccessToken(parts[1]).get(api_settings.USER_ID_CLAIM)
+    except TokenError:
+        return None
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Remembers who is making the request so writes can pin that user to the
+    primary, and pins anyone who sends an unsafe request.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = _user_id.set(_token_user_id(request))
+        try:
+            response = self.get_response(request)
+            self._pin_unsafe(request)
+            return response
+        finally:
+            _user_id.reset(token)
+
+    async def __acall__(self, request):
+        token = _user_id.set(_token_user_id(request))
+        try:
+            response = await self.get_response(request)
+            self._pin_unsafe(request)
+            return response
+        finally:
+            _user_id.reset(token)
+
+    def _pin_unsafe(self, request):
+        if request.method not in ("GET", "HEAD", "OPTIONS"):
+            mark_write()
@@ -0,0 +1,51 @@
+import copy
+
+
+def _snapshot(value):
+    # JSON fields hand out dicts and lists that can be changed in place.
+    return copy.deepcopy(value) if isinstance(value, (dict, list)) else value
+
+
+class DirtyFieldsMixin:
+    """
+    Model mixin that remembers the column values an instance was loaded with,
+    so that ``save()`` on an existing row writes only the columns that changed
+    (and nothing at all when none did). Passing ``update_fields`` explicitly
+    still wins.
+    """
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = {name: _snapshot(value) for name, value in zip(field_names, values)}
+        return instance
+
+    def dirty_fields(self):
+        """Names of the fields whose value differs from the stored one (fields never loaded count as changed once set)."""
+        loaded = self._loaded_values
+        dirty = []
+        for field in self._meta.concrete_fields:
+            if field.primary_key or field.attname not in self.__dict__:
+                continue
+            if field.attname not in loaded or loaded[field.attname] != self.__dict__[field.attname]:
+                dirty.append(field.name)
+        return dirty
+
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        super().refresh_from_db(using=using, fields=fields, **kwargs)
+        fields = None if fields is None else set(fields)
+        loaded = self.__dict__.setdefault("_loaded_values", {})
+        for field in self._meta.concrete_fields:
+            if field.attname in self.__dict__ and (fields is None or {field.name, field.attname} & fields):
+                loaded[field.attname] = _snapshot(self.__dict__[field.attname])
+
+    def save(self, *args, update_fields=None, **kwargs):
+        if update_fields is None and hasattr(self, "_loaded_values"):
+            update_fields = self.dirty_fields()
+        super().save(*args, update_fields=update_fields, **kwargs)
+        saved = self._meta.concrete_fields if update_fields is None else [
+            self._meta.get_field(name) for name in update_fields
+        ]
+        loaded = self.__dict__.setdefault("_loaded_values", {})
+        for field in saved:
+            loaded[field.attname] = _snapshot(getattr(self, field.attname))
@@ -0,0 +1,69 @@
+import threading
+import time
+from collections import OrderedDict
+from coverence import metrics
+
+_missing = object()
+
+
+class LRUCache:
+    """
+    Bounded, thread-safe in-process LRU cache that reports its hit rate.
+
+    With ``ttl`` set, entries also expire that many seconds after they were
+    stored. Other workers cannot invalidate this worker's entries, so data
+    that can change elsewhere needs a ttl to bound how stale it gets.
+    """
+
+    def __init__(self, name, maxsize, ttl=None):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        metrics.register_gauge(f"cache.{name}.hit_rate", self.hit_rate)
+        metrics.register_gauge(f"cache.{name}.size", lambda: len(self._data))
+
+    def get(self, key, default=None):
+        with self._lock:
+            expires, value = self._data.get(key, (None, _missing))
+            if expires is not None and expires < time.monotonic():
+                del self._data[key]
+                value = _missing
+            if value is _missing:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        expires = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self):
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hit_rate(),
+        }
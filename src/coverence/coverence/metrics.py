@@ -0,0 +1,34 @@
+import threading
+from collections import defaultdict
+from rest_framework.views import APIView
+from rest_framework.response import Response
+from rest_framework.permissions import IsAdminUser
+
+# Process-local counters and gauges; every worker reports its own numbers.
+_lock = threading.Lock()
+_counters = defaultdict(int)
+_gauges = {}
+
+
+def incr(name, amount=1):
+    with _lock:
+        _counters[name] += amount
+
+
+def register_gauge(name, func):
+    _gauges[name] = func
+
+
+def snapshot():
+    with _lock:
+        data = dict(_counters)
+    for name, func in _gauges.items():
+        data[name] = func()
+    return data
+
+
+class MetricsView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(snapshot())
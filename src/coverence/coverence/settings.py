@@ -57,19 +57,125 @@ ASGI_APPLICATION = 'coverence.asgi.application'
 redis_url = os.environ.get("REDIS_URL", "redis://127.0.0.1:6379")
 url = urllib.parse.urlparse(redis_url)
 
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': redis_url,
+    },
+}
+
+# coverence.channel_layers.ShardedChannelLayer delivers to sockets on the same
+# worker in memory and only goes through Redis for the others. Groups and
+# channels are spread over the comma-separated CHANNEL_REDIS_URLS (REDIS_URL by
+# default) by a consistent hash ring, so adding a shard moves about 1/N of them.
+channel_redis_urls = [
+    urllib.parse.urlparse(shard.strip())
+    for shard in os.environ.get("CHANNEL_REDIS_URLS", redis_url).split(",")
+]
+
 CHANNEL_LAYERS = {
     'default': {
-        'BACKEND': 'channels_redis.core.RedisChannelLayer',
+        'BACKEND': os.environ.get("CHANNEL_LAYER_BACKEND", 'coverence.channel_layers.ShardedChannelLayer'),
         'CONFIG': {
             "hosts": [{
-                "host": url.hostname,
-                "port": url.port,
-                "password": url.password, 
-            }],
+                "host": shard.hostname,
+                "port": shard.port,
+                "password": shard.password, 
+            } for shard in channel_redis_urls],
         },
     },
 }
 
+# Socket churn: at most CHAT_MAX_HANDSHAKES connections per worker go through
+# authentication and connect() at once; up to CHAT_HANDSHAKE_QUEUE_SIZE more
+# wait up to CHAT_HANDSHAKE_QUEUE_TIMEOUT seconds, the rest are told to retry.
+# On CHAT_DRAIN_SIGNAL a worker stops taking sockets and closes its open ones
+# over CHAT_DRAIN_WINDOW seconds (send it before stopping the worker), each
+# told to reconnect after a random CHAT_RECONNECT_MIN_MS..MAX_MS.
+CHAT_MAX_HANDSHAKES = int(os.environ.get("CHAT_MAX_HANDSHAKES", "32"))
+CHAT_HANDSHAKE_QUEUE_SIZE = int(os.environ.get("CHAT_HANDSHAKE_QUEUE_SIZE", "256"))
+CHAT_HANDSHAKE_QUEUE_TIMEOUT = float(os.environ.get("CHAT_HANDSHAKE_QUEUE_TIMEOUT", "5"))
+CHAT_DRAIN_SIGNAL = os.environ.get("CHAT_DRAIN_SIGNAL", "SIGUSR1")
+CHAT_DRAIN_WINDOW = float(os.environ.get("CHAT_DRAIN_WINDOW", "30"))
+CHAT_RECONNECT_MIN_MS = int(os.environ.get("CHAT_RECONNECT_MIN_MS", "500"))
+CHAT_RECONNECT_MAX_MS = int(os.environ.get("CHAT_RECONNECT_MAX_MS", "15000"))
+
+# Typing indicators: repeated "typing: true" frames are forwarded at most once
+# per refresh interval, and typing expires after the timeout without frames.
+CHAT_TYPING_REFRESH_INTERVAL = float(os.environ.get("CHAT_TYPING_REFRESH_INTERVAL", "3"))
+CHAT_TYPING_TIMEOUT = float(os.environ.get("CHAT_TYPING_TIMEOUT", "6"))
+
+# Inbound socket frames: (tokens per second, burst) per event type, checked
+# per connection and per user across all of that user's sockets on a worker.
+CHAT_RATE_LIMITS = {
+    "message": (5, 10),
+    "typing": (4, 8),
+    "default": (5, 10),
+}
+CHAT_USER_RATE_LIMITS = {
+    "message": (10, 20),
+    "typing": (8, 16),
+    "default": (10, 20),
+}
+
+# Outbound socket frames queued per connection before the slow-consumer
+# policy kicks in: "drop" discards new frames, "disconnect" closes the socket.
+CHAT_SEND_QUEUE_SIZE = int(os.environ.get("CHAT_SEND_QUEUE_SIZE", "100"))
+CHAT_SLOW_CONSUMER_POLICY = os.environ.get("CHAT_SLOW_CONSUMER_POLICY", "drop")
+
+# Presence: a user's notification sockets count as online for this long after
+# the last refresh. Offline users get no live pushes, only a digest of at most
+# CHAT_DIGEST_MAX_SENDERS senders (previews cut to CHAT_DIGEST_PREVIEW_CHARS)
+# when they next connect. Digests are cached for up to
+# CHAT_DIGEST_CACHE_SECONDS while nothing new arrives.
+CHAT_PRESENCE_TTL = int(os.environ.get("CHAT_PRESENCE_TTL", "90"))
+CHAT_DIGEST_MAX_SENDERS = int(os.environ.get("CHAT_DIGEST_MAX_SENDERS", "20"))
+CHAT_DIGEST_PREVIEW_CHARS = int(os.environ.get("CHAT_DIGEST_PREVIEW_CHARS", "140"))
+CHAT_DIGEST_CACHE_SECONDS = int(os.environ.get("CHAT_DIGEST_CACHE_SECONDS", "600"))
+
+# In-process LRU sizes for user cards and user pair -> chat room lookups.
+# Saves only invalidate the saving worker's card cache, so cards also expire
+# after USER_CARD_CACHE_SECONDS everywhere else.
+USER_CARD_CACHE_SIZE = int(os.environ.get("USER_CARD_CACHE_SIZE", "10000"))
+USER_CARD_CACHE_SECONDS = int(os.environ.get("USER_CARD_CACHE_SECONDS", "60"))
+CHAT_ROOM_CACHE_SIZE = int(os.environ.get("CHAT_ROOM_CACHE_SIZE", "50000"))
+# Maximum number of ids accepted by the batch user-card endpoint.
+USER_CARDS_BATCH_LIMIT = int(os.environ.get("USER_CARDS_BATCH_LIMIT", "100"))
+
+# Rows fetched per server-side cursor round trip (and per streamed chunk)
+# by the message export endpoints.
+CHAT_EXPORT_CHUNK_SIZE = int(os.environ.get("CHAT_EXPORT_CHUNK_SIZE", "500"))
+
+# Message search (chat.search): the PostgreSQL text search configuration used
+# for Message.search_vector, and the default/maximum results per page.
+CHAT_SEARCH_CONFIG = os.environ.get("CHAT_SEARCH_CONFIG", "simple")
+CHAT_SEARCH_PAGE_SIZE = int(os.environ.get("CHAT_SEARCH_PAGE_SIZE", "20"))
+CHAT_SEARCH_MAX_PAGE_SIZE = int(os.environ.get("CHAT_SEARCH_MAX_PAGE_SIZE", "100"))
+
+# Incremental sync (chat/sync/): at most SYNC_MAX_CHANGES changes per
+# response (the client asks again while has_more is set). The compact_changes
+# command drops changes older than SYNC_CHANGE_RETENTION_DAYS; a client that
+# has not synced for longer gets a full snapshot.
+SYNC_MAX_CHANGES = int(os.environ.get("SYNC_MAX_CHANGES", "500"))
+SYNC_CHANGE_RETENTION_DAYS = float(os.environ.get("SYNC_CHANGE_RETENTION_DAYS", "14"))
+
+# Serve history, recent chats, notifications and unseen counts from the
+# async-native views (chat.async_views, users.async_views) under ASGI.
+ASYNC_READ_VIEWS = os.environ.get("ASYNC_READ_VIEWS", "True") == "True"
+
+# Identical concurrent reads of recent chats and profiles (same user, URL and
+# parameters) share one computation (coverence.single_flight). With
+# SINGLE_FLIGHT_TTL > 0 the result is also reused for that many seconds
+# within the worker, at the cost of serving it that much out of date.
+SINGLE_FLIGHT_TTL = float(os.environ.get("SINGLE_FLIGHT_TTL", "0"))
+
+# Bounded database access: at most DB_POOL_MAX_SIZE threads per worker hold a
+# connection for HTTP requests at once, and DB_POOL_CONSUMER_MAX_SIZE more for
+# websocket consumers; callers wait up to DB_POOL_CHECKOUT_TIMEOUT seconds.
+DB_POOL_MAX_SIZE = int(os.environ.get("DB_POOL_MAX_SIZE", "10"))
+DB_POOL_CONSUMER_MAX_SIZE = int(os.environ.get("DB_POOL_CONSUMER_MAX_SIZE", "5"))
+DB_POOL_CHECKOUT_TIMEOUT = float(os.environ.get("DB_POOL_CHECKOUT_TIMEOUT", "5"))
+
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
@@ -79,6 +185,8 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'coverence.db_pool.PoolCheckoutMiddleware',
+    'coverence.db_router.ReplicaRoutingMiddleware',
 ]
 
 CORS_ALLOWED_ORIGINS = [
@@ -104,8 +212,17 @@ REST_FRAMEWORK = {
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(hours=10),  
     'REFRESH_TOKEN_LIFETIME': timedelta(days=7),
+    'TOKEN_OBTAIN_SERIALIZER': 'users.serializers.ClaimsTokenObtainPairSerializer',
 }
 
+# How long a user's current token version is trusted before it is re-read;
+# revoke_tokens() clears it immediately.
+TOKEN_VERSION_CACHE_SECONDS = int(os.environ.get("TOKEN_VERSION_CACHE_SECONDS", "300"))
+
+# Cached profile versions and representations (users.profile_cache) expire
+# after this long even if nothing bumps the version.
+PROFILE_CACHE_SECONDS = int(os.environ.get("PROFILE_CACHE_SECONDS", "3600"))
+
 
 
 
@@ -117,6 +234,26 @@ CLOUDINARY_STORAGE = {
 
 DEFAULT_FILE_STORAGE = 'cloudinary_storage.storage.MediaCloudinaryStorage'
 
+MEDIA_URL = '/media/'
+MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# Absolute base that locally stored renditions are published under, so their
+# URLs are complete when written (e.g. "https://coverence.example.com/media/").
+MEDIA_PUBLIC_URL = os.environ.get("MEDIA_PUBLIC_URL", MEDIA_URL)
+
+# Profile image uploads are staged on local disk and processed by a small
+# worker pool into renditions, stored through PROFILE_IMAGE_STORAGE
+# (users.image_storage.LocalFileSystemStorage keeps them under MEDIA_ROOT).
+PROFILE_IMAGE_STORAGE = os.environ.get("PROFILE_IMAGE_STORAGE", "users.image_storage.CloudinaryStorage")
+PROFILE_IMAGE_STAGING_DIR = os.environ.get("PROFILE_IMAGE_STAGING_DIR", os.path.join(BASE_DIR, 'image_staging'))
+PROFILE_IMAGE_WORKERS = int(os.environ.get("PROFILE_IMAGE_WORKERS", "2"))
+PROFILE_IMAGE_FORMAT = os.environ.get("PROFILE_IMAGE_FORMAT", "WEBP")
+PROFILE_IMAGE_QUALITY = int(os.environ.get("PROFILE_IMAGE_QUALITY", "82"))
+PROFILE_IMAGE_SIZES = {
+    "sm": 64,
+    "md": 256,
+    "lg": 1024,
+}
+
 
 
 ROOT_URLCONF = 'coverence.urls'
@@ -147,10 +284,34 @@ DATABASES = {
     'default': dj_database_url.config(
         default=os.environ.get('DATABASE_URL'),
         conn_max_age=600,
+        conn_health_checks=True,
         ssl_require=True 
     )
 }
 
+# Read replicas, e.g. DATABASE_REPLICA_URLS=postgres://replica1/db,postgres://replica2/db
+# (sqlite:////tmp/replica.sqlite3 works for local testing). Designated read
+# endpoints and consumer lookups use them; see coverence.db_router.
+DATABASE_REPLICAS = []
+for index, replica_url in enumerate(filter(None, os.environ.get("DATABASE_REPLICA_URLS", "").split(","))):
+    alias = f"replica_{index}"
+    DATABASES[alias] = dj_database_url.parse(
+        replica_url,
+        conn_max_age=600,
+        conn_health_checks=True,
+        ssl_require=not replica_url.startswith("sqlite"),
+    )
+    DATABASES[alias]["TEST"] = {"MIRROR": "default"}
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['coverence.db_router.ReplicaRouter']
+
+# A user who wrote reads from the primary for this long afterwards.
+REPLICA_STICKY_SECONDS = int(os.environ.get("REPLICA_STICKY_SECONDS", "5"))
+# How often a replica's health is probed, and how long a failed one is skipped.
+REPLICA_HEALTH_CHECK_INTERVAL = float(os.environ.get("REPLICA_HEALTH_CHECK_INTERVAL", "10"))
+REPLICA_RETRY_SECONDS = float(os.environ.get("REPLICA_RETRY_SECONDS", "30"))
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -169,6 +330,21 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Passwords are hashed in PASSWORD_HASH_WORKERS processes per worker (see
+# users.hashing), as many hashes at a time; up to PASSWORD_HASH_QUEUE_SIZE
+# more wait up to PASSWORD_HASH_QUEUE_TIMEOUT seconds, the rest get a 503.
+# PASSWORD_HASHER=argon2 (needs argon2-cffi) hashes new passwords with
+# Argon2; existing PBKDF2 hashes are upgraded on the user's next login.
+PASSWORD_HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS", "2"))
+PASSWORD_HASH_QUEUE_SIZE = int(os.environ.get("PASSWORD_HASH_QUEUE_SIZE", "64"))
+PASSWORD_HASH_QUEUE_TIMEOUT = float(os.environ.get("PASSWORD_HASH_QUEUE_TIMEOUT", "10"))
+PASSWORD_HASHERS = [
+    'users.hashing.PBKDF2PasswordHasher',
+    'users.hashing.Argon2PasswordHasher',
+]
+if os.environ.get("PASSWORD_HASHER", "pbkdf2") == "argon2":
+    PASSWORD_HASHERS.reverse()
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/4.2/topics/i18n/
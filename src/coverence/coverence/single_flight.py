@@ -0,0 +1,111 @@
+import asyncio
+import contextvars
+import threading
+import time
+from coverence import metrics
+from coverence.lru import LRUCache
+
+_missing = object()
+
+
+def request_key(request):
+    """Identifies a read by user, URL and query parameters (in any order)."""
+    params = tuple(sorted((name, tuple(values)) for name, values in request.GET.lists()))
+    return request.user.id, request.build_absolute_uri(request.path), params
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent computations within the worker.
+
+    While one caller computes the value for a key, other callers with the same
+    key wait for it and share its result (or exception) instead of repeating
+    the work. Threads (``run``) and coroutines on the event loop (``arun``)
+    are coalesced separately; a shared coroutine runs as a task in a fresh
+    context, so it sees none of the leader's context variables (its pool
+    checkout, replica routing) and must set up its own. With ``ttl`` set, results are also reused for
+    that many seconds from a bounded cache. Results are shared, so callers
+    must not modify them.
+    """
+
+    def __init__(self, name, ttl=0, maxsize=10000):
+        self.name = name
+        self.ttl = ttl
+        self.cache = LRUCache(f"single_flight.{name}", maxsize) if ttl > 0 else None
+        self._calls = {}
+        self._tasks = {}
+        self._lock = threading.Lock()
+
+    def _cached(self, key):
+        if self.cache is None:
+            return _missing
+        entry = self.cache.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            return _missing
+        metrics.incr(f"single_flight.{self.name}.cached")
+        return entry[1]
+
+    def _store(self, key, value):
+        if self.cache is not None:
+            self.cache.set(key, (time.monotonic() + self.ttl, value))
+
+    def run(self, key, func):
+        value = self._cached(key)
+        if value is not _missing:
+            return value
+
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            metrics.incr(f"single_flight.{self.name}.coalesced")
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        metrics.incr(f"single_flight.{self.name}.computed")
+        try:
+            call.result = func()
+            self._store(key, call.result)
+            return call.result
+        except BaseException as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    async def arun(self, key, func):
+        value = self._cached(key)
+        if value is not _missing:
+            return value
+
+        task = self._tasks.get(key)
+        if task is None:
+            metrics.incr(f"single_flight.{self.name}.computed")
+            task = self._tasks[key] = asyncio.get_running_loop().create_task(func(), context=contextvars.Context())
+            task.add_done_callback(lambda done: self._finished(key, done))
+        else:
+            metrics.incr(f"single_flight.{self.name}.coalesced")
+        # A caller that goes away must not cancel the work for the others.
+        return await asyncio.shield(task)
+
+    def _finished(self, key, task):
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        if not task.cancelled() and task.exception() is None:
+            self._store(key, task.result())
@@ -0,0 +1,220 @@
+import datetime
+import itertools
+import random
+import time
+from django.contrib.auth.models import User
+from django.db import transaction
+from chat.models import ChatRoom, Message
+from chat.search import index_messages
+from users.models import Notification, UserActivity, UserProfile
+
+# Synthetic datasets for profiling and benchmarks. Rows are written with
+# bulk_create in batches, so no per-row signals run, and everything but the
+# primary keys is determined by the seed. Activity is skewed the way chat
+# traffic is: a few users and rooms carry most of it (Zipf weights), and only
+# recent messages and notifications are unread.
+SCALES = {
+    "small": {"users": 200, "messages": 10_000},
+    "medium": {"users": 2_000, "messages": 100_000},
+    "large": {"users": 10_000, "messages": 1_000_000},
+    "xlarge": {"users": 50_000, "messages": 10_000_000},
+}
+
+# Timestamps end here rather than at the current time, so that a seed always
+# gives the same dataset.
+DEFAULT_END = datetime.datetime(2025, 1, 1, tzinfo=datetime.timezone.utc)
+
+FIRST_NAMES = ["Ada", "Alan", "Grace", "Linus", "Margaret", "Ken", "Barbara", "Dennis", "Frances", "Edsger", "Radia", "Guido"]
+LAST_NAMES = ["Lovelace", "Turing", "Hopper", "Torvalds", "Hamilton", "Thompson", "Liskov", "Ritchie", "Allen", "Dijkstra", "Perlman", "Rossum"]
+SKILLS = ["Python", "Django", "React", "Guitar", "Spanish", "Drawing", "Cooking", "Chess", "Photography", "Statistics", "Piano", "Writing"]
+TIMES = ["Weekday evenings", "Weekends", "Mornings", "Flexible"]
+
+
+def make_vocabulary(size, rng):
+    syllables = ["ka", "lo", "mi", "ren", "ta", "vo", "shi", "nu", "pe", "dra", "el", "os"]
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(syllables) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+def zipf_cum_weights(count, exponent=1.0):
+    """Cumulative weights for random.choices where rank r is drawn with weight 1 / r**exponent."""
+    return list(itertools.accumulate(1 / rank ** exponent for rank in range(1, count + 1)))
+
+
+def bulk_create_with_timestamps(model, rows, field):
+    """
+    bulk_create for a model whose ``field`` is auto_now_add: the rows are
+    inserted (which stamps them with the current time) and their own values
+    are written back afterwards.
+    """
+    values = [getattr(row, field) for row in rows]
+    created = model.objects.bulk_create(rows)
+    for row, value in zip(created, values):
+        setattr(row, field, value)
+    model.objects.bulk_update(created, [field])
+    return created
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(itertools.islice(iterator, size)):
+        yield batch
+
+
+def generate(
+    users,
+    messages,
+    rooms_per_user=8,
+    notifications_per_user=5,
+    vocabulary=20000,
+    days=90,
+    seed=0,
+    batch_size=5000,
+    prefix="synth",
+    index=True,
+    end=DEFAULT_END,
+    log=None,
+):
+    """
+    Creates ``users`` users (usernames ``<prefix>_<n>``) with profiles and
+    activity rows, rooms between them, ``messages`` messages over the last
+    ``days`` days before ``end`` (indexed for search unless ``index`` is
+    false) and notifications.
+
+    Returns {"users": [user ids], "rooms": [room ids], "vocabulary": [words,
+    most frequent first]}.
+    """
+    rng = random.Random(seed)
+    log = log or (lambda line: None)
+    start = end - datetime.timedelta(days=days)
+    span = (end - start).total_seconds()
+    words = make_vocabulary(vocabulary, rng)
+    rng.shuffle(words)
+
+    def stage(name, count, func):
+        began = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - began
+        log(f"{name}: {count} in {elapsed:.1f} s ({count / elapsed if elapsed else 0:.0f}/s)")
+        return result
+
+    user_ids = stage("users", users, lambda: _users(users, prefix, start, end, days, batch_size, rng))
+    room_pairs = _room_pairs(user_ids, rooms_per_user, rng)
+    room_ids = stage("rooms", len(room_pairs), lambda: _rooms(room_pairs, start, days, batch_size, rng))
+    stage("messages", messages, lambda: _messages(
+        room_ids, room_pairs, messages, words, start, span, end, index, batch_size, rng
+    ))
+    count = users * notifications_per_user
+    stage("notifications", count, lambda: _notifications(user_ids, count, start, span, end, batch_size, rng))
+    return {"users": user_ids, "rooms": room_ids, "vocabulary": words}
+
+
+def _users(count, prefix, start, end, days, batch_size, rng):
+    user_ids = []
+    for batch in batched(range(count), batch_size):
+        with transaction.atomic():
+            created = User.objects.bulk_create(
+                User(
+                    username=f"{prefix}_{i}",
+                    email=f"{prefix}_{i}@example.com",
+                    first_name=rng.choice(FIRST_NAMES),
+                    last_name=rng.choice(LAST_NAMES),
+                    password="!",
+                    date_joined=start - datetime.timedelta(days=rng.uniform(0, 3 * days)),
+                )
+                for i in batch
+            )
+            ids = [user.id for user in created]
+            UserProfile.objects.bulk_create(
+                UserProfile(
+                    user_id=user_id,
+                    bio=f"Here to learn {rng.choice(SKILLS).lower()}.",
+                    skill_known=", ".join(rng.sample(SKILLS, rng.randint(1, 3))),
+                    skill_wanted=", ".join(rng.sample(SKILLS, rng.randint(1, 3))),
+                    available_time=rng.choice(TIMES),
+                    updated_at=start,
+                )
+                for user_id in ids
+            )
+            # Most users were seen recently, a long tail not for weeks.
+            UserActivity.objects.bulk_create(
+                UserActivity(user_id=user_id, last_seen=end - datetime.timedelta(hours=rng.expovariate(1 / 48)))
+                for user_id in ids
+            )
+        user_ids += ids
+    return user_ids
+
+
+def _room_pairs(user_ids, rooms_per_user, rng):
+    # Partners are drawn by popularity, so some users are in many rooms.
+    popular = user_ids[:]
+    rng.shuffle(popular)
+    weights = zipf_cum_weights(len(popular), 0.8)
+    pairs = set()
+    for user_id in user_ids:
+        for other in rng.choices(popular, cum_weights=weights, k=rng.randint(1, 2 * rooms_per_user)):
+            if other != user_id:
+                pairs.add((min(user_id, other), max(user_id, other)))
+    return sorted(pairs)
+
+
+def _rooms(pairs, start, days, batch_size, rng):
+    room_ids = []
+    for batch in batched(pairs, batch_size):
+        with transaction.atomic():
+            room_ids += [room.id for room in bulk_create_with_timestamps(ChatRoom, [
+                ChatRoom(user1_id=a, user2_id=b, created_at=start - datetime.timedelta(days=rng.uniform(0, days)))
+                for a, b in batch
+            ], "created_at")]
+    return room_ids
+
+
+def _messages(room_ids, room_pairs, count, words, start, span, end, index, batch_size, rng):
+    # A few rooms are very busy and most are quiet.
+    order = list(range(len(room_ids)))
+    rng.shuffle(order)
+    room_weights = zipf_cum_weights(len(order), 1.1)
+    word_weights = zipf_cum_weights(len(words))
+    unread_after = end - datetime.timedelta(days=2)
+
+    for batch in batched(range(count), batch_size):
+        rows = []
+        for i, room in zip(batch, rng.choices(order, cum_weights=room_weights, k=len(batch))):
+            # Ids follow time, as they do for live messages.
+            timestamp = start + datetime.timedelta(seconds=span * i / count)
+            rows.append(Message(
+                room_id=room_ids[room],
+                sender_id=room_pairs[room][rng.random() < 0.5],
+                content=" ".join(rng.choices(words, cum_weights=word_weights, k=rng.randint(3, 20))),
+                timestamp=timestamp,
+                is_seen=timestamp < unread_after or rng.random() < 0.3,
+            ))
+        with transaction.atomic():
+            created = bulk_create_with_timestamps(Message, rows, "timestamp")
+            if index:
+                index_messages(((message.id, message.room_id, message.content) for message in created), replace=False)
+
+
+def _notifications(user_ids, count, start, span, end, batch_size, rng):
+    recipients = user_ids[:]
+    rng.shuffle(recipients)
+    weights = zipf_cum_weights(len(recipients))
+    unread_after = end - datetime.timedelta(days=3)
+
+    for batch in batched(range(count), batch_size):
+        rows = []
+        for i, to_user in zip(batch, rng.choices(recipients, cum_weights=weights, k=len(batch))):
+            created_at = start + datetime.timedelta(seconds=span * i / count)
+            read = created_at < unread_after
+            rows.append(Notification(
+                to_user_id=to_user,
+                from_user_id=rng.choice(user_ids),
+                notification_type=rng.choice(("comment", "like")),
+                created_at=created_at,
+                is_read=read,
+                is_seen=read or rng.random() < 0.5,
+            ))
+        with transaction.atomic():
+            bulk_create_with_timestamps(Notification, rows, "created_at")
@@ -0,0 +1,17 @@
+from django.test import TestCase
+from coverence.synthetic import DEFAULT_END, generate
+
+
+class SyntheticDataTestCase(TestCase):
+    """
+    A small seeded synthetic dataset (see coverence.synthetic), created once
+    per test class, for query budget tests that need skewed data rather than
+    a couple of hand-made rows. ``self.dataset`` is what generate() returned;
+    ``dataset_options`` overrides its arguments.
+    """
+
+    dataset_options = {"users": 40, "messages": 800, "index": False}
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.dataset = generate(prefix="test", end=DEFAULT_END, **cls.dataset_options)
@@ -0,0 +1,467 @@
+import asyncio
+import os
+import socket
+import threading
+import time
+import unittest
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connections, router
+from django.db.models import Max
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TransactionTestCase, override_settings
+from chat.models import ChatRoom, Message
+from coverence import db_pool, db_router, metrics
+from coverence.channel_layers import HashRing, HybridChannelLayer, ShardedChannelLayer, shard_name
+from coverence.db_pool import ConnectionPool, PoolCheckoutMiddleware, PoolTimeout
+from coverence.db_router import ReplicaRoutingMiddleware, use_replica
+from coverence.single_flight import SingleFlight, request_key
+from coverence.synthetic import DEFAULT_END
+from coverence.testing import SyntheticDataTestCase
+from rest_framework_simplejwt.tokens import AccessToken
+from users.models import Notification
+
+# The channel layer tests need a Redis they may flush, e.g.
+# TEST_REDIS_URL=redis://localhost:6379/15; they are skipped without one.
+TEST_REDIS_URL = os.environ.get("TEST_REDIS_URL")
+
+
+# A second alias standing in for a read replica, configured the way settings
+# configures DATABASE_REPLICA_URLS (a test mirror of default). It is added on
+# import so that the test runner sets it up; only ReplicaRouterTests use it,
+# without wrapping transactions, which on SQLite would lock the mirror out.
+REPLICA_ALIAS = "replica_test"
+connections.settings.setdefault(REPLICA_ALIAS, {**connections.settings["default"], "TEST": {"MIRROR": "default"}})
+
+
+def redis_available():
+    if not TEST_REDIS_URL:
+        return False
+    url = urllib.parse.urlparse(TEST_REDIS_URL)
+    try:
+        socket.create_connection((url.hostname, url.port or 6379), timeout=1).close()
+    except OSError:
+        return False
+    return True
+
+
+class HashRingTests(SimpleTestCase):
+    keys = [f"chat_{i}" for i in range(5000)]
+
+    def test_single_node(self):
+        self.assertEqual({HashRing(["a:6379"]).get(key) for key in self.keys}, {0})
+
+    def test_keys_spread_over_nodes(self):
+        ring = HashRing(["a:6379", "b:6379", "c:6379"])
+        counts = [0, 0, 0]
+        for key in self.keys:
+            counts[ring.get(key)] += 1
+        self.assertTrue(all(count > len(self.keys) / 6 for count in counts), counts)
+
+    def test_adding_a_node_moves_few_keys(self):
+        before = HashRing(["a:6379", "b:6379", "c:6379"])
+        after = HashRing(["a:6379", "b:6379", "c:6379", "d:6379"])
+        moved = sum(before.nodes[before.get(key)] != after.nodes[after.get(key)] for key in self.keys)
+        self.assertLess(moved / len(self.keys), 0.4)
+
+    def test_placement_ignores_host_order(self):
+        ring = HashRing(["a:6379", "b:6379"])
+        reversed_ring = HashRing(["b:6379", "a:6379"])
+        for key in self.keys[:100]:
+            self.assertEqual(ring.nodes[ring.get(key)], reversed_ring.nodes[reversed_ring.get(key)])
+
+    def test_shard_name(self):
+        self.assertEqual(shard_name({"address": "redis://:secret@cache:6380/2"}), "cache:6380/2")
+        self.assertEqual(shard_name({"host": "cache"}), "cache:6379")
+
+
+@unittest.skipUnless(redis_available(), "TEST_REDIS_URL is not set or not reachable")
+class HybridChannelLayerTests(SimpleTestCase):
+    async def asyncSetUp(self):
+        self.layer = HybridChannelLayer(hosts=[TEST_REDIS_URL])
+        self.other_worker = HybridChannelLayer(hosts=[TEST_REDIS_URL])
+        await self.layer.flush()
+
+    async def receive_all(self, layer, channel):
+        messages = []
+        while True:
+            try:
+                messages.append(await asyncio.wait_for(layer.receive(channel), 0.5))
+            except asyncio.TimeoutError:
+                return messages
+
+    def run_async(self, test):
+        async def wrapper():
+            await self.asyncSetUp()
+            try:
+                await test()
+            finally:
+                await self.layer.flush()
+                await self.layer.close_pools()
+                await self.other_worker.close_pools()
+
+        asyncio.run(wrapper())
+
+    def test_group_send_reaches_every_member_once(self):
+        async def test():
+            first, second = await self.layer.new_channel(), await self.layer.new_channel()
+            remote = await self.other_worker.new_channel()
+            for layer, channel in ((self.layer, first), (self.layer, second), (self.other_worker, remote)):
+                await layer.group_add("room", channel)
+            await self.layer.group_send("room", {"type": "hello", "n": 1})
+            await self.other_worker.group_send("room", {"type": "hello", "n": 2})
+            # Each worker's own messages arrive in order; across workers they
+            # may not (a local delivery can beat a message still in Redis).
+            for layer, channel in ((self.layer, first), (self.layer, second), (self.other_worker, remote)):
+                self.assertEqual(sorted(message["n"] for message in await self.receive_all(layer, channel)), [1, 2])
+            self.assertEqual(self.layer.redis_pending, {})
+
+        self.run_async(test)
+
+    def test_order_is_kept_behind_messages_in_redis(self):
+        async def test():
+            channel = await self.layer.new_channel()
+            await self.layer.group_add("room", channel)
+            # As if the worker's reader were waiting on Redis for this channel.
+            self.layer.blocked_channel = channel
+            await self.layer.send(channel, {"type": "chat", "n": 1})
+            await self.layer.group_send("room", {"type": "chat", "n": 2})
+            self.layer.blocked_channel = None
+            await self.layer.send(channel, {"type": "chat", "n": 3})
+            await self.layer.group_send("room", {"type": "chat", "n": 4})
+            messages = await self.receive_all(self.layer, channel)
+            self.assertEqual([message["n"] for message in messages], [1, 2, 3, 4])
+            self.assertNotIn("__hybrid_pending__", messages[0])
+            self.assertEqual(self.layer.redis_pending, {})
+
+        self.run_async(test)
+
+    def test_local_drops_are_counted(self):
+        async def test():
+            self.layer.capacity = 2
+            channel = await self.layer.new_channel()
+            await self.layer.group_add("room", channel)
+            before = metrics.snapshot()
+            for n in range(3):
+                await self.layer.group_send("room", {"type": "chat", "n": n})
+            after = metrics.snapshot()
+            for name, count in (("local_deliveries", 2), ("local_dropped", 1)):
+                key = f"channel_layer.{name}"
+                self.assertEqual(after.get(key, 0) - before.get(key, 0), count)
+            self.assertEqual(len(await self.receive_all(self.layer, channel)), 2)
+
+        self.run_async(test)
+
+
+@unittest.skipUnless(redis_available(), "TEST_REDIS_URL is not set or not reachable")
+class ShardedChannelLayerTests(SimpleTestCase):
+    def test_group_send_across_shards(self):
+        # Two databases of the same Redis stand in for two shards.
+        url = urllib.parse.urlparse(TEST_REDIS_URL)
+        hosts = [f"redis://{url.netloc}/{db}" for db in (14, 15)]
+
+        async def test():
+            layers = [ShardedChannelLayer(hosts=hosts, health_interval=0) for _ in range(2)]
+            try:
+                channels = [await layer.new_channel() for layer in layers]
+                groups = [f"room_{i}" for i in range(20)]
+                for group in groups:
+                    for layer, channel in zip(layers, channels):
+                        await layer.group_add(group, channel)
+                self.assertEqual({layers[0].consistent_hash(group) for group in groups}, {0, 1})
+                for group in groups:
+                    await layers[0].group_send(group, {"type": "hello", "group": group})
+                for layer, channel in zip(layers, channels):
+                    received = [(await layer.receive(channel))["group"] for _ in groups]
+                    self.assertEqual(sorted(received), sorted(groups))
+                health = await layers[0].check_shards()
+                self.assertTrue(all(shard["up"] for shard in health.values()))
+            finally:
+                await layers[0].flush()
+                for layer in layers:
+                    await layer.close_pools()
+
+        asyncio.run(test())
+
+
+class SyntheticDatasetTests(SyntheticDataTestCase):
+    def test_timestamps_kept(self):
+        # Generated timestamps survive the models' auto_now_add.
+        for model, field in ((ChatRoom, "created_at"), (Message, "timestamp"), (Notification, "created_at")):
+            with self.subTest(model=model.__name__):
+                self.assertLessEqual(model.objects.aggregate(latest=Max(field))["latest"], DEFAULT_END)
+
+    def test_auto_now_add_left_alone(self):
+        self.assertTrue(Message._meta.get_field("timestamp").auto_now_add)
+        room = ChatRoom.objects.get(id=self.dataset["rooms"][0])
+        message = Message.objects.create(room=room, sender_id=room.user1_id, content="now")
+        self.assertGreater(message.timestamp, DEFAULT_END)
+
+    def test_counts(self):
+        self.assertEqual(len(self.dataset["users"]), 40)
+        self.assertEqual(Message.objects.filter(room_id__in=self.dataset["rooms"]).count(), 800)
+
+
+class ConnectionPoolTests(SimpleTestCase):
+    def make_pool(self, max_size=1, checkout_timeout=0.2):
+        pool = ConnectionPool("db_pool.test", max_size, checkout_timeout)
+        self.addCleanup(pool._executor.shutdown)
+        return pool
+
+    def hold(self, pool):
+        """Takes a slot from another thread until the returned event is set."""
+        taken, release = threading.Event(), threading.Event()
+
+        def run():
+            with pool.checkout():
+                taken.set()
+                release.wait(5)
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        taken.wait(5)
+        self.addCleanup(thread.join)
+        self.addCleanup(release.set)
+        return release
+
+    def test_checkout_and_release(self):
+        pool = self.make_pool(2)
+        with pool.checkout():
+            self.assertEqual(pool.in_use, 1)
+        self.assertEqual(pool.in_use, 0)
+
+        async def run():
+            async with pool.acheckout():
+                self.assertEqual(pool.in_use, 1)
+                self.assertIs(db_pool._checked_out.get(), pool)
+            self.assertIsNone(db_pool._checked_out.get())
+
+        async_to_sync(run)()
+        self.assertEqual((pool.in_use, pool.checkouts), (0, 2))
+
+    async def test_async_waiter_gets_slot_released_by_thread(self):
+        pool = self.make_pool()
+        release = self.hold(pool)
+        waiting = asyncio.ensure_future(self.checkout_once(pool))
+        await asyncio.sleep(0.02)
+        self.assertFalse(waiting.done())
+        self.assertEqual(pool.waiting, 1)
+        release.set()
+        await asyncio.wait_for(waiting, 1)
+        self.assertEqual((pool.in_use, pool.checkouts), (0, 2))
+
+    async def test_timeout(self):
+        pool = self.make_pool(checkout_timeout=0.05)
+        self.hold(pool)
+        with self.assertRaises(PoolTimeout):
+            async with pool.acheckout():
+                pass
+        with self.assertRaises(PoolTimeout):
+            pool.run(lambda: None)
+        self.assertEqual((pool.timeouts, pool.waiting), (2, 0))
+
+    async def test_waiters_leave_default_executor_free(self):
+        pool = self.make_pool(checkout_timeout=2)
+        release = self.hold(pool)
+        waiters = [asyncio.ensure_future(self.checkout_once(pool)) for _ in range(64)]
+        await asyncio.sleep(0.02)
+        # More waiters than the default executor has threads, and it still runs work.
+        loop = asyncio.get_running_loop()
+        self.assertEqual(await asyncio.wait_for(loop.run_in_executor(None, lambda: 42), 1), 42)
+        release.set()
+        await asyncio.wait_for(asyncio.gather(*waiters), 5)
+        self.assertEqual((pool.in_use, pool.waiting, pool.timeouts), (0, 0, 0))
+
+    async def checkout_once(self, pool):
+        async with pool.acheckout():
+            await asyncio.sleep(0)
+
+    async def test_cancelled_checkout_gives_up_its_turn(self):
+        pool = self.make_pool()
+        release = self.hold(pool)
+        cancelled = asyncio.ensure_future(self.checkout_once(pool))
+        waiting = asyncio.ensure_future(self.checkout_once(pool))
+        await asyncio.sleep(0.02)
+        cancelled.cancel()
+        release.set()
+        await asyncio.wait_for(waiting, 1)
+        self.assertTrue(cancelled.cancelled())
+        self.assertEqual((pool.in_use, pool.waiting, len(pool._waiters)), (0, 0, 0))
+
+    async def test_arun_inside_checkout_reuses_it(self):
+        pool = self.make_pool()
+        async with pool.acheckout():
+            result = await asyncio.wait_for(pool.arun(lambda: db_pool._checked_out.get()), 1)
+        # The call ran covered by the request's checkout instead of waiting for a second slot.
+        self.assertIsNone(result)
+        self.assertEqual(pool.checkouts, 1)
+        self.assertIs(await pool.arun(lambda: db_pool._checked_out.get()), pool)
+        self.assertEqual(pool.checkouts, 2)
+
+    def test_middleware_returns_503_when_exhausted(self):
+        pool = self.make_pool(checkout_timeout=0.05)
+        self.hold(pool)
+        request = RequestFactory().get("/")
+
+        async def view(request):
+            return HttpResponse()
+
+        with mock.patch.object(db_pool, "pool", pool):
+            sync_response = PoolCheckoutMiddleware(lambda request: HttpResponse())(request)
+            async_response = async_to_sync(PoolCheckoutMiddleware(view))(request)
+        self.assertEqual((sync_response.status_code, async_response.status_code), (503, 503))
+
+
+class SingleFlightTests(SimpleTestCase):
+    async def test_concurrent_callers_share_one_call(self):
+        flight = SingleFlight("test")
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return {"value": 1}
+
+        results = await asyncio.gather(*(flight.arun("key", compute) for _ in range(10)))
+        self.assertEqual(len(calls), 1)
+        self.assertTrue(all(result is results[0] for result in results))
+        self.assertEqual(flight._tasks, {})
+
+    def test_threads_share_one_call(self):
+        flight = SingleFlight("test")
+        calls = []
+        started = threading.Event()
+
+        def compute():
+            calls.append(1)
+            started.set()
+            time.sleep(0.05)
+            return 1
+
+        with ThreadPoolExecutor(4) as executor:
+            leader = executor.submit(flight.run, "key", compute)
+            started.wait(1)
+            followers = [executor.submit(flight.run, "key", compute) for _ in range(3)]
+            self.assertEqual([leader.result()] + [future.result() for future in followers], [1] * 4)
+        self.assertEqual(len(calls), 1)
+
+    async def test_errors_reach_every_caller(self):
+        flight = SingleFlight("test")
+
+        async def compute():
+            await asyncio.sleep(0.01)
+            raise ValueError("boom")
+
+        results = await asyncio.gather(*(flight.arun("key", compute) for _ in range(3)), return_exceptions=True)
+        self.assertTrue(all(isinstance(result, ValueError) for result in results))
+
+    async def test_leader_cancellation_leaves_followers_the_result(self):
+        flight = SingleFlight("test")
+
+        async def compute():
+            await asyncio.sleep(0.05)
+            return 1
+
+        leader = asyncio.ensure_future(flight.arun("key", compute))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(flight.arun("key", compute))
+        await asyncio.sleep(0)
+        leader.cancel()
+        self.assertEqual(await follower, 1)
+        self.assertTrue(leader.cancelled())
+
+    async def test_shared_call_runs_in_fresh_context(self):
+        flight = SingleFlight("test")
+        seen = []
+
+        async def compute():
+            seen.append((db_pool._checked_out.get(), db_router._replica_ok.get()))
+            async with db_pool.pool.acheckout():
+                return db_pool._checked_out.get() is db_pool.pool
+
+        with use_replica(1):
+            async with db_pool.pool.acheckout():
+                self.assertTrue(await flight.arun("key", compute))
+        self.assertEqual(seen, [(None, False)])
+
+    async def test_ttl_cache(self):
+        flight = SingleFlight("test", ttl=60)
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            return 1
+
+        self.assertEqual([await flight.arun("key", compute) for _ in range(3)], [1] * 3)
+        self.assertEqual(len(calls), 1)
+
+    def test_request_key(self):
+        factory = RequestFactory()
+
+        def key(user_id, path):
+            request = factory.get(path)
+            request.user = mock.Mock(id=user_id)
+            return request_key(request)
+
+        self.assertEqual(key(1, "/api/chat/recent/?a=1&b=2"), key(1, "/api/chat/recent/?b=2&a=1"))
+        self.assertNotEqual(key(1, "/api/chat/recent/"), key(2, "/api/chat/recent/"))
+        self.assertNotEqual(key(1, "/api/chat/recent/?a=1"), key(1, "/api/chat/recent/?a=2"))
+        self.assertNotEqual(key(1, "/api/chat/recent/"), key(1, "/api/chat/search/"))
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+    DATABASE_REPLICAS=[REPLICA_ALIAS],
+    REPLICA_HEALTH_CHECK_INTERVAL=0,
+)
+class ReplicaRouterTests(TransactionTestCase):
+    replica = REPLICA_ALIAS
+    databases = {"default", REPLICA_ALIAS}
+
+    def setUp(self):
+        cache.clear()
+        db_router._unhealthy_until.clear()
+        db_router._last_checked.clear()
+
+    def test_reads_use_replica_only_when_allowed(self):
+        self.assertEqual(User.objects.all().db, "default")
+        with use_replica(1):
+            self.assertEqual(User.objects.all().db, self.replica)
+            self.assertFalse(User.objects.filter(username="nobody").exists())
+            self.assertEqual(router.db_for_write(User), "default")
+        self.assertEqual(User.objects.all().db, "default")
+
+    def test_read_your_writes(self):
+        with use_replica(1):
+            db_router.mark_write(1)
+            self.assertEqual(User.objects.all().db, "default")
+        with use_replica(1):
+            self.assertEqual(User.objects.all().db, "default")
+        with use_replica(2):
+            self.assertEqual(User.objects.all().db, self.replica)
+
+    def test_writes_do_not_touch_the_cache(self):
+        with use_replica(1), mock.patch.object(db_router, "cache") as router_cache:
+            User.objects.create_user("ada", "ada@example.com", "pw")
+        router_cache.set.assert_not_called()
+
+    def test_unhealthy_replica_falls_back_to_default(self):
+        with mock.patch.object(connections[self.replica], "ensure_connection", side_effect=OSError("down")):
+            with use_replica(1):
+                self.assertEqual(User.objects.all().db, "default")
+        # Not probed again until REPLICA_RETRY_SECONDS have passed.
+        with use_replica(1):
+            self.assertEqual(User.objects.all().db, "default")
+
+    def test_middleware_pins_unsafe_requests(self):
+        token = AccessToken.for_user(User.objects.create_user("ada", "ada@example.com", "pw"))
+        middleware = ReplicaRoutingMiddleware(lambda request: HttpResponse())
+        factory = RequestFactory()
+        middleware(factory.get("/", HTTP_AUTHORIZATION=f"Bearer {token}"))
+        self.assertIsNone(cache.get(db_router._sticky_key(token["user_id"])))
+        middleware(factory.post("/", HTTP_AUTHORIZATION=f"Bearer {token}"))
+        self.assertTrue(cache.get(db_router._sticky_key(token["user_id"])))
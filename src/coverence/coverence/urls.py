@@ -3,6 +3,7 @@ from django.urls import path, include
 from django.http import HttpResponse
 from django.conf import settings
 from django.conf.urls.static import static
+from coverence.metrics import MetricsView
 from rest_framework_simplejwt.views import (
     TokenObtainPairView,
     TokenRefreshView,
@@ -20,7 +21,8 @@ urlpatterns = [
     path('', home),  
     path('api/users/', include('users.urls')),
     path('api/', include('chat.urls')), 
+    path('api/metrics/', MetricsView.as_view(), name='metrics'),
 
-]
+] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
 
 
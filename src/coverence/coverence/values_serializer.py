@@ -0,0 +1,63 @@
+import operator
+from rest_framework import serializers
+
+_datetime_field = serializers.DateTimeField()
+
+
+class ValuesSerializer:
+    """
+    Read-only serializer for high-volume lists, built on values_list() rows.
+
+    ``fields`` maps each output key, in output order, to one of:
+
+    * a column path, e.g. ``"sender__email"``;
+    * a ``(method_name, column, ...)`` tuple, whose method is called with
+      those columns (like a SerializerMethodField);
+    * a nested ValuesSerializer class, read through the relation of the
+      same name.
+
+    Every column is fetched in a single query, and each field is compiled
+    once into an extractor over the row tuple, so a row costs one dict
+    comprehension instead of a pass through DRF's field machinery.
+    """
+
+    fields = {}
+
+    def __init__(self, context=None, prefix="", columns=None):
+        self.context = context or {}
+        self.columns = [] if columns is None else columns
+        self.extractors = [(name, self._compile(prefix, name, source)) for name, source in self.fields.items()]
+
+    def _index(self, column):
+        if column not in self.columns:
+            self.columns.append(column)
+        return self.columns.index(column)
+
+    def _compile(self, prefix, name, source):
+        if isinstance(source, str):
+            return operator.itemgetter(self._index(prefix + source))
+
+        if isinstance(source, type) and issubclass(source, ValuesSerializer):
+            nested = source(self.context, f"{prefix}{name}__", self.columns)
+            return nested.to_representation
+
+        method = getattr(self, source[0])
+        indexes = [self._index(prefix + column) for column in source[1:]]
+        if len(indexes) == 1:
+            getter = operator.itemgetter(indexes[0])
+            return lambda row: method(getter(row))
+        getter = operator.itemgetter(*indexes)
+        return lambda row: method(*getter(row))
+
+    def to_representation(self, row):
+        return {name: extract(row) for name, extract in self.extractors}
+
+    def serialize(self, queryset):
+        return [self.to_representation(row) for row in queryset.values_list(*self.columns)]
+
+    async def aserialize(self, queryset):
+        return [self.to_representation(row) async for row in queryset.values_list(*self.columns)]
+
+    def format_datetime(self, value):
+        # Same formatting as a DRF DateTimeField ("Z" for UTC, current timezone).
+        return _datetime_field.to_representation(value)
@@ -0,0 +1,67 @@
+from django.http import JsonResponse
+from django.views import View
+from rest_framework import exceptions
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from coverence.db_pool import database_sync_to_async
+from .authentication import ClaimsUser, acurrent_token_version
+from .models import Notification
+from .notifications import mark_notifications_seen
+from .serializers import NotificationValuesSerializer
+
+
+class AsyncAPIView(View):
+    """
+    Plain Django async view for hot read endpoints.
+
+    DRF's APIView only runs synchronous handlers, so these views authenticate
+    the JWT themselves (from its claims, as StatelessJWTAuthentication does)
+    and use the async ORM end to end instead of being pushed through a sync
+    thread adapter. Authentication failures get the same 401 response, body
+    and WWW-Authenticate header as the DRF views.
+    """
+
+    authenticator = JWTAuthentication()
+
+    async def authenticate(self, request):
+        header = self.authenticator.get_header(request)
+        raw_token = self.authenticator.get_raw_token(header) if header else None
+        if raw_token is None:
+            raise exceptions.NotAuthenticated()
+
+        user = ClaimsUser(self.authenticator.get_validated_token(raw_token))
+        if not user.is_active:
+            raise AuthenticationFailed("User is inactive", code="user_inactive")
+        if user.token_version != await acurrent_token_version(user.id):
+            raise AuthenticationFailed("Token has been revoked", code="token_revoked")
+        return user
+
+    def authentication_failed(self, request, exc):
+        # As DRF's exception handler renders it.
+        data = exc.detail if isinstance(exc.detail, (list, dict)) else {"detail": exc.detail}
+        response = JsonResponse(data, status=exc.status_code, safe=False)
+        response["WWW-Authenticate"] = self.authenticator.authenticate_header(request)
+        return response
+
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            request.user = await self.authenticate(request)
+        except (exceptions.AuthenticationFailed, exceptions.NotAuthenticated) as exc:
+            return self.authentication_failed(request, exc)
+        return await super().dispatch(request, *args, **kwargs)
+
+
+class AsyncNotificationView(AsyncAPIView):
+    async def get(self, request):
+        await database_sync_to_async(mark_notifications_seen)(request.user.id)
+        notifications = Notification.objects.filter(to_user_id=request.user.id).order_by('-created_at')
+        serializer = NotificationValuesSerializer(context={'request': request})
+        return JsonResponse(await serializer.aserialize(notifications), safe=False)
+
+
+class AsyncUnseenNotificationCountView(AsyncAPIView):
+    async def get(self, request):
+        unseen_total_count = await Notification.objects.filter(to_user_id=request.user.id, is_seen=False).acount()
+        return JsonResponse({
+            'unseen_count': unseen_total_count
+        })
@@ -0,0 +1,90 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db.models import F
+from django.utils.functional import cached_property
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.models import TokenUser
+from .models import UserProfile
+from .profile_cache import bump_profile_version
+
+
+def _token_version_key(user_id):
+    return f"token_version:{user_id}"
+
+
+def current_token_version(user_id):
+    version = cache.get(_token_version_key(user_id))
+    if version is None:
+        version = UserProfile.objects.filter(user_id=user_id).values_list("token_version", flat=True).first() or 0
+        cache.set(_token_version_key(user_id), version, settings.TOKEN_VERSION_CACHE_SECONDS)
+    return version
+
+
+async def acurrent_token_version(user_id):
+    version = await cache.aget(_token_version_key(user_id))
+    if version is None:
+        version = await UserProfile.objects.filter(user_id=user_id).values_list("token_version", flat=True).afirst() or 0
+        await cache.aset(_token_version_key(user_id), version, settings.TOKEN_VERSION_CACHE_SECONDS)
+    return version
+
+
+def revoke_tokens(user_id):
+    """Invalidates every token issued to the user so far."""
+    UserProfile.objects.filter(user_id=user_id).update(token_version=F("token_version") + 1)
+    cache.delete(_token_version_key(user_id))
+    bump_profile_version(user_id)
+
+
+class ClaimsUser(TokenUser):
+    """
+    Request user built from the claims embedded at login, without a query.
+
+    Anything the claims do not carry is looked up on the full ``User``, which
+    is loaded on first use only.
+    """
+
+    @cached_property
+    def first_name(self):
+        return self.token.get("first_name", "")
+
+    @cached_property
+    def last_name(self):
+        return self.token.get("last_name", "")
+
+    @cached_property
+    def is_active(self):
+        return self.token.get("active", True)
+
+    @cached_property
+    def token_version(self):
+        return self.token.get("tv", 0)
+
+    @cached_property
+    def instance(self):
+        # A token outlives its user; the request is then unauthenticated
+        # rather than failing wherever the user is first looked at.
+        try:
+            return User.objects.get(id=self.id)
+        except User.DoesNotExist:
+            raise AuthenticationFailed("User not found", code="user_not_found") from None
+
+    def __getattr__(self, attr):
+        if attr.startswith("_"):
+            raise AttributeError(attr)
+        if attr in self.token.payload:
+            return self.token[attr]
+        return getattr(self.instance, attr)
+
+
+class StatelessJWTAuthentication(JWTAuthentication):
+    """JWT authentication that trusts the token's claims instead of loading the user."""
+
+    def get_user(self, validated_token):
+        user = ClaimsUser(validated_token)
+        if not user.is_active:
+            raise AuthenticationFailed("User is inactive", code="user_inactive")
+        if user.token_version != current_token_version(user.id):
+            raise AuthenticationFailed("Token has been revoked", code="token_revoked")
+        return user
@@ -0,0 +1,34 @@
+from django.conf import settings
+
+# One place that decides which URL represents a user's avatar. Rendition URLs
+# are complete when they are stored (see users.images), and an unprocessed
+# Cloudinary upload is addressed from its stored path, so resolving an avatar
+# never needs the Cloudinary SDK or the request.
+CLOUDINARY_BASE_URL = f"https://res.cloudinary.com/{settings.CLOUDINARY_STORAGE['CLOUD_NAME']}/"
+
+
+def original_url(image):
+    if not image:
+        return None
+    path = image if isinstance(image, str) else image.get_prep_value()
+    return path if path.startswith(("http://", "https://")) else f"{CLOUDINARY_BASE_URL}{path}"
+
+
+def avatar_url(profile, size):
+    """URL of ``profile``'s avatar at ``size``, falling back to the original upload."""
+    if profile is None:
+        return None
+    return resolve_avatar(profile.image_renditions, profile.profile_image, size)
+
+
+def resolve_avatar(renditions, image, size):
+    # Same as avatar_url, from the raw column values of a profile.
+    rendition = renditions.get(size) if renditions else None
+    return rendition["url"] if rendition else original_url(image)
+
+
+def absolute_url(url, request):
+    # Only renditions stored under a relative MEDIA_PUBLIC_URL need the host.
+    if url and request is not None and url.startswith("/"):
+        return request.build_absolute_uri(url)
+    return url
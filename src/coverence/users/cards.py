@@ -0,0 +1,61 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from coverence.lru import LRUCache
+from .serializers import PublicUserValuesSerializer
+
+# Lightweight "user card": what PublicUserSerializer renders (with a
+# host-relative avatar URL), so cached cards can stand in for it anywhere a
+# list of users is rendered. Cards are always filled from the primary, so a
+# lagging replica can never put a stale card back into the cache right after
+# an invalidation, and they expire after USER_CARD_CACHE_SECONDS so changes
+# made through other workers show up too.
+card_cache = LRUCache("user_cards", settings.USER_CARD_CACHE_SIZE, settings.USER_CARD_CACHE_SECONDS)
+
+
+card_serializer = PublicUserValuesSerializer()
+
+
+def display_name(card):
+    return f"{card['first_name']} {card['last_name']}"
+
+
+def _cached_cards(user_ids):
+    cards = {}
+    missing = []
+    for user_id in user_ids:
+        card = card_cache.get(user_id)
+        if card is None:
+            missing.append(user_id)
+        else:
+            cards[user_id] = card
+    return cards, missing
+
+
+def get_user_cards(user_ids):
+    cards, missing = _cached_cards(user_ids)
+
+    if missing:
+        for card in card_serializer.serialize(User.objects.using("default").filter(id__in=missing)):
+            card_cache.set(card["id"], card)
+            cards[card["id"]] = card
+
+    return cards
+
+
+async def aget_user_cards(user_ids):
+    cards, missing = _cached_cards(user_ids)
+
+    if missing:
+        for card in await card_serializer.aserialize(User.objects.using("default").filter(id__in=missing)):
+            card_cache.set(card["id"], card)
+            cards[card["id"]] = card
+
+    return cards
+
+
+def get_user_card(user_id):
+    return get_user_cards([int(user_id)]).get(int(user_id))
+
+
+def invalidate_user_card(user_id):
+    card_cache.delete(user_id)
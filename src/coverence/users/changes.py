@@ -0,0 +1,97 @@
+from collections import defaultdict
+from django.core import signing
+from django.db import IntegrityError, transaction
+from django.db.models import F, Max
+from django.utils import timezone
+from .models import ChangeLog, ChangeLogEntry
+
+# Per-user change log behind incremental sync (chat.sync). Every change a user
+# should hear about gets the next number in that user's sequence; numbers are
+# taken under a lock on the user's ChangeLog row, so they commit in order and
+# a client that has seen everything up to N never misses a change below N.
+#
+# The log keeps only the latest change per object (kind, key): recording a
+# change again moves the entry forward instead of adding one. Entries older
+# than SYNC_CHANGE_RETENTION_DAYS are dropped by compact_changes(), which
+# raises the user's floor; clients behind the floor get a full snapshot.
+ROOM = "room"
+MESSAGE = "message"
+READ = "read"
+NOTIFICATION = "notification"
+
+TOKEN_SALT = "users.changes"
+
+
+def make_token(user_id, seq):
+    return signing.dumps([user_id, seq], salt=TOKEN_SALT)
+
+
+def read_token(user_id, token):
+    """The sequence number in ``token``, or None if it is invalid or another user's."""
+    try:
+        token_user_id, seq = signing.loads(token, salt=TOKEN_SALT)
+    except (signing.BadSignature, TypeError, ValueError):
+        return None
+    return seq if token_user_id == user_id and isinstance(seq, int) else None
+
+
+def _advance(user_id, count):
+    """Takes ``count`` sequence numbers for the user and returns the last one."""
+    if not ChangeLog.objects.filter(user_id=user_id).update(seq=F("seq") + count):
+        try:
+            with transaction.atomic():
+                ChangeLog.objects.create(user_id=user_id, seq=count)
+            return count
+        except IntegrityError:
+            ChangeLog.objects.filter(user_id=user_id).update(seq=F("seq") + count)
+    return ChangeLog.objects.filter(user_id=user_id).values_list("seq", flat=True).get()
+
+
+def record_changes(changes):
+    """Records ``(user_id, kind, key)`` changes, in the caller's transaction if there is one."""
+    by_user = defaultdict(dict)
+    for user_id, kind, key in changes:
+        by_user[user_id][(kind, key)] = None
+    changed_at = timezone.now()
+
+    entries = []
+    # No savepoint: a failure here has to roll back the caller's change too.
+    with transaction.atomic(savepoint=False):
+        # Users in id order, so concurrent writers lock them in the same order.
+        for user_id in sorted(by_user):
+            keys = list(by_user[user_id])
+            first = _advance(user_id, len(keys)) - len(keys)
+            entries += [
+                ChangeLogEntry(user_id=user_id, kind=kind, key=key, seq=first + i, changed_at=changed_at)
+                for i, (kind, key) in enumerate(keys, 1)
+            ]
+        ChangeLogEntry.objects.bulk_create(
+            entries, update_conflicts=True, unique_fields=["user", "kind", "key"], update_fields=["seq", "changed_at"]
+        )
+
+
+def log_head(user_id):
+    """Returns (seq, floor) of the user's change log."""
+    return ChangeLog.objects.filter(user_id=user_id).values_list("seq", "floor").first() or (0, 0)
+
+
+def changes_between(user_id, after, upto, limit):
+    """Up to ``limit`` (seq, kind, key) changes with after < seq <= upto, oldest first."""
+    return list(
+        ChangeLogEntry.objects.filter(user_id=user_id, seq__gt=after, seq__lte=upto)
+        .order_by("seq").values_list("seq", "kind", "key")[:limit]
+    )
+
+
+def compact_changes(before):
+    """Drops entries last changed before ``before``, raising each user's floor past them. Returns the count."""
+    floors = (
+        ChangeLogEntry.objects.filter(changed_at__lt=before)
+        .values("user_id").annotate(floor=Max("seq")).values_list("user_id", "floor")
+    )
+    deleted = 0
+    for user_id, floor in list(floors):
+        with transaction.atomic():
+            ChangeLog.objects.filter(user_id=user_id, floor__lt=floor).update(floor=floor)
+            deleted += ChangeLogEntry.objects.filter(user_id=user_id, seq__lte=floor).delete()[0]
+    return deleted
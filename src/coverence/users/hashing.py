@@ -0,0 +1,150 @@
+import atexit
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import django
+from django.conf import settings
+from django.contrib.auth import hashers
+from django.utils.module_loading import import_string
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from coverence import metrics
+
+# Password hashing is CPU-bound for tens to hundreds of milliseconds, and in a
+# server thread it holds the GIL that every other request in the worker
+# needs. The hashers below run encode() and verify() in a small process pool
+# instead; the calling thread only waits. Everything that hashes (login, the
+# decoy hash for unknown users, signup, set_password, rehash on login) goes
+# through the hashers, so nothing else has to know about the pool.
+
+
+class HashingBusy(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "Too many sign-ins at the moment, try again shortly."
+    default_code = "hashing_busy"
+
+
+def _call(hasher_path, method, *args):
+    return getattr(import_string(hasher_path)(), method)(*args)
+
+
+class HashPool:
+    """
+    Runs hashing jobs on ``workers`` processes, ``workers`` at a time.
+
+    Callers beyond that wait up to ``queue_timeout`` seconds for a turn, and
+    at most ``queue_size`` of them wait at once; the rest get HashingBusy. The
+    processes are started on first use, from a fresh interpreter (forking a
+    threaded server process is not safe). If one of them dies (OOM, a
+    signal), the pool is replaced and the job retried once. The pool is shut
+    down at exit.
+    """
+
+    def __init__(self, workers, queue_size, queue_timeout):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.waiting = 0
+        self._slots = threading.BoundedSemaphore(workers)
+        self._lock = threading.Lock()
+        self._executor = None
+
+        metrics.register_gauge("auth.hash.in_flight", lambda: self.in_flight)
+        metrics.register_gauge("auth.hash.waiting", lambda: self.waiting)
+        atexit.register(self.shutdown)
+
+    @property
+    def executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=django.setup,
+                )
+            return self._executor
+
+    def _acquire(self):
+        start = time.monotonic()
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                if self.waiting >= self.queue_size:
+                    metrics.incr("auth.hash.rejected")
+                    raise HashingBusy()
+                self.waiting += 1
+            acquired = self._slots.acquire(timeout=self.queue_timeout)
+            with self._lock:
+                self.waiting -= 1
+            if not acquired:
+                metrics.incr("auth.hash.rejected")
+                raise HashingBusy()
+        with self._lock:
+            self.in_flight += 1
+        metrics.incr("auth.hash.jobs")
+        metrics.incr("auth.hash.queue_ms", round((time.monotonic() - start) * 1000))
+
+    def _release(self):
+        with self._lock:
+            self.in_flight -= 1
+        self._slots.release()
+
+    def _replace(self, broken):
+        with self._lock:
+            if self._executor is not broken:
+                return
+            self._executor = None
+        metrics.incr("auth.hash.pool_restarts")
+        broken.shutdown(wait=False)
+
+    def _submit(self, func, *args):
+        executor = self.executor
+        try:
+            return executor.submit(func, *args).result()
+        except BrokenProcessPool:
+            # A broken executor fails every job from then on.
+            self._replace(executor)
+            return self.executor.submit(func, *args).result()
+
+    def run(self, func, *args):
+        self._acquire()
+        try:
+            start = time.monotonic()
+            result = self._submit(func, *args)
+            metrics.incr("auth.hash.run_ms", round((time.monotonic() - start) * 1000))
+            return result
+        finally:
+            self._release()
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown()
+
+
+hash_pool = HashPool(
+    settings.PASSWORD_HASH_WORKERS, settings.PASSWORD_HASH_QUEUE_SIZE, settings.PASSWORD_HASH_QUEUE_TIMEOUT
+)
+
+
+class PooledHasherMixin:
+    """Runs the wrapped Django hasher's encode() and verify() on hash_pool."""
+
+    hasher_path = None
+
+    def encode(self, password, salt, *args):
+        return hash_pool.run(_call, self.hasher_path, "encode", password, salt, *args)
+
+    def verify(self, password, encoded):
+        return hash_pool.run(_call, self.hasher_path, "verify", password, encoded)
+
+
+class PBKDF2PasswordHasher(PooledHasherMixin, hashers.PBKDF2PasswordHasher):
+    hasher_path = "django.contrib.auth.hashers.PBKDF2PasswordHasher"
+
+
+class Argon2PasswordHasher(PooledHasherMixin, hashers.Argon2PasswordHasher):
+    hasher_path = "django.contrib.auth.hashers.Argon2PasswordHasher"
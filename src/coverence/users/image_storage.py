@@ -0,0 +1,47 @@
+import os
+from django.conf import settings
+
+
+class RenditionStorage:
+    """Where processed avatar renditions are written; chosen by PROFILE_IMAGE_STORAGE."""
+
+    def save(self, name, data, content_type):
+        """Stores ``data`` under ``name`` and returns its public URL."""
+        raise NotImplementedError
+
+    def delete(self, name):
+        raise NotImplementedError
+
+
+class LocalFileSystemStorage(RenditionStorage):
+    def __init__(self, root=None, base_url=None):
+        self.root = str(root or settings.MEDIA_ROOT)
+        self.base_url = base_url or settings.MEDIA_PUBLIC_URL
+
+    def save(self, name, data, content_type):
+        path = os.path.join(self.root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+        return f"{self.base_url}{name}"
+
+    def delete(self, name):
+        try:
+            os.remove(os.path.join(self.root, name))
+        except FileNotFoundError:
+            pass
+
+
+class CloudinaryStorage(RenditionStorage):
+    def save(self, name, data, content_type):
+        import cloudinary.uploader
+
+        public_id, _ = os.path.splitext(name)
+        result = cloudinary.uploader.upload(data, public_id=public_id, overwrite=True, resource_type="image")
+        return result["secure_url"]
+
+    def delete(self, name):
+        import cloudinary.uploader
+
+        public_id, _ = os.path.splitext(name)
+        cloudinary.uploader.destroy(public_id, resource_type="image")
@@ -0,0 +1,88 @@
+import io
+import logging
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+from PIL import Image, ImageOps
+from coverence.db_pool import pool
+from .cards import invalidate_user_card
+from .models import UserProfile
+from .profile_cache import bump_profile_version
+
+logger = logging.getLogger(__name__)
+
+# Uploads are written to a staging directory inside the request and turned into
+# renditions here, off the request path.
+_executor = ThreadPoolExecutor(max_workers=settings.PROFILE_IMAGE_WORKERS, thread_name_prefix="avatar")
+
+CONTENT_TYPES = {"WEBP": "image/webp", "JPEG": "image/jpeg"}
+
+
+def get_storage():
+    return import_string(settings.PROFILE_IMAGE_STORAGE)()
+
+
+def stage_upload(user_id, uploaded_file):
+    os.makedirs(settings.PROFILE_IMAGE_STAGING_DIR, exist_ok=True)
+    path = os.path.join(settings.PROFILE_IMAGE_STAGING_DIR, f"{user_id}-{uuid.uuid4().hex}")
+    with open(path, "wb") as f:
+        for chunk in uploaded_file.chunks():
+            f.write(chunk)
+    _executor.submit(process_staged_image, path)
+    return path
+
+
+def render(image, max_size, image_format):
+    rendition = image.copy()
+    rendition.thumbnail((max_size, max_size), Image.LANCZOS)
+    buffer = io.BytesIO()
+    # Re-encoding a fresh image without passing exif/icc data strips metadata.
+    rendition.save(buffer, format=image_format, quality=settings.PROFILE_IMAGE_QUALITY)
+    return buffer.getvalue()
+
+
+def process_staged_image(path):
+    user_id = int(os.path.basename(path).split("-", 1)[0])
+    image_format = settings.PROFILE_IMAGE_FORMAT
+    extension = image_format.lower().replace("jpeg", "jpg")
+    storage = get_storage()
+
+    try:
+        with Image.open(path) as original:
+            image = ImageOps.exif_transpose(original)
+            image = image.convert("RGBA" if image_format == "WEBP" and image.mode in ("RGBA", "LA", "P") else "RGB")
+
+        token = uuid.uuid4().hex[:12]
+        renditions = {}
+        for size, max_size in settings.PROFILE_IMAGE_SIZES.items():
+            name = f"avatars/{user_id}/{token}_{size}.{extension}"
+            url = storage.save(name, render(image, max_size, image_format), CONTENT_TYPES[image_format])
+            renditions[size] = {"url": url, "name": name}
+
+        previous = pool.run(save_renditions, user_id, renditions)
+        for rendition in previous.values():
+            storage.delete(rendition["name"])
+    except Exception:
+        logger.exception("Failed to process staged profile image %s", path)
+    finally:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def save_renditions(user_id, renditions):
+    # The row lock orders concurrent uploads for the user, so each one sees
+    # (and deletes) what the previous one stored.
+    with transaction.atomic():
+        previous = (
+            UserProfile.objects.select_for_update().filter(user_id=user_id)
+            .values_list("image_renditions", flat=True).first()
+        ) or {}
+        UserProfile.objects.filter(user_id=user_id).update(image_renditions=renditions)
+        bump_profile_version(user_id)
+    invalidate_user_card(user_id)
+    return previous
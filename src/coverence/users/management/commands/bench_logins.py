@@ -0,0 +1,124 @@
+import asyncio
+import json
+import statistics
+import time
+from channels.testing import HttpCommunicator
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+from coverence.asgi import application
+from users import hashing
+from users.models import UserProfile
+
+PASSWORD = "correct horse battery staple"
+
+# Preferred hasher first; the others are there to verify existing hashes.
+VARIANTS = {
+    "inline pbkdf2": ["django.contrib.auth.hashers.PBKDF2PasswordHasher", "django.contrib.auth.hashers.Argon2PasswordHasher"],
+    "pooled pbkdf2": ["users.hashing.PBKDF2PasswordHasher", "users.hashing.Argon2PasswordHasher"],
+    "inline argon2": ["django.contrib.auth.hashers.Argon2PasswordHasher", "django.contrib.auth.hashers.PBKDF2PasswordHasher"],
+    "pooled argon2": ["users.hashing.Argon2PasswordHasher", "users.hashing.PBKDF2PasswordHasher"],
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures login requests per second through one in-process ASGI worker with password "
+        "hashing in the request thread (inline) and on the hashing process pool (pooled), for "
+        "PBKDF2 and Argon2, along with the latency of a cheap request served meanwhile. With "
+        "--upgrade the users start with PBKDF2 hashes, so Argon2 logins also rehash them."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=50)
+        parser.add_argument("--logins", type=int, default=200)
+        parser.add_argument("--concurrency", type=int, default=8)
+        parser.add_argument("--hash-workers", type=int, help="Hashing processes (default PASSWORD_HASH_WORKERS)")
+        parser.add_argument("--variants", nargs="+", choices=VARIANTS, default=list(VARIANTS))
+        parser.add_argument("--upgrade", action="store_true")
+
+    def handle(self, *args, **options):
+        if options["hash_workers"]:
+            hashing.hash_pool = hashing.HashPool(options["hash_workers"], 100000, 600)
+
+        # Requests are served from other threads, so the users have to be
+        # committed; they are deleted again at the end.
+        User.objects.filter(username__startswith="bench_login_").delete()
+        users = User.objects.bulk_create(
+            User(username=f"bench_login_{i}", email=f"bench_login_{i}@example.com") for i in range(options["users"])
+        )
+        UserProfile.objects.bulk_create(UserProfile(user=user) for user in users)
+        try:
+            for variant in options["variants"]:
+                result = self.run_variant(variant, users, options)
+                self.stdout.write(
+                    f"{variant:<14} {result['rate']:>6.1f} logins/s, login p50 {result['p50']:>5.0f} ms, "
+                    f"cheap request p50 {result['probe_p50']:>5.1f} ms, max {result['probe_max']:>6.1f} ms"
+                    + (f", {result['upgraded']} hashes upgraded" if options["upgrade"] else "")
+                )
+        finally:
+            User.objects.filter(username__startswith="bench_login_").delete()
+            hashing.hash_pool.shutdown()
+
+    def run_variant(self, variant, users, options):
+        # Users start with hashes of the variant's preferred hasher, or PBKDF2
+        # ones with --upgrade.
+        with override_settings(PASSWORD_HASHERS=VARIANTS["inline pbkdf2" if options["upgrade"] else variant]):
+            encoded = make_password(PASSWORD)
+        algorithm = encoded.split("$", 1)[0]
+        user_ids = [user.id for user in users]
+        User.objects.filter(id__in=user_ids).update(password=encoded)
+
+        with override_settings(PASSWORD_HASHERS=VARIANTS[variant]):
+            # Warms up the hashing processes.
+            make_password(PASSWORD)
+            result = asyncio.run(self.run(users, options))
+        result["upgraded"] = User.objects.filter(id__in=user_ids).exclude(password__startswith=f"{algorithm}$").count()
+        return result
+
+    async def login(self, user):
+        body = json.dumps({"username": user.username, "password": PASSWORD}).encode()
+        communicator = HttpCommunicator(
+            application, "POST", "/api/users/login/", body=body,
+            headers=[(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        )
+        response = await communicator.get_response(timeout=600)
+        await communicator.wait()
+        if response["status"] != 200:
+            raise CommandError(f"Login failed with {response['status']}: {response['body'][:200]}")
+
+    async def run(self, users, options):
+        pending = list(range(options["logins"]))
+        latencies = []
+        probes = []
+        done = asyncio.Event()
+
+        async def client():
+            while pending:
+                i = pending.pop()
+                start = time.perf_counter()
+                await self.login(users[i % len(users)])
+                latencies.append(time.perf_counter() - start)
+
+        async def probe():
+            while not done.is_set():
+                start = time.perf_counter()
+                communicator = HttpCommunicator(application, "GET", "/")
+                await communicator.get_response(timeout=600)
+                await communicator.wait()
+                probes.append(time.perf_counter() - start)
+                await asyncio.sleep(0.02)
+
+        probing = asyncio.ensure_future(probe())
+        start = time.perf_counter()
+        await asyncio.gather(*(client() for _ in range(options["concurrency"])))
+        elapsed = time.perf_counter() - start
+        done.set()
+        await probing
+        return {
+            "rate": len(latencies) / elapsed,
+            "p50": statistics.median(latencies) * 1000,
+            "probe_p50": statistics.median(probes) * 1000,
+            "probe_max": max(probes) * 1000,
+        }
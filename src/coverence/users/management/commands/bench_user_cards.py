@@ -0,0 +1,74 @@
+import time
+import cloudinary
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+from users.models import UserProfile
+from users.serializers import PublicUserSerializer
+
+
+class LegacyPublicUserSerializer(PublicUserSerializer):
+    """PublicUserSerializer as it resolved avatars before users.avatars existed."""
+
+    def get_profile_image(self, obj):
+        try:
+            profile = obj.userprofile
+            rendition = profile.image_renditions.get(self.context.get("avatar_size", "sm"))
+            url = rendition["url"] if rendition else None
+            if not url and profile.profile_image:
+                url = profile.profile_image.url
+            if url:
+                request = self.context.get('request')
+                return request.build_absolute_uri(url) if request else url
+            return None
+        except Exception as e:
+            print("Error fetching profile_image:", e)
+            return None
+
+
+def make_users(count):
+    image_field = UserProfile._meta.get_field("profile_image")
+    users = []
+    for i in range(1, count + 1):
+        user = User(id=i, username=f"user{i}", first_name="Ada", last_name=f"Lovelace {i}", email=f"user{i}@example.com")
+        profile = UserProfile(user=user, skill_known="Python")
+        if i % 2:
+            # Half the users still only have the original upload.
+            profile.profile_image = image_field.to_python(f"image/upload/v1718000000/profile_images/user{i}.jpg")
+        else:
+            profile.image_renditions = {
+                size: {"url": f"https://res.cloudinary.com/demo/image/upload/avatars/{i}/abc_{size}.webp", "name": ""}
+                for size in settings.PROFILE_IMAGE_SIZES
+            }
+        users.append(user)
+    return users
+
+
+class Command(BaseCommand):
+    help = "Times serializing user cards with the legacy and the shared avatar URL resolution"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=1000)
+        parser.add_argument("--rounds", type=int, default=20)
+
+    def handle(self, *args, **options):
+        if not cloudinary.config().cloud_name:
+            # The legacy path builds URLs through the SDK, which needs this.
+            cloudinary.config(cloud_name=settings.CLOUDINARY_STORAGE["CLOUD_NAME"])
+
+        users = make_users(options["users"])
+        request = RequestFactory().get("/api/users/search/")
+        context = {"request": request}
+
+        runs = [
+            ("legacy serializer", lambda: LegacyPublicUserSerializer(users, many=True, context=context).data),
+            ("serializer", lambda: PublicUserSerializer(users, many=True, context=context).data),
+        ]
+        for name, run in runs:
+            run()
+            start = time.perf_counter()
+            for _ in range(options["rounds"]):
+                run()
+            elapsed_ms = (time.perf_counter() - start) / options["rounds"] * 1000
+            self.stdout.write(f"{name}: {elapsed_ms:.2f} ms per {len(users)} users")
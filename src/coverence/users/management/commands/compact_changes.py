@@ -0,0 +1,19 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from users.changes import compact_changes
+
+
+class Command(BaseCommand):
+    help = (
+        "Drops change log entries older than SYNC_CHANGE_RETENTION_DAYS (or --days); clients "
+        "that last synced before them get a full snapshot on their next sync."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=float, default=settings.SYNC_CHANGE_RETENTION_DAYS)
+
+    def handle(self, *args, **options):
+        deleted = compact_changes(timezone.now() - timedelta(days=options["days"]))
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} change log entries."))
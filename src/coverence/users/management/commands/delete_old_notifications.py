@@ -1,7 +1,9 @@
 from django.core.management.base import BaseCommand
+from django.db import transaction
 from django.utils import timezone
 from datetime import timedelta
 from users.models import Notification  # adjust based on actual path
+from users.changes import NOTIFICATION, record_changes
 
 class Command(BaseCommand):
     help = "Deletes notifications older than 7 days"
@@ -9,6 +11,10 @@ class Command(BaseCommand):
     def handle(self, *args, **kwargs):
         cutoff = timezone.now() - timedelta(hours=20)
         old_notifications = Notification.objects.filter(created_at__lt=cutoff)
-        count = old_notifications.count()
-        old_notifications.delete()
+        with transaction.atomic():
+            # Synced clients learn about the removals from the change log.
+            removed = list(old_notifications.values_list("to_user_id", "id"))
+            old_notifications.filter(id__in=[notification_id for _, notification_id in removed]).delete()
+            record_changes((user_id, NOTIFICATION, notification_id) for user_id, notification_id in removed)
+        count = len(removed)
         self.stdout.write(self.style.SUCCESS(f"Deleted {count} notifications older than 7 days."))
@@ -0,0 +1,15 @@
+import os
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from users.images import process_staged_image
+
+
+class Command(BaseCommand):
+    help = "Processes profile image uploads left in the staging directory (e.g. after a worker restart)"
+
+    def handle(self, *args, **kwargs):
+        staging_dir = settings.PROFILE_IMAGE_STAGING_DIR
+        names = sorted(os.listdir(staging_dir)) if os.path.isdir(staging_dir) else []
+        for name in names:
+            process_staged_image(os.path.join(staging_dir, name))
+        self.stdout.write(self.style.SUCCESS(f"Processed {len(names)} staged profile images."))
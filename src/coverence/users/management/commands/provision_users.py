@@ -0,0 +1,39 @@
+import csv
+import sys
+import time
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from users.provisioning import PROFILE_FIELDS, provision_users
+
+
+class Command(BaseCommand):
+    help = (
+        "Creates users with their profiles and activity rows in bulk from a CSV file with an "
+        "email column and optionally password, first_name, last_name, "
+        + ", ".join(PROFILE_FIELDS) + ". Use - to read standard input."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        if options["path"] == "-":
+            accounts = list(csv.DictReader(sys.stdin))
+        else:
+            with open(options["path"], newline="") as file:
+                accounts = list(csv.DictReader(file))
+
+        emails = [account.get("email") for account in accounts]
+        if not all(emails):
+            raise CommandError("Every row needs an email")
+        if len(set(emails)) != len(emails):
+            raise CommandError("The file lists an email more than once")
+        taken = list(User.objects.filter(username__in=emails).values_list("username", flat=True)[:10])
+        if taken:
+            raise CommandError(f"Users already exist: {', '.join(taken)}")
+
+        start = time.perf_counter()
+        users = provision_users(accounts, options["batch_size"])
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(f"Created {len(users)} users in {elapsed:.1f} s"))
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-19 15:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0020_alter_notification_notification_type_delete_follow'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='token_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-19 15:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0022_userprofile_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='image_renditions',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
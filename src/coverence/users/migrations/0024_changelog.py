@@ -0,0 +1,41 @@
+# Generated by Django 5.2.1 on 2026-10-19 16:57
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('users', '0023_userprofile_image_renditions'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeLog',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='+', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('seq', models.PositiveBigIntegerField(default=0)),
+                ('floor', models.PositiveBigIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ChangeLogEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=16)),
+                ('key', models.BigIntegerField()),
+                ('seq', models.PositiveBigIntegerField()),
+                ('changed_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'seq'], name='users_chang_user_id_8f92d4_idx'), models.Index(fields=['changed_at'], name='users_chang_changed_1953d2_idx')],
+                'constraints': [models.UniqueConstraint(fields=('user', 'kind', 'key'), name='changelog_entry_unique_key')],
+            },
+        ),
+    ]
@@ -5,16 +5,22 @@ from pillow_heif import register_heif_opener
 import os
 from django.utils import timezone
 from cloudinary.models import CloudinaryField
+from coverence.dirty_fields import DirtyFieldsMixin
 
 register_heif_opener()
 
-class UserProfile(models.Model):
+class UserProfile(DirtyFieldsMixin, models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     bio = models.TextField(blank=True)
     profile_image = CloudinaryField('image', blank=True, null=True)
     skill_known = models.CharField(max_length=255, blank=True)
     skill_wanted = models.CharField(max_length=255, blank=True)
     available_time = models.CharField(max_length=255, blank=True)
+    token_version = models.PositiveIntegerField(default=0)
+    version = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(default=timezone.now)
+    # Processed avatar renditions by size name: {"sm": {"url": ..., "name": ...}, ...}
+    image_renditions = models.JSONField(default=dict, blank=True)
 
     def __str__(self):
         return self.user.username
@@ -41,3 +47,24 @@ class Notification(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+
+
+class ChangeLog(models.Model):
+    """Head of a user's change log (see users.changes)."""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='+')
+    # Last sequence number handed out, and the highest one compacted away.
+    seq = models.PositiveBigIntegerField(default=0)
+    floor = models.PositiveBigIntegerField(default=0)
+
+
+class ChangeLogEntry(models.Model):
+    """The latest change to one object (``kind``, ``key``) as seen by ``user``."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    kind = models.CharField(max_length=16)
+    key = models.BigIntegerField()
+    seq = models.PositiveBigIntegerField()
+    changed_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['user', 'kind', 'key'], name='changelog_entry_unique_key')]
+        indexes = [models.Index(fields=['user', 'seq']), models.Index(fields=['changed_at'])]
@@ -0,0 +1,11 @@
+from django.db import transaction
+from .changes import NOTIFICATION, record_changes
+from .models import Notification
+
+
+def mark_notifications_seen(user_id):
+    with transaction.atomic():
+        ids = list(Notification.objects.filter(to_user_id=user_id, is_seen=False).values_list("id", flat=True))
+        if ids:
+            Notification.objects.filter(id__in=ids).update(is_seen=True)
+            record_changes((user_id, NOTIFICATION, notification_id) for notification_id in ids)
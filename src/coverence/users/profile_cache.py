@@ -0,0 +1,63 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from coverence.single_flight import SingleFlight
+from .models import UserProfile
+
+# Profiles are versioned: every save of the user or profile that can change
+# what is rendered bumps UserProfile.version (see users.signals), and every
+# cached representation and ETag is keyed by it, so nothing needs deleting.
+# Representations are built on the primary: the version comes from there, and
+# a lagging replica would cache old data under the new version.
+# Concurrent requests for the same representation share one lookup (and one
+# build on a miss); being keyed by version, they never share a stale one.
+profile_flight = SingleFlight("profiles", settings.SINGLE_FLIGHT_TTL)
+
+
+def _version_key(user_id):
+    return f"profile_version:{user_id}"
+
+
+def profile_version(user_id):
+    """Returns (version, updated_at) for the user's profile, from cache when possible."""
+    info = cache.get(_version_key(user_id))
+    if info is None:
+        info = UserProfile.objects.filter(user_id=user_id).values_list("version", "updated_at").first()
+        if info is None:
+            return None
+        cache.set(_version_key(user_id), info, settings.PROFILE_CACHE_SECONDS)
+    return info
+
+
+def bump_profile_version(user_id):
+    UserProfile.objects.filter(user_id=user_id).update(version=F("version") + 1, updated_at=timezone.now())
+    # After commit, so a concurrent read cannot cache the old version again.
+    transaction.on_commit(lambda: cache.delete(_version_key(user_id)))
+
+
+def profile_etag(request, user_id):
+    info = profile_version(user_id)
+    return f'"{user_id}-{info[0]}"' if info else None
+
+
+def profile_last_modified(request, user_id):
+    info = profile_version(user_id)
+    return info[1] if info else None
+
+
+def cached_profile(kind, user_id, build):
+    """Returns the cached ``kind`` representation of the current profile version."""
+    info = profile_version(user_id)
+    key = f"profile:{kind}:{user_id}:{info[0] if info else 0}"
+    return profile_flight.run(key, lambda: _load_profile(key, build))
+
+
+def _load_profile(key, build):
+    data = cache.get(key)
+    if data is None:
+        data = build()
+        if data is not None:
+            cache.set(key, data, settings.PROFILE_CACHE_SECONDS)
+    return data
@@ -0,0 +1,40 @@
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+from .models import UserActivity, UserProfile
+
+# Creating users one by one costs an INSERT plus the post_save work for each
+# (profile, activity, card invalidation). bulk_create sends no signals, so the
+# related rows are created here, three statements per batch in total.
+PROFILE_FIELDS = ("bio", "skill_known", "skill_wanted", "available_time")
+
+
+def provision_users(accounts, batch_size=1000):
+    """
+    Creates a user, profile and activity row for each account dict: ``email``
+    (also the username, as for SignUpView), optional ``password`` (unusable
+    when missing), ``first_name``, ``last_name`` and the profile fields.
+
+    Runs in one transaction and returns the created users.
+    """
+    users = []
+    with transaction.atomic():
+        for start in range(0, len(accounts), batch_size):
+            batch = accounts[start:start + batch_size]
+            created = User.objects.bulk_create(
+                User(
+                    username=account["email"],
+                    email=account["email"],
+                    first_name=account.get("first_name", ""),
+                    last_name=account.get("last_name", ""),
+                    password=make_password(account.get("password") or None),
+                )
+                for account in batch
+            )
+            UserProfile.objects.bulk_create(
+                UserProfile(user=user, **{field: account.get(field, "") for field in PROFILE_FIELDS})
+                for user, account in zip(created, batch)
+            )
+            UserActivity.objects.bulk_create(UserActivity(user=user) for user in created)
+            users += created
+    return users
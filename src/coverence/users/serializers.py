@@ -1,5 +1,8 @@
 from django.contrib.auth.models import User
 from rest_framework import serializers
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from coverence.values_serializer import ValuesSerializer
+from .avatars import absolute_url, avatar_url, resolve_avatar
 from .models import UserProfile, Notification
 
 
@@ -19,14 +22,7 @@ class UserSerializer(serializers.ModelSerializer):
         extra_kwargs = {'password': {'write_only': True}}
 
     def get_profile_image(self, obj):
-        try:
-            profile = obj.userprofile
-            if profile.profile_image:
-                return profile.profile_image.url
-            return None
-        except Exception as e:
-            print("Error fetching profile_image:", e)
-            return None
+        return avatar_url(getattr(obj, "userprofile", None), self.context.get("avatar_size", "md"))
 
     def create(self, validated_data):
         profile_data = validated_data.pop('profile', {})
@@ -76,15 +72,8 @@ class PublicUserSerializer(serializers.ModelSerializer):
         fields = ['id', 'first_name', 'last_name', 'email', 'profile_image', 'skill_known']
 
     def get_profile_image(self, obj):
-        try:
-            profile = obj.userprofile
-            if profile.profile_image:
-                request = self.context.get('request')  # Needed for full URL
-                return request.build_absolute_uri(profile.profile_image.url) if request else profile.profile_image.url
-            return None
-        except Exception as e:
-            print("Error fetching profile_image:", e)
-            return None
+        url = avatar_url(getattr(obj, "userprofile", None), self.context.get("avatar_size", "sm"))
+        return absolute_url(url, self.context.get('request'))
 
     def get_skill_known(self, obj):
         try:
@@ -99,3 +88,46 @@ class NotificationSerializer(serializers.ModelSerializer):
     class Meta:
         model = Notification
         fields = ['id', 'from_user', 'notification_type', 'created_at', 'is_read', 'is_seen']
+
+
+class PublicUserValuesSerializer(ValuesSerializer):
+    """Same output as PublicUserSerializer, straight from values_list() rows."""
+
+    fields = {
+        "id": "id",
+        "first_name": "first_name",
+        "last_name": "last_name",
+        "email": "email",
+        "profile_image": ("get_profile_image", "userprofile__image_renditions", "userprofile__profile_image"),
+        "skill_known": "userprofile__skill_known",
+    }
+
+    def get_profile_image(self, renditions, image):
+        url = resolve_avatar(renditions, image, self.context.get("avatar_size", "sm"))
+        return absolute_url(url, self.context.get('request'))
+
+
+class NotificationValuesSerializer(ValuesSerializer):
+    """Same output as NotificationSerializer, straight from values_list() rows."""
+
+    fields = {
+        "id": "id",
+        "from_user": PublicUserValuesSerializer,
+        "notification_type": "notification_type",
+        "created_at": ("format_datetime", "created_at"),
+        "is_read": "is_read",
+        "is_seen": "is_seen",
+    }
+
+
+class ClaimsTokenObtainPairSerializer(TokenObtainPairSerializer):
+    """Embeds the claims StatelessJWTAuthentication builds its request user from."""
+
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        token["first_name"] = user.first_name
+        token["last_name"] = user.last_name
+        token["active"] = user.is_active
+        token["tv"] = UserProfile.objects.filter(user=user).values_list("token_version", flat=True).first() or 0
+        return token
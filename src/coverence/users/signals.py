@@ -1,9 +1,59 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_init, post_save
 from django.dispatch import receiver
 from django.contrib.auth.models import User
-from .models import UserProfile, UserActivity
+from .models import Notification, UserProfile, UserActivity
+from .cards import invalidate_user_card
+from .authentication import revoke_tokens
+from .changes import NOTIFICATION, record_changes
+from .profile_cache import bump_profile_version
+
+# User fields that show up in rendered profiles. Saves limited to others
+# (last_login on every sign-in, password rehashes) keep cached profiles.
+PROFILE_USER_FIELDS = {"first_name", "last_name", "email", "is_active"}
+
+@receiver(post_save, sender=User)
+def create_related_user_models(sender, instance, created, raw=False, **kwargs):
+    # Only on insert: later saves of the user must not pay for the lookups.
+    # Users created in bulk get theirs from users.provisioning.
+    if created and not raw:
+        UserProfile.objects.create(user=instance)
+        UserActivity.objects.create(user=instance)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+@receiver(post_save, sender=UserProfile)
+def invalidate_cached_user_card(sender, instance, **kwargs):
+    invalidate_user_card(instance.user_id if sender is UserProfile else instance.id)
+
 
 @receiver(post_save, sender=User)
-def create_related_user_models(sender, instance, **kwargs):
-    UserProfile.objects.get_or_create(user=instance)
-    UserActivity.objects.get_or_create(user=instance)
+@receiver(post_save, sender=UserProfile)
+def bump_cached_profile_version(sender, instance, created, update_fields=None, raw=False, **kwargs):
+    if created or raw:
+        return
+    if sender is User and update_fields is not None and not PROFILE_USER_FIELDS.intersection(update_fields):
+        return
+    bump_profile_version(instance.id if sender is User else instance.user_id)
+
+
+# auth's User cannot take DirtyFieldsMixin, so is_active as loaded (or last
+# saved) is remembered the same way, for deactivations to be told apart from
+# other saves of an inactive user.
+@receiver(post_init, sender=User)
+def remember_loaded_is_active(sender, instance, **kwargs):
+    instance._loaded_is_active = instance.is_active
+
+
+@receiver(post_save, sender=User)
+def revoke_tokens_of_deactivated_user(sender, instance, created, raw=False, **kwargs):
+    was_active = instance._loaded_is_active
+    instance._loaded_is_active = instance.is_active
+    if was_active and not instance.is_active and not (created or raw):
+        revoke_tokens(instance.id)
+
+
+@receiver(post_save, sender=Notification)
+def record_new_notification(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        record_changes([(instance.to_user_id, NOTIFICATION, instance.id)])
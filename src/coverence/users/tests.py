@@ -1,3 +1,415 @@
-from django.test import TestCase
+import datetime
+import io
+import os
+import shutil
+import signal
+import tempfile
+import time
+from unittest import mock
+import json
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from PIL import Image
+from django.utils import timezone
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.test import APIClient
+from .async_views import AsyncNotificationView
+from . import changes
+from .authentication import ClaimsUser, revoke_tokens
+from .cards import card_cache, get_user_card
+from .hashing import HashPool, _call
+from .image_storage import LocalFileSystemStorage
+from .images import process_staged_image
+from .models import ChangeLogEntry, UserActivity, UserProfile
+from .provisioning import provision_users
+from .serializers import ClaimsTokenObtainPairSerializer
+from .views import NotificationView
+from .profile_cache import profile_version
 
-# Create your tests here.
+LOCAL_CACHE = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+
+@override_settings(CACHES=LOCAL_CACHE)
+class ProfileCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("ada", "ada@example.com", "pw", first_name="Ada", last_name="Lovelace")
+        self.client = APIClient()
+        self.url = reverse("public-profile", args=[self.user.id])
+
+    def get_profile(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_user_save_refreshes_cached_profile(self):
+        etag = self.get_profile()["ETag"]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.first_name = "Augusta"
+            self.user.save()
+        response = self.get_profile()
+        self.assertEqual(response.data["first_name"], "Augusta")
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_profile_save_refreshes_cached_profile(self):
+        self.get_profile()
+        with self.captureOnCommitCallbacks(execute=True):
+            profile = UserProfile.objects.get(user=self.user)
+            profile.bio = "Analyst"
+            profile.save()
+        self.assertEqual(self.get_profile().data["bio"], "Analyst")
+
+    def test_saves_outside_profile_fields_keep_version(self):
+        version = profile_version(self.user.id)[0]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.last_login = timezone.now()
+            self.user.save(update_fields=["last_login"])
+            UserProfile.objects.get(user=self.user).save()
+        self.assertEqual(profile_version(self.user.id)[0], version)
+
+    def test_not_modified(self):
+        etag = self.get_profile()["ETag"]
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+
+class UserCardCacheTests(TestCase):
+    def setUp(self):
+        card_cache.clear()
+        self.user = User.objects.create_user("ada", "ada@example.com", "pw", first_name="Ada", last_name="Lovelace")
+
+    def test_save_invalidates_card(self):
+        self.assertEqual(get_user_card(self.user.id)["first_name"], "Ada")
+        self.user.first_name = "Augusta"
+        self.user.save()
+        self.assertEqual(get_user_card(self.user.id)["first_name"], "Augusta")
+
+    def test_cards_expire(self):
+        with mock.patch.object(card_cache, "ttl", 0.01):
+            get_user_card(self.user.id)
+            # Like a save on another worker: this worker's cache is not told.
+            User.objects.filter(id=self.user.id).update(first_name="Augusta")
+            time.sleep(0.02)
+            self.assertEqual(get_user_card(self.user.id)["first_name"], "Augusta")
+
+
+@override_settings(CACHES=LOCAL_CACHE, USER_CARDS_BATCH_LIMIT=20)
+class UserCardsViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        card_cache.clear()
+        self.users = [
+            User.objects.create(username=f"user{i}", email=f"user{i}@example.com", first_name=f"User{i}", last_name="Test")
+            for i in range(12)
+        ]
+        self.client = APIClient()
+        self.client.force_authenticate(self.users[0])
+
+    def get_cards(self, ids):
+        return self.client.get(reverse("user-cards"), {"ids": ids})
+
+    def test_cards_in_request_order(self):
+        ids = [self.users[3].id, self.users[1].id, self.users[3].id, self.users[2].id]
+        response = self.get_cards(",".join(map(str, ids)))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([card["id"] for card in response.data["cards"]], [ids[0], ids[1], ids[3]])
+        self.assertEqual(response.data["cards"][0]["first_name"], "User3")
+        self.assertEqual(response.data["not_found"], [])
+
+    def test_not_found(self):
+        missing = self.users[-1].id + 100
+        response = self.get_cards(f"{self.users[1].id},{missing}")
+        self.assertEqual([card["id"] for card in response.data["cards"]], [self.users[1].id])
+        self.assertEqual(response.data["not_found"], [missing])
+
+    def test_bad_ids(self):
+        for ids in ("1,two", "1.5", "1,,x"):
+            response = self.get_cards(ids)
+            self.assertEqual(response.status_code, 400)
+            self.assertIn("error", response.data)
+
+    def test_too_many_ids(self):
+        response = self.get_cards(",".join(str(i) for i in range(1, 22)))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data, {"error": "At most 20 ids per request"})
+
+    def test_constant_queries_on_cold_cache(self):
+        for users in (self.users[:1], self.users):
+            card_cache.clear()
+            with self.assertNumQueries(1):
+                response = self.get_cards(",".join(str(user.id) for user in users))
+            self.assertEqual(len(response.data["cards"]), len(users))
+        # Warm: served from the card cache.
+        with self.assertNumQueries(0):
+            self.get_cards(",".join(str(user.id) for user in self.users))
+
+
+class HashPoolTests(SimpleTestCase):
+    hasher = "django.contrib.auth.hashers.MD5PasswordHasher"
+
+    def setUp(self):
+        self.pool = HashPool(1, 1, 5)
+        self.addCleanup(self.pool.shutdown)
+
+    def test_pool_is_replaced_after_a_process_dies(self):
+        encoded = self.pool.run(_call, self.hasher, "encode", "pw", "salt")
+        for pid in list(self.pool.executor._processes):
+            os.kill(pid, signal.SIGKILL)
+        time.sleep(0.2)
+        self.assertTrue(self.pool.run(_call, self.hasher, "verify", "pw", encoded))
+        self.assertEqual(self.pool.in_flight, 0)
+
+
+class LocalFileSystemStorageTests(SimpleTestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.storage = LocalFileSystemStorage(self.root, "https://example.com/media/")
+
+    def test_save_and_delete(self):
+        url = self.storage.save("avatars/1/abc_sm.webp", b"data", "image/webp")
+        self.assertEqual(url, "https://example.com/media/avatars/1/abc_sm.webp")
+        path = os.path.join(self.root, "avatars", "1", "abc_sm.webp")
+        with open(path, "rb") as f:
+            self.assertEqual(f.read(), b"data")
+        self.storage.delete("avatars/1/abc_sm.webp")
+        self.assertFalse(os.path.exists(path))
+        # Deleting what is already gone is fine.
+        self.storage.delete("avatars/1/abc_sm.webp")
+
+
+class ProcessStagedImageTests(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        override = override_settings(
+            MEDIA_ROOT=os.path.join(self.root, "media"),
+            MEDIA_PUBLIC_URL="https://example.com/media/",
+            PROFILE_IMAGE_STORAGE="users.image_storage.LocalFileSystemStorage",
+            PROFILE_IMAGE_SIZES={"sm": 16, "lg": 64},
+            PROFILE_IMAGE_FORMAT="WEBP",
+        )
+        override.enable()
+        self.addCleanup(override.disable)
+        self.user = User.objects.create_user("ada", "ada@example.com", "pw")
+
+    def stage(self, size=(200, 100)):
+        path = os.path.join(self.root, f"{self.user.id}-{len(os.listdir(self.root))}")
+        buffer = io.BytesIO()
+        Image.new("RGB", size, "red").save(buffer, format="JPEG")
+        with open(path, "wb") as f:
+            f.write(buffer.getvalue())
+        return path
+
+    def renditions(self):
+        return UserProfile.objects.get(user=self.user).image_renditions
+
+    def stored(self, rendition):
+        return os.path.join(settings.MEDIA_ROOT, rendition["name"])
+
+    def test_renditions_are_stored_and_recorded(self):
+        path = self.stage()
+        process_staged_image(path)
+        renditions = self.renditions()
+        self.assertEqual(set(renditions), {"sm", "lg"})
+        self.assertTrue(renditions["sm"]["url"].startswith("https://example.com/media/avatars/"))
+        with Image.open(self.stored(renditions["lg"])) as image:
+            self.assertEqual((image.format, image.size), ("WEBP", (64, 32)))
+        self.assertFalse(os.path.exists(path))
+
+    def test_previous_renditions_are_deleted(self):
+        process_staged_image(self.stage())
+        first = self.renditions()
+        process_staged_image(self.stage())
+        second = self.renditions()
+        self.assertNotEqual(first["sm"]["name"], second["sm"]["name"])
+        self.assertFalse(any(os.path.exists(self.stored(rendition)) for rendition in first.values()))
+        self.assertTrue(all(os.path.exists(self.stored(rendition)) for rendition in second.values()))
+
+    def test_unreadable_upload_is_discarded(self):
+        path = os.path.join(self.root, f"{self.user.id}-broken")
+        with open(path, "wb") as f:
+            f.write(b"not an image")
+        with self.assertLogs("users.images", "ERROR"):
+            process_staged_image(path)
+        self.assertEqual(self.renditions(), {})
+        self.assertFalse(os.path.exists(path))
+
+
+@override_settings(CACHES=LOCAL_CACHE)
+class AsyncAuthenticationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("ada", "ada@example.com", "pw")
+        self.token = str(ClaimsTokenObtainPairSerializer.get_token(self.user).access_token)
+
+    def responses(self, **headers):
+        request = RequestFactory().get("/api/users/notifications/", **headers)
+        response = NotificationView.as_view()(request)
+        response.render()
+        async_response = async_to_sync(AsyncNotificationView.as_view())(request)
+        return response, async_response
+
+    def assertSameResponse(self, **headers):
+        response, async_response = self.responses(**headers)
+        self.assertEqual(async_response.status_code, response.status_code)
+        self.assertEqual(async_response.get("WWW-Authenticate"), response.get("WWW-Authenticate"))
+        self.assertEqual(json.loads(async_response.content), json.loads(response.content))
+        return response
+
+    def test_missing_token(self):
+        response = self.assertSameResponse()
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response["WWW-Authenticate"], 'Bearer realm="api"')
+
+    def test_invalid_token(self):
+        self.assertEqual(self.assertSameResponse(HTTP_AUTHORIZATION="Bearer nonsense").status_code, 401)
+
+    def test_revoked_token(self):
+        revoke_tokens(self.user.id)
+        self.assertEqual(self.assertSameResponse(HTTP_AUTHORIZATION=f"Bearer {self.token}").status_code, 401)
+
+    def test_valid_token(self):
+        self.assertEqual(self.assertSameResponse(HTTP_AUTHORIZATION=f"Bearer {self.token}").status_code, 200)
+
+
+class ChangeLogTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("ada", "ada@example.com", "pw")
+
+    def test_sequence_and_upsert(self):
+        self.assertEqual(changes.log_head(self.user.id), (0, 0))
+        changes.record_changes([(self.user.id, changes.ROOM, 1), (self.user.id, changes.MESSAGE, 10)])
+        changes.record_changes([(self.user.id, changes.ROOM, 1), (self.user.id, changes.ROOM, 1)])
+        self.assertEqual(changes.log_head(self.user.id), (3, 0))
+        # The room's entry moved forward instead of a second one being added.
+        self.assertEqual(
+            changes.changes_between(self.user.id, 0, 3, 10), [(2, changes.MESSAGE, 10), (3, changes.ROOM, 1)]
+        )
+        self.assertEqual(changes.changes_between(self.user.id, 2, 3, 10), [(3, changes.ROOM, 1)])
+
+    def test_compaction_raises_floor(self):
+        changes.record_changes([(self.user.id, changes.MESSAGE, key) for key in (1, 2, 3)])
+        ChangeLogEntry.objects.filter(user=self.user, seq__lte=2).update(
+            changed_at=timezone.now() - datetime.timedelta(days=30)
+        )
+        self.assertEqual(changes.compact_changes(timezone.now() - datetime.timedelta(days=1)), 2)
+        self.assertEqual(changes.log_head(self.user.id), (3, 2))
+        self.assertEqual(changes.changes_between(self.user.id, 0, 3, 10), [(3, changes.MESSAGE, 3)])
+
+    def test_tokens(self):
+        other = User.objects.create_user("bob", "bob@example.com", "pw")
+        token = changes.make_token(self.user.id, 5)
+        self.assertEqual(changes.read_token(self.user.id, token), 5)
+        self.assertIsNone(changes.read_token(other.id, token))
+        self.assertIsNone(changes.read_token(self.user.id, token[:-2] + "xx"))
+        self.assertIsNone(changes.read_token(self.user.id, "garbage"))
+
+
+@override_settings(CACHES=LOCAL_CACHE)
+class DeactivationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("ada", "ada@example.com", "pw")
+
+    def token_version(self):
+        return UserProfile.objects.get(user=self.user).token_version
+
+    def test_only_deactivation_revokes(self):
+        self.user.first_name = "Ada"
+        self.user.save()
+        self.assertEqual(self.token_version(), 0)
+
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.token_version(), 1)
+
+        # Later saves of the inactive user, loaded again or not, revoke nothing more.
+        self.user.last_name = "Lovelace"
+        self.user.save()
+        user = User.objects.get(id=self.user.id)
+        user.save()
+        self.assertEqual(self.token_version(), 1)
+
+        user.is_active = True
+        user.save()
+        user.is_active = False
+        user.save()
+        self.assertEqual(self.token_version(), 2)
+
+
+class DirtyFieldsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("ada", "ada@example.com", "pw")
+
+    def test_tracks_changes_since_load_and_save(self):
+        profile = UserProfile.objects.get(user=self.user)
+        self.assertEqual(profile.dirty_fields(), [])
+        profile.bio = "Hi"
+        self.assertEqual(profile.dirty_fields(), ["bio"])
+        profile.save()
+        self.assertEqual(profile.dirty_fields(), [])
+
+        UserProfile.objects.filter(id=profile.id).update(skill_known="Chess")
+        profile.refresh_from_db()
+        self.assertEqual((profile.dirty_fields(), profile.skill_known), ([], "Chess"))
+        profile.skill_known = "Chess"
+        self.assertEqual(profile.dirty_fields(), [])
+
+    def test_save_writes_only_changed_columns(self):
+        profile = UserProfile.objects.get(user=self.user)
+        with self.assertNumQueries(0):
+            profile.save()
+        profile.bio = "Hi"
+        with CaptureQueriesContext(connection) as queries:
+            profile.save()
+        update = next(query["sql"] for query in queries if query["sql"].startswith("UPDATE"))
+        self.assertIn('"bio"', update)
+        self.assertNotIn('"skill_known"', update)
+
+
+class ProvisioningTests(TestCase):
+    def test_creates_users_with_related_rows(self):
+        accounts = [
+            {"email": f"user{i}@example.com", "first_name": f"User {i}", "bio": f"Bio {i}"} for i in range(5)
+        ]
+        accounts[0]["password"] = "secret"
+        # Three statements per batch, in a savepoint here.
+        with self.assertNumQueries(2 + 2 * 3):
+            users = provision_users(accounts, batch_size=3)
+        self.assertEqual([user.username for user in users], [account["email"] for account in accounts])
+        self.assertEqual(UserProfile.objects.filter(user__in=users).count(), 5)
+        self.assertEqual(UserActivity.objects.filter(user__in=users).count(), 5)
+        self.assertEqual(UserProfile.objects.get(user=users[4]).bio, "Bio 4")
+        self.assertTrue(User.objects.get(id=users[0].id).check_password("secret"))
+        self.assertFalse(User.objects.get(id=users[1].id).has_usable_password())
+
+
+@override_settings(CACHES=LOCAL_CACHE)
+class ClaimsUserTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("ada", "ada@example.com", "pw", first_name="Ada")
+        self.token = ClaimsTokenObtainPairSerializer.get_token(self.user).access_token
+
+    def test_claims_without_query(self):
+        user = ClaimsUser(self.token)
+        with self.assertNumQueries(0):
+            self.assertEqual((user.id, user.first_name, user.is_active, user.token_version), (self.user.id, "Ada", True, 0))
+        with self.assertNumQueries(1):
+            self.assertEqual(user.email, "ada@example.com")
+
+    def test_deleted_user(self):
+        self.user.delete()
+        user = ClaimsUser(self.token)
+        with self.assertRaises(AuthenticationFailed):
+            user.email
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.token}")
+        response = client.put(reverse("profile"), {"first_name": "Grace"}, format="json")
+        self.assertEqual(response.status_code, 401)
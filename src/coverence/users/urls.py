@@ -1,5 +1,7 @@
+from django.conf import settings
 from django.urls import path
-from .views import SignUpView, LoginView, ProfileView, UserSearchAPIView, PublicProfileView, NotificationView, UnseenNotificationCountView
+from .views import SignUpView, LoginView, ProfileView, UserSearchAPIView, PublicProfileView, NotificationView, UnseenNotificationCountView, UserCardsView
+from .async_views import AsyncNotificationView, AsyncUnseenNotificationCountView
 
 urlpatterns = [
     path('signup/', SignUpView.as_view(), name='signup'),
@@ -7,6 +9,15 @@ urlpatterns = [
     path('profile/', ProfileView.as_view(), name='profile'),
     path('search/', UserSearchAPIView.as_view(), name='user-search'),
     path('<int:user_id>/public-profile/', PublicProfileView.as_view(), name='public-profile'),
-    path('notifications/', NotificationView.as_view(), name='notifications'),
-    path('notifications/unseen-count/', UnseenNotificationCountView.as_view(), name='unseen-notification-count'),
+    path('cards/', UserCardsView.as_view(), name='user-cards'),
+    path(
+        'notifications/',
+        (AsyncNotificationView if settings.ASYNC_READ_VIEWS else NotificationView).as_view(),
+        name='notifications',
+    ),
+    path(
+        'notifications/unseen-count/',
+        (AsyncUnseenNotificationCountView if settings.ASYNC_READ_VIEWS else UnseenNotificationCountView).as_view(),
+        name='unseen-notification-count',
+    ),
 ]
@@ -1,8 +1,9 @@
 from django.shortcuts import render
+from django.conf import settings
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from .serializers import UserSerializer, UserProfileSerializer, PublicUserSerializer, NotificationSerializer
+from .serializers import UserSerializer, UserProfileSerializer, PublicUserValuesSerializer, NotificationValuesSerializer, ClaimsTokenObtainPairSerializer
 from rest_framework_simplejwt.views import TokenObtainPairView
 from rest_framework.permissions import IsAuthenticated
 from django.contrib.auth.models import User
@@ -10,6 +11,15 @@ from .models import UserProfile, Notification
 from rest_framework.parsers import MultiPartParser, FormParser
 from django.db.models import Q, F, Value
 from django.db.models.functions import Concat, Lower
+from coverence.db_router import replica_reads
+from .authentication import StatelessJWTAuthentication
+from .avatars import absolute_url, avatar_url
+from .cards import get_user_cards
+from .images import stage_upload
+from .notifications import mark_notifications_seen
+from .profile_cache import cached_profile, profile_etag, profile_last_modified
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
 
 # -------------------- AUTHENTICATION -------------------- #
 
@@ -24,17 +34,31 @@ class SignUpView(APIView):
 
 
 class LoginView(TokenObtainPairView):
-    pass
+    serializer_class = ClaimsTokenObtainPairSerializer
 
 
 # -------------------- USER PROFILE -------------------- #
 
+def _own_profile_etag(request):
+    return profile_etag(request, request.user.id)
+
+
+def _own_profile_last_modified(request):
+    return profile_last_modified(request, request.user.id)
+
+
 class ProfileView(APIView):
+    authentication_classes = [StatelessJWTAuthentication]
     permission_classes = [IsAuthenticated]
     parser_classes = [MultiPartParser, FormParser]
 
+    @method_decorator(condition(etag_func=_own_profile_etag, last_modified_func=_own_profile_last_modified))
     def get(self, request):
-        user = request.user
+        user_id = request.user.id
+        return Response(cached_profile("own", user_id, lambda: self.build_profile(request, user_id)))
+
+    def build_profile(self, request, user_id):
+        user = User.objects.get(id=user_id)
         try:
             profile = user.userprofile
         except UserProfile.DoesNotExist:
@@ -42,31 +66,31 @@ class ProfileView(APIView):
 
         serializer = UserProfileSerializer(profile)
 
-        # Fix incomplete Cloudinary URL if needed
-        profile_image = serializer.data.get("profile_image")
-        if profile_image and not profile_image.startswith("http"):
-            profile_image = f"https://res.cloudinary.com/dsljowlpr/{profile_image}"
-
-        return Response({
+        return {
             "id": user.id,
             "first_name": user.first_name,
             "last_name": user.last_name,
             "email": user.email,
             "bio": serializer.data.get("bio"),
-            "profile_image": profile_image,
+            "profile_image": absolute_url(avatar_url(profile, "lg"), request),
             "skill_known": serializer.data.get("skill_known"),
             "skill_wanted": serializer.data.get("skill_wanted"),
             "available_time": serializer.data.get("available_time"),
-        })
+        }
 
     def put(self, request):
-        user = request.user
+        user = request.user.instance
         profile, _ = UserProfile.objects.get_or_create(user=user)
 
-        # Update User fields
-        user.first_name = request.data.get("first_name", user.first_name)
-        user.last_name = request.data.get("last_name", user.last_name)
-        user.save()
+        # Update User fields, writing only the columns that changed.
+        changed = []
+        for field in ("first_name", "last_name"):
+            value = request.data.get(field, getattr(user, field))
+            if value != getattr(user, field):
+                setattr(user, field, value)
+                changed.append(field)
+        if changed:
+            user.save(update_fields=changed)
 
         # Update Profile fields
         profile.bio = request.data.get("bio", profile.bio)
@@ -74,41 +98,84 @@ class ProfileView(APIView):
         profile.skill_wanted = request.data.get("skill_wanted", profile.skill_wanted)
         profile.available_time = request.data.get("available_time", profile.available_time)
 
-        if request.FILES.get("profile_image"):
-            profile.profile_image = request.FILES["profile_image"]
-
+        # Only the changed columns are written (see DirtyFieldsMixin); saves
+        # bump the profile version (see users.signals).
         profile.save()
 
+        # Renditions are produced in the background; the profile version is
+        # bumped again once they are stored.
+        if request.FILES.get("profile_image"):
+            stage_upload(user.id, request.FILES["profile_image"])
+
         return Response({"message": "Profile updated successfully"}, status=status.HTTP_200_OK)
 
 
 class PublicProfileView(APIView):
+    authentication_classes = [StatelessJWTAuthentication]
+
+    @method_decorator(condition(etag_func=profile_etag, last_modified_func=profile_last_modified))
     def get(self, request, user_id):
+        data = cached_profile("public", user_id, lambda: self.build_profile(request, user_id))
+        if data is None:
+            return Response({"detail": "Not found."}, status=404)
+        return Response(data)
+
+    def build_profile(self, request, user_id):
         try:
             user = User.objects.get(id=user_id)
             profile = user.userprofile
         except (User.DoesNotExist, UserProfile.DoesNotExist):
-            return Response({"detail": "Not found."}, status=404)
+            return None
 
-        data = {
+        return {
             "id": user.id,
             "first_name": user.first_name,
             "last_name": user.last_name,
             "email": user.email,
             "bio": profile.bio,
-            "profile_image": request.build_absolute_uri(profile.profile_image.url) if profile.profile_image else None,
+            "profile_image": absolute_url(avatar_url(profile, "lg"), request),
             "skill_known": profile.skill_known,
             "skill_wanted": profile.skill_wanted,
             "available_time": profile.available_time,
         }
-        return Response(data)
+
+
+class UserCardsView(APIView):
+    authentication_classes = [StatelessJWTAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        try:
+            user_ids = list(dict.fromkeys(int(user_id) for user_id in request.GET.get("ids", "").split(",") if user_id))
+        except ValueError:
+            return Response({"error": "ids must be a comma-separated list of user ids"}, status=status.HTTP_400_BAD_REQUEST)
+
+        if len(user_ids) > settings.USER_CARDS_BATCH_LIMIT:
+            return Response(
+                {"error": f"At most {settings.USER_CARDS_BATCH_LIMIT} ids per request"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        cards = get_user_cards(user_ids)
+        found = []
+        for user_id in user_ids:
+            if user_id in cards:
+                card = cards[user_id]
+                found.append({**card, "profile_image": absolute_url(card["profile_image"], request)})
+
+        return Response({
+            "cards": found,
+            "not_found": [user_id for user_id in user_ids if user_id not in cards],
+        })
 
 
 # -------------------- USER SEARCH -------------------- #
 
 class UserSearchAPIView(APIView):
+    authentication_classes = [StatelessJWTAuthentication]
     permission_classes = [IsAuthenticated]
 
+    @replica_reads
     def get(self, request):
         query = request.GET.get('q', '').strip().lower() 
 
@@ -129,8 +196,8 @@ class UserSearchAPIView(APIView):
                 Q(skill_wanted__icontains=query)
             ).exclude(id=request.user.id)
 
-            serializer = PublicUserSerializer(users, many=True, context={'request': request})
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            serializer = PublicUserValuesSerializer(context={'request': request})
+            return Response(serializer.serialize(users), status=status.HTTP_200_OK)
 
         except Exception as e:
             print(f"❌ Error in search: {e}")
@@ -140,21 +207,23 @@ class UserSearchAPIView(APIView):
 # -------------------- NOTIFICATIONS -------------------- #
 
 class NotificationView(APIView):
+    authentication_classes = [StatelessJWTAuthentication]
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        Notification.objects.filter(to_user=request.user, is_seen=False).update(is_seen=True)
-        notifications = Notification.objects.filter(to_user=request.user).order_by('-created_at')
-        serializer = NotificationSerializer(notifications, many=True, context={'request': request})
-        return Response(serializer.data)
+        mark_notifications_seen(request.user.id)
+        notifications = Notification.objects.filter(to_user_id=request.user.id).order_by('-created_at')
+        serializer = NotificationValuesSerializer(context={'request': request})
+        return Response(serializer.serialize(notifications))
     
 
 class UnseenNotificationCountView(APIView):
+    authentication_classes = [StatelessJWTAuthentication]
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
         user = request.user
-        unseen_total_count = Notification.objects.filter(to_user=user, is_seen=False).count()
+        unseen_total_count = Notification.objects.filter(to_user_id=user.id, is_seen=False).count()
         return Response({
             'unseen_count': unseen_total_count
         })